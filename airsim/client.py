@@ -2,6 +2,7 @@ from __future__ import print_function
 
 from .utils import *
 from .types import *
+from .instrumentation import InstrumentedRpcClient, RpcStats
 
 import msgpackrpc #install as admin: pip install msgpack-rpc-python
 import numpy as np #pip install numpy
@@ -11,10 +12,47 @@ import math
 import logging
 
 class VehicleClient:
-    def __init__(self, ip = "", port = 41451, timeout_value = 3600):
+    def __init__(self, ip = "", port = 41451, timeout_value = 3600, instrument = False):
         if (ip == ""):
             ip = "127.0.0.1"
         self.client = msgpackrpc.Client(msgpackrpc.Address(ip, port), timeout = timeout_value, pack_encoding = 'utf-8', unpack_encoding = 'utf-8')
+        self.rpc_stats = None
+        if instrument:
+            self.enableRpcInstrumentation(True)
+
+#----------------------------------- RPC instrumentation ---------------------------------------------
+    def enableRpcInstrumentation(self, enable = True):
+        """
+        Record call count, payload size and latency histogram for every RPC issued by this client
+
+        Args:
+            enable (bool, optional): True to start recording, False to remove the instrumentation layer
+        """
+        if enable and self.rpc_stats is None:
+            self.rpc_stats = RpcStats()
+            self.client = InstrumentedRpcClient(self.client, self.rpc_stats)
+        elif not enable and self.rpc_stats is not None:
+            if isinstance(self.client, InstrumentedRpcClient):
+                self.client = self.client.rpc
+            self.rpc_stats = None
+
+    def getRpcStats(self):
+        """
+        Snapshot of the statistics recorded since instrumentation was enabled
+
+        Returns:
+            dict: RPC name mapped to count, errors, latency (mean/p50/p95/max ms), bytes sent/received and histogram
+        """
+        if self.rpc_stats is None:
+            return {}
+        return self.rpc_stats.snapshot()
+
+    def resetRpcStats(self):
+        """
+        Clear the statistics recorded so far
+        """
+        if self.rpc_stats is not None:
+            self.rpc_stats.reset()
 
 #----------------------------------- Common vehicle APIs ---------------------------------------------
     def reset(self):
@@ -1115,8 +1153,8 @@ class VehicleClient:
 
 #----------------------------------- Multirotor APIs ---------------------------------------------
 class MultirotorClient(VehicleClient, object):
-    def __init__(self, ip = "", port = 41451, timeout_value = 3600):
-        super(MultirotorClient, self).__init__(ip, port, timeout_value)
+    def __init__(self, ip = "", port = 41451, timeout_value = 3600, instrument = False):
+        super(MultirotorClient, self).__init__(ip, port, timeout_value, instrument)
 
     def takeoffAsync(self, timeout_sec = 20, vehicle_name = ''):
         """
@@ -1583,8 +1621,8 @@ class MultirotorClient(VehicleClient, object):
 
 #----------------------------------- Car APIs ---------------------------------------------
 class CarClient(VehicleClient, object):
-    def __init__(self, ip = "", port = 41451, timeout_value = 3600):
-        super(CarClient, self).__init__(ip, port, timeout_value)
+    def __init__(self, ip = "", port = 41451, timeout_value = 3600, instrument = False):
+        super(CarClient, self).__init__(ip, port, timeout_value, instrument)
 
     def setCarControls(self, controls, vehicle_name = ''):
         """
@@ -0,0 +1,184 @@
+import bisect
+import threading
+import time
+
+# Upper bucket edges of the latency histograms in milliseconds
+LATENCY_BUCKETS_MS = (0.1, 0.2, 0.5, 1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, float('inf'))
+
+
+def payload_size(obj):
+    """
+    Estimate the msgpack size of an RPC argument or result in bytes.
+    Cheap enough to run on every call: lists of numbers are sized from their length.
+    """
+    if obj is None or isinstance(obj, bool):
+        return 1
+    if isinstance(obj, (bytes, bytearray, memoryview, str)):
+        return len(obj)
+    if isinstance(obj, (int, float)):
+        return 9
+    if isinstance(obj, (list, tuple)):
+        if obj and isinstance(obj[0], (int, float)):
+            return 9 * len(obj)
+        return sum(payload_size(item) for item in obj)
+    if isinstance(obj, dict):
+        return sum(payload_size(k) + payload_size(v) for k, v in obj.items())
+    if hasattr(obj, 'to_msgpack'):
+        return payload_size(obj.to_msgpack())
+    return 9
+
+
+class RpcMethodStats:
+    def __init__(self):
+        self.count = 0
+        self.errors = 0
+        self.completed = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+        self.bytes_sent = 0
+        self.bytes_received = 0
+        self.histogram = [0] * len(LATENCY_BUCKETS_MS)
+
+    def percentile(self, q):
+        """ Approximate latency percentile from the histogram (bucket upper edge) """
+        if self.completed == 0:
+            return 0.0
+        target = q * self.completed
+        seen = 0
+        for edge, n in zip(LATENCY_BUCKETS_MS, self.histogram):
+            seen += n
+            if seen >= target:
+                return min(edge, self.max_ms)
+        return self.max_ms
+
+    def to_dict(self):
+        return {
+            'count': self.count,
+            'errors': self.errors,
+            'completed': self.completed,
+            'not_completed': self.count - self.completed,
+            'total_ms': self.total_ms,
+            # No latency for calls that were never completed (e.g. async calls nobody joined)
+            'mean_ms': self.total_ms / self.completed if self.completed else None,
+            'p50_ms': self.percentile(0.5) if self.completed else None,
+            'p95_ms': self.percentile(0.95) if self.completed else None,
+            'max_ms': self.max_ms if self.completed else None,
+            'bytes_sent': self.bytes_sent,
+            'bytes_received': self.bytes_received,
+            'histogram': [[edge, n] for edge, n in zip(LATENCY_BUCKETS_MS, self.histogram) if n],
+        }
+
+
+class RpcStats:
+    """
+    Per RPC name call count, payload size and latency histogram.
+    Async calls are counted when issued; their latency is recorded when the future is first joined.
+    Fire-and-forget calls that are never joined stay in the not completed count and have no latency.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._methods = {}
+
+    def _get(self, method):
+        stats = self._methods.get(method)
+        if stats is None:
+            stats = self._methods[method] = RpcMethodStats()
+        return stats
+
+    def record_send(self, method, args):
+        size = payload_size(args)
+        with self._lock:
+            stats = self._get(method)
+            stats.count += 1
+            stats.bytes_sent += size
+
+    def record_result(self, method, latency_ms, result=None, failed=False):
+        size = 0 if failed else payload_size(result)
+        with self._lock:
+            stats = self._get(method)
+            stats.completed += 1
+            stats.total_ms += latency_ms
+            stats.max_ms = max(stats.max_ms, latency_ms)
+            stats.bytes_received += size
+            stats.histogram[bisect.bisect_left(LATENCY_BUCKETS_MS, latency_ms)] += 1
+            if failed:
+                stats.errors += 1
+
+    def reset(self):
+        with self._lock:
+            self._methods.clear()
+
+    def snapshot(self):
+        """ Return a dict mapping each RPC name to a dict of its statistics """
+        with self._lock:
+            return {method: stats.to_dict() for method, stats in self._methods.items()}
+
+    def summary(self):
+        """ Format the snapshot as a table sorted by total time spent """
+        rows = sorted(self.snapshot().items(), key=lambda kv: kv[1]['total_ms'], reverse=True)
+        lines = ["%-36s %7s %7s %10s %9s %9s %9s %12s" % (
+            "rpc", "count", "pending", "total_ms", "mean_ms", "p95_ms", "max_ms", "bytes_in")]
+        for method, s in rows:
+            if s['completed']:
+                latency = "%10.1f %9.2f %9.2f %9.2f" % (s['total_ms'], s['mean_ms'], s['p95_ms'], s['max_ms'])
+            else:
+                latency = "%10s %9s %9s %9s" % ("n/a", "n/a", "n/a", "n/a")
+            lines.append("%-36s %7d %7d %s %12d" % (
+                method, s['count'], s['not_completed'], latency, s['bytes_received']))
+        return "\n".join(lines)
+
+
+class _InstrumentedFuture:
+    def __init__(self, future, method, stats, start):
+        self._future = future
+        self._method = method
+        self._stats = stats
+        self._start = start
+        self._recorded = False
+
+    def _finish(self, result=None, failed=False):
+        if not self._recorded:
+            self._recorded = True
+            self._stats.record_result(self._method, (time.perf_counter() - self._start) * 1000.0, result, failed)
+
+    def join(self):
+        self._future.join()
+        self._finish()
+
+    def get(self):
+        try:
+            result = self._future.get()
+        except Exception:
+            self._finish(failed=True)
+            raise
+        self._finish(result)
+        return result
+
+    def __getattr__(self, name):
+        return getattr(self._future, name)
+
+
+class InstrumentedRpcClient:
+    """ Proxy around msgpackrpc.Client feeding every call into an RpcStats instance """
+    def __init__(self, rpc, stats):
+        self.rpc = rpc
+        self.stats = stats
+
+    def call(self, method, *args):
+        self.stats.record_send(method, args)
+        start = time.perf_counter()
+        try:
+            result = self.rpc.call(method, *args)
+        except Exception:
+            self.stats.record_result(method, (time.perf_counter() - start) * 1000.0, failed=True)
+            raise
+        self.stats.record_result(method, (time.perf_counter() - start) * 1000.0, result)
+        return result
+
+    def call_async(self, method, *args):
+        self.stats.record_send(method, args)
+        start = time.perf_counter()
+        return _InstrumentedFuture(self.rpc.call_async(method, *args), method, self.stats, start)
+
+    def __getattr__(self, name):
+        return getattr(self.rpc, name)
@@ -1,85 +1,211 @@
-import numpy as np
-import matplotlib.pyplot as plt
-import re
+"""
+Reading and writing PFM (portable float map) images.
+
+read_pfm parses the header and memory-maps the payload, so large depth or
+flow archives are only paged in as they are accessed.  PfmSequenceWriter and
+PfmSequenceReader store many frames in one file as back-to-back PFM records
+(the first record on its own is a valid .pfm file), which suits streaming
+depth recordings.
+"""
+import mmap
+import os
 import sys
-import pdb
-
-
-def read_pfm(file):
-    """ Read a pfm file """
-    file = open(file, 'rb')
 
-    color = None
-    width = None
-    height = None
-    scale = None
-    endian = None
-
-    header = file.readline().rstrip()
-    header = str(bytes.decode(header, encoding='utf-8'))
-    if header == 'PF':
-        color = True
-    elif header == 'Pf':
-        color = False
-    else:
-        raise Exception('Not a PFM file.')
-
-    pattern = r'^(\d+)\s(\d+)\s$'
-    temp_str = str(bytes.decode(file.readline(), encoding='utf-8'))
-    dim_match = re.match(pattern, temp_str)
-    if dim_match:
-        width, height = map(int, dim_match.groups())
-    else:
-        temp_str += str(bytes.decode(file.readline(), encoding='utf-8'))
-        dim_match = re.match(pattern, temp_str)
-        if dim_match:
-            width, height = map(int, dim_match.groups())
-        else:
-            raise Exception('Malformed PFM header: width, height cannot be found')
-
-    scale = float(file.readline().rstrip())
-    if scale < 0: # little-endian
-        endian = '<'
-        scale = -scale
-    else:
-        endian = '>' # big-endian
-
-    data = np.fromfile(file, endian + 'f')
-    shape = (height, width, 3) if color else (height, width)
-
-    data = np.reshape(data, shape)
-    # DEY: I don't know why this was there.
-    file.close()
-    
-    return data, scale
-
-
-def write_pfm(file, image, scale=1):
-    """ Write a pfm file """
-    file = open(file, 'wb')
+import numpy as np
 
-    color = None
 
+def _parse_header(buf, offset=0):
+    """
+    Parse the PFM header starting at offset of a bytes-like buffer.
+    Returns (shape, dtype, scale, payload_offset).
+    """
+    fields = []
+    pos = offset
+    # The header is three whitespace separated lines: type, "width height",
+    # scale.  Some writers put width and height on separate lines.
+    while len(fields) < 4:
+        end = buf.find(b'\n', pos)
+        if end < 0:
+            raise EOFError('Malformed PFM header: unexpected end of file')
+        fields.extend(bytes(buf[pos:end]).decode('utf-8').split())
+        pos = end + 1
+        if len(fields) == 1 and fields[0] not in ('PF', 'Pf'):
+            raise ValueError('Not a PFM file.')
+    kind, width, height, scale = fields[:4]
+    if not (width.isdigit() and height.isdigit()):
+        raise ValueError('Malformed PFM header: width, height cannot be found')
+    width, height, scale = int(width), int(height), float(scale)
+    endian = '<' if scale < 0 else '>'
+    shape = (height, width, 3) if kind == 'PF' else (height, width)
+    return shape, np.dtype(endian + 'f4'), abs(scale), pos
+
+
+def _header(image, scale=1):
+    """Header bytes for image; raises for unsupported dtypes or shapes."""
     if image.dtype.name != 'float32':
-        raise Exception('Image dtype must be float32.')
-
+        raise ValueError('Image dtype must be float32.')
     if len(image.shape) == 3 and image.shape[2] == 3: # color image
         color = True
-    elif len(image.shape) == 2 or len(image.shape) == 3 and image.shape[2] == 1: # greyscale
+    elif len(image.shape) == 2 or len(image.shape) == 3 and image.shape[2] == 1: # grayscale
         color = False
     else:
-        raise Exception('Image must have H x W x 3, H x W x 1 or H x W dimensions.')
-
-    file.write(bytes('PF\n', 'UTF-8') if color else bytes('Pf\n', 'UTF-8'))
-    temp_str = '%d %d\n' % (image.shape[1], image.shape[0])
-    file.write(bytes(temp_str, 'UTF-8'))
+        raise ValueError('Image must have H x W x 3, H x W x 1 or H x W dimensions.')
 
     endian = image.dtype.byteorder
-
     if endian == '<' or endian == '=' and sys.byteorder == 'little':
         scale = -scale
+    return ('PF\n' if color else 'Pf\n').encode('utf-8') + \
+        ('%d %d\n' % (image.shape[1], image.shape[0])).encode('utf-8') + \
+        ('%f\n' % scale).encode('utf-8')
+
+
+def read_pfm(file, mmap_mode='r'):
+    """
+    Read a pfm file.  Returns (data, scale).
+    With mmap_mode (the default) data is a read-only np.memmap of the payload;
+    pass mmap_mode=None to read it into memory.
+    """
+    with open(file, 'rb') as f:
+        head = f.read(256)
+    shape, dtype, scale, offset = _parse_header(head)
+    if mmap_mode is None:
+        with open(file, 'rb') as f:
+            f.seek(offset)
+            data = np.fromfile(f, dtype, count=int(np.prod(shape)))
+        return data.reshape(shape), scale
+    return np.memmap(file, dtype=dtype, mode=mmap_mode, offset=offset, shape=shape), scale
 
-    temp_str = '%f\n' % scale
-    file.write(bytes(temp_str, 'UTF-8'))
 
-    image.tofile(file)
+def write_pfm(file, image, scale=1):
+    """
+    Write a pfm file.  file is a path or a binary file object opened for
+    writing (used by the batch and sequence writers).
+    """
+    header = _header(image, scale)
+    if hasattr(file, 'write'):
+        file.write(header)
+        file.write(np.ascontiguousarray(image).tobytes())
+        return
+    with open(file, 'wb') as f:
+        f.write(header)
+        image.tofile(f)
+
+
+def write_pfm_batch(files, images, scale=1):
+    """
+    Write each image to the corresponding path.
+    The header is built once per distinct shape and dtype.
+    """
+    headers = {}
+    for file, image in zip(files, images):
+        key = (image.shape, image.dtype.str)
+        if key not in headers:
+            headers[key] = _header(image, scale)
+        with open(file, 'wb') as f:
+            f.write(headers[key])
+            image.tofile(f)
+
+
+class PfmSequenceWriter:
+    """
+    Append frames to a multi-frame PFM container.
+    The file is opened for appending, so a recording can be continued and a
+    reader can pick up new frames with refresh().
+    """
+
+    def __init__(self, path, scale=1):
+        self.path = path
+        self.scale = scale
+        self.count = 0
+        self._headers = {}
+        self._file = open(path, 'ab')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def append(self, image):
+        key = (image.shape, image.dtype.str)
+        if key not in self._headers:
+            self._headers[key] = _header(image, self.scale)
+        self._file.write(self._headers[key])
+        self._file.write(np.ascontiguousarray(image).tobytes())
+        self.count += 1
+
+    def extend(self, images):
+        for image in images:
+            self.append(image)
+
+    def flush(self):
+        self._file.flush()
+
+    def close(self):
+        if not self._file.closed:
+            self._file.close()
+
+
+class PfmSequenceReader:
+    """
+    Lazily read frames of a multi-frame PFM container (or a single .pfm).
+    The file is memory-mapped once; indexing returns read-only views into it.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._file = None
+        self._map = None
+        self._index = []  # (offset, shape, dtype, scale) per frame
+        self.refresh()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def refresh(self):
+        """Re-map the file and index frames appended since the last call."""
+        size = os.path.getsize(self.path)
+        if size == 0:
+            return self
+        if self._map is None or len(self._map) < size:
+            self.close()
+            self._file = open(self.path, 'rb')
+            self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        pos = 0
+        if self._index:
+            offset, shape, dtype, _ = self._index[-1]
+            pos = offset + int(np.prod(shape)) * dtype.itemsize
+        while pos < size:
+            try:
+                shape, dtype, scale, offset = _parse_header(self._map, pos)
+            except EOFError:  # header still being written
+                break
+            end = offset + int(np.prod(shape)) * dtype.itemsize
+            if end > size:  # frame still being written
+                break
+            self._index.append((offset, shape, dtype, scale))
+            pos = end
+        return self
+
+    def __len__(self):
+        return len(self._index)
+
+    def __getitem__(self, index):
+        offset, shape, dtype, _ = self._index[index]
+        return np.frombuffer(self._map, dtype, count=int(np.prod(shape)), offset=offset).reshape(shape)
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def scale(self, index):
+        return self._index[index][3]
+
+    def close(self):
+        self._map = None
+        if self._file is not None:
+            self._file.close()
+            self._file = None
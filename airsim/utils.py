@@ -1,28 +1,59 @@
 import numpy as np #pip install numpy
+import array
 import math
 import time
 import sys
 import os
 import inspect
 import types
-import re
 import logging
 
 from .types import *
+from .pfm import read_pfm, write_pfm
 
 
 def string_to_uint8_array(bstr):
-    return np.fromstring(bstr, np.uint8)
+    return np.frombuffer(bstr, np.uint8)
     
 def string_to_float_array(bstr):
-    return np.fromstring(bstr, np.float32)
+    return np.frombuffer(bstr, np.float32)
+
+def to_float_array(data):
+    """
+    float32 array of an image_data_float payload.
+    Binary payloads (bytes, bytearray, memoryview) are viewed without copying;
+    the list of floats AirSim sends is packed once through array.array, which
+    is several times faster than np.asarray on a list.
+    """
+    if isinstance(data, np.ndarray):
+        return data.astype(np.float32, copy=False).ravel()
+    if isinstance(data, (bytes, bytearray, memoryview)):
+        return np.frombuffer(data, np.float32)
+    return np.frombuffer(array.array('f', data), np.float32)
     
 def list_to_2d_float_array(flst, width, height):
-    return np.reshape(np.asarray(flst, np.float32), (height, width))
+    return to_float_array(flst).reshape(height, width)
     
 def get_pfm_array(response):
     return list_to_2d_float_array(response.image_data_float, response.width, response.height)
 
+def get_flow_array(response):
+    """
+    (H, W, 2) float32 array of an ImageType.OpticalFlow response requested
+    with pixels_as_float
+    """
+    return to_float_array(response.image_data_float).reshape(response.height, response.width, -1)
+
+def get_point_cloud(lidar_data):
+    """
+    (N, 3) float32 array of LidarData.point_cloud.
+    AirSim sends [0.0] when there are no points; that gives an empty array.
+    """
+    points = to_float_array(lidar_data.point_cloud)
+    if points.size < 3:
+        return np.empty((0, 3), np.float32)
+    return points[:points.size - points.size % 3].reshape(-1, 3)
+
     
 def get_public_fields(obj):
     return [attr for attr in dir(obj)
@@ -124,80 +155,6 @@ def wait_key(message = ''):
     return result
 
     
-def read_pfm(file):
-    """ Read a pfm file """
-    file = open(file, 'rb')
-
-    color = None
-    width = None
-    height = None
-    scale = None
-    endian = None
-
-    header = file.readline().rstrip()
-    header = str(bytes.decode(header, encoding='utf-8'))
-    if header == 'PF':
-        color = True
-    elif header == 'Pf':
-        color = False
-    else:
-        raise Exception('Not a PFM file.')
-
-    temp_str = str(bytes.decode(file.readline(), encoding='utf-8'))
-    dim_match = re.match(r'^(\d+)\s(\d+)\s$', temp_str)
-    if dim_match:
-        width, height = map(int, dim_match.groups())
-    else:
-        raise Exception('Malformed PFM header.')
-
-    scale = float(file.readline().rstrip())
-    if scale < 0: # little-endian
-        endian = '<'
-        scale = -scale
-    else:
-        endian = '>' # big-endian
-
-    data = np.fromfile(file, endian + 'f')
-    shape = (height, width, 3) if color else (height, width)
-
-    data = np.reshape(data, shape)
-    # DEY: I don't know why this was there.
-    file.close()
-    
-    return data, scale
-
-    
-def write_pfm(file, image, scale=1):
-    """ Write a pfm file """
-    file = open(file, 'wb')
-
-    color = None
-
-    if image.dtype.name != 'float32':
-        raise Exception('Image dtype must be float32.')
-
-    if len(image.shape) == 3 and image.shape[2] == 3: # color image
-        color = True
-    elif len(image.shape) == 2 or len(image.shape) == 3 and image.shape[2] == 1: # grayscale
-        color = False
-    else:
-        raise Exception('Image must have H x W x 3, H x W x 1 or H x W dimensions.')
-
-    file.write('PF\n'.encode('utf-8')  if color else 'Pf\n'.encode('utf-8'))
-    temp_str = '%d %d\n' % (image.shape[1], image.shape[0])
-    file.write(temp_str.encode('utf-8'))
-
-    endian = image.dtype.byteorder
-
-    if endian == '<' or endian == '=' and sys.byteorder == 'little':
-        scale = -scale
-
-    temp_str = '%f\n' % scale
-    file.write(temp_str.encode('utf-8'))
-
-    image.tofile(file)
-
-    
 def write_png(filename, image):
     """ image must be numpy array H X W X channels
     """
@@ -1,300 +1,252 @@
 import airsim
+import argparse
 import cv2
-import numpy as np
 import time
-from datetime import datetime
 import os
+import json
 import subprocess
 from airsim import ImageRequest, ImageType
 
+from uav.control import ControlServer, ThroughputMeter, install_signal_handlers
 from uav.interface import exit_flag, start_gui
 from uav.navigation import Navigator
-from uav.utils import get_drone_state, partition_roi
-from uav.perception import FlowHistory
-from uav.logging import debug_print
-from sparse_optical_flow_utils import initialize_sparse_features, track_and_detect_obstacle
-
-# GUI state holder
-param_refs = {
-    'state': [''],
-    'reset_flag': [False]
-}
-start_gui(param_refs)
+from uav.decision import DepthConfirmer, NavigationPolicy, ObstacleDetector
+from uav.egomotion import EgoMotionCompensator, GyroDerotator
+from uav.pipeline import SCHEDULERS, Pipeline, default_stages
+from uav.trace import TRACE_OUTPUT, trace_rpc, tracer
+from uav.lockstep import LockstepDriver
+from uav.startup import SimulatorNotReady, wait_for_simulator, warm_up
+from sparse_optical_flow_utils import SparseFlowTracker
 
 # Display debug images if environment variable is set
 DEBUG_DISPLAY = os.environ.get("DEBUG_DISPLAY", "0") == "1"
+# Record per-RPC latency histograms and print them in the run summary
+RPC_STATS = os.environ.get("RPC_STATS", "0") == "1"
+# Store raw grayscale frames, kinematics and commands for offline replay
+RECORD_SESSION = os.environ.get("RECORD_SESSION", "0") == "1"
+# Advance the paused simulation by this many sim seconds per frame (0 = real time)
+LOCKSTEP = float(os.environ.get("LOCKSTEP", "0"))
+# Seconds to wait for the simulator RPC server to answer after launch
+SIM_STARTUP_TIMEOUT = float(os.environ.get("SIM_STARTUP_TIMEOUT", "60"))
+# Reset episodes by teleporting to the start pose instead of landing and taking off
+FAST_RESET = os.environ.get("FAST_RESET", "0") == "1"
+# How pipeline stages are executed: serial, threaded or process
+PIPELINE_SCHEDULER = os.environ.get("PIPELINE_SCHEDULER", "serial")
+# Confirm or veto flow obstacles with a depth image batched into the image request
+DEPTH_CHECK = os.environ.get("DEPTH_CHECK", "0") == "1"
+# Centre clearance (m) beyond which a flow obstacle is vetoed
+DEPTH_VETO_M = float(os.environ.get("DEPTH_VETO_M", "8"))
+# LiDAR sensor fused per ROI partition with the flow decision ("" = disabled)
+LIDAR_NAME = os.environ.get("LIDAR_NAME", "")
+# Centre range (m) below which LiDAR or depth reports an obstacle without flow (0 = off)
+RANGE_TRIGGER_M = float(os.environ.get("RANGE_TRIGGER_M", "0"))
+# What triggers a brake: flow (magnitude threshold), ttc (time to contact) or either
+BRAKE_ON = os.environ.get("BRAKE_ON", "flow")
+# Centre time to contact (s) below which BRAKE_ON=ttc/either reports an obstacle
+TTC_BRAKE_S = float(os.environ.get("TTC_BRAKE_S", "2"))
+# Remove global rotational flow before partition averaging: "", homography, affine
+# or gyro (predicted from the body rates and the camera intrinsics, no image fit)
+EGO_MOTION = os.environ.get("EGO_MOTION", "")
+# RANSAC iteration bound of the ego-motion fit (fixed cost per frame)
+EGO_MOTION_ITERS = int(os.environ.get("EGO_MOTION_ITERS", "100"))
+# IMU read for EGO_MOTION=gyro ("" = angular velocity of the vehicle state)
+IMU_NAME = os.environ.get("IMU_NAME", "")
+# Run without GUI, overlay video or debug window (batch servers)
+HEADLESS = os.environ.get("HEADLESS", "0") == "1"
+# Local TCP port accepting stop/reset/status commands (0 = disabled)
+CONTROL_PORT = int(os.environ.get("CONTROL_PORT", "0"))
 
-# === Launch Unreal Engine simulation ===
 # Path to the Blocks executable. This can be overridden by setting the
 # BLOCKS_EXE_PATH environment variable.
-ue4_exe = os.environ.get(
+UE4_EXE = os.environ.get(
     "BLOCKS_EXE_PATH",
     r"C:\Users\newso\Documents\AirSimExperiments\BlocksBuild\WindowsNoEditor\Blocks\Binaries\Win64\Blocks.exe",
 )
-sim_process = None
-try:
-    sim_process = subprocess.Popen([ue4_exe, "-windowed", "-ResX=1280", "-ResY=720"])
-    print("Launching Unreal Engine simulation...")
-    time.sleep(5)
-except Exception as e:
-    print("Failed to launch UE4:", e)
-
-client = airsim.MultirotorClient()
-client.confirmConnection()
-print("Connected!")
-client.enableApiControl(True)
-client.armDisarm(True)
-client.takeoffAsync().join()
-client.moveToPositionAsync(0, 0, -2, 2).join()
-
-navigator = Navigator(client)
 
 GRACE_FRAMES = 10  # ignore obstacle logic for startup period
 MIN_FLOW_THRESHOLD = 1.0  # ignore jitter below this flow magnitude
 NO_FEATURE_LIMIT = 10
-no_feature_frames = 0
 PARTITIONS = 3
 SAFE_FRAMES = 5  # frames without obstacles before resuming after a brake
-safe_counter = 0
-flow_history = FlowHistory(alpha=0.5)
-smooth_L = smooth_C = smooth_R = 0.0
-
-frame_count = 0
-start_time = time.time()
-prev_time = None
-prev_vel = None
-timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-os.makedirs("flow_logs", exist_ok=True)
-log_file = open(f"flow_logs/sparse_log_{timestamp}.csv", 'w')
-log_file.write(
-    "frame,abs_time,rel_time,pos_x,pos_y,pos_z,yaw,vx,vy,vz,speed,obstacle_detected,features_detected,flow_left,flow_center,flow_right,state,safe_counter\n"
-)
-
-# Sparse optical flow state
-prev_gray_sparse = None
-prev_pts = None
-roi = [60, 60, 580, 420]  # wider and more forgiving ROI
-roi_parts = partition_roi(roi, PARTITIONS)
-
-# Video writer
-fourcc = cv2.VideoWriter_fourcc(*'MJPG')
-out = cv2.VideoWriter('sparse_flow_output.avi', fourcc, 8.0, (640, 480))
-
-try:
-    while not exit_flag[0]:
-        frame_count += 1
-        # Reset flow history on first frame
-        if frame_count == 1:
-            flow_history = FlowHistory(alpha=0.5)
-        time_now = time.time()
-        dt = 0.0 if prev_time is None else time_now - prev_time
-        prev_time = time_now
-        pos, yaw, speed, vel = get_drone_state(client)
-
-        responses = client.simGetImages([
-            ImageRequest("oakd_camera", ImageType.Scene, False, True)
-        ])
-        response = responses[0]
-        if response.width == 0 or len(response.image_data_uint8) == 0:
-            print("⚠️ Empty image response")
-            continue
-
-        img1d = np.frombuffer(response.image_data_uint8, dtype=np.uint8)
-        img = cv2.imdecode(img1d, cv2.IMREAD_COLOR)
-        if img is None:
-            print("❌ Failed to decode image")
-            continue
-
-        debug_print(f"🖼 Frame {frame_count} captured and decoded")
-        img = cv2.resize(img, (640, 480))
-        gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
-        vis_img = img.copy()
-        good_old = np.empty((0, 2), dtype=np.float32)
-        good_new = np.empty((0, 2), dtype=np.float32)
-        part_flows = [0.0] * PARTITIONS
-
-        # Sparse flow detection
-        obstacle_sparse = False
-        features_detected = 0
-        if prev_gray_sparse is None:
-            prev_gray_sparse = gray
-            prev_pts = initialize_sparse_features(prev_gray_sparse)
-            if prev_pts is not None:
-                features_detected = len(prev_pts)
-                debug_print(f"🔍 Initialized {features_detected} features")
-            debug_print("🔧 First grayscale frame set")
-        else:
-            prev_pts, good_old, good_new, part_flows = track_and_detect_obstacle(
-                prev_gray_sparse,
-                gray,
-                prev_pts,
-                roi,
-                partitions=PARTITIONS,
-                dt=dt,
-                drone_speed=speed,
-                displacement_threshold=2.5,
-            )
-
-            prev_gray_sparse = gray.copy()
-            if prev_pts is not None:
-                features_detected = len(prev_pts)
-                if features_detected < 10:
-                    debug_print("🔁 Too few features — reinitializing")
-                    prev_pts = initialize_sparse_features(prev_gray_sparse)
-                    if prev_pts is not None:
-                        features_detected = len(prev_pts)
-
-        debug_print(f"📈 Features detected: {features_detected}")
-        if features_detected == 0:
-            no_feature_frames += 1
-        else:
-            no_feature_frames = 0
-
-        if part_flows:
-            flow_history.update(*part_flows)
-        smooth_L, smooth_C, smooth_R = flow_history.average()
-        debug_print(
-            f"[DEBUG] smoothed flows L/C/R: {smooth_L:.2f}, "
-            f"{smooth_C:.2f}, {smooth_R:.2f}"
-        )
-
-        if no_feature_frames >= NO_FEATURE_LIMIT:
-            debug_print("❌ No features for several frames — resetting tracker")
-            prev_gray_sparse = gray
-            prev_pts = initialize_sparse_features(prev_gray_sparse)
-            no_feature_frames = 0
+ROI = [60, 60, 580, 420]  # wider and more forgiving ROI
 
-        # threshold = max(MIN_FLOW_THRESHOLD, 2.5 * max(speed, 0.2))
-        # Determine threshold first
-        if frame_count < GRACE_FRAMES:
-            threshold = float('inf')
-        else:
-            threshold = 350.0  # keep it fixed for now
-
-        # Then calculate corridor condition
-        corridor = (
-            smooth_C <= threshold
-            and smooth_L > threshold
-            and smooth_R > threshold
-        )
 
-        # Obstacle decision logic
-        if frame_count < GRACE_FRAMES:
-            obstacle_sparse = False
-        else:
-            if smooth_C > threshold:
-                if corridor:
-                    obstacle_sparse = False
-                else:
-                    obstacle_sparse = True
-            else:
-                obstacle_sparse = False
-
-        # Navigation
-        state_str = "forward"
-        if obstacle_sparse:
-            safe_counter = 0
-            state_str = navigator.dodge(smooth_L, smooth_C, smooth_R)
-        else:
-            if navigator.braked or navigator.dodging:
-                safe_counter += 1
-                debug_print(f"[DEBUG] clear frames: {safe_counter}/{SAFE_FRAMES}")
-
-                if safe_counter >= SAFE_FRAMES:
-                    state_str = navigator.resume_forward()
-                    safe_counter = 0
-                else:
-                    if navigator.braked:
-                        state_str = navigator.brake()
-                    else:
-                        state_str = "dodge"
-            else:
-                state_str = navigator.blind_forward()
+def launch_simulator():
+    """Launch Blocks and wait until it answers.  Returns ``(process, startup)``."""
+    sim_process = None
+    try:
+        sim_process = subprocess.Popen([UE4_EXE, "-windowed", "-ResX=1280", "-ResY=720"])
+        print("Launching Unreal Engine simulation...")
+    except Exception as e:
+        print("Failed to launch UE4:", e)
 
+    try:
+        startup = wait_for_simulator(deadline=SIM_STARTUP_TIMEOUT, process=sim_process)
+    except SimulatorNotReady as e:
+        print("❌ Simulator not ready:", e)
+        if sim_process:
+            sim_process.terminate()
+        raise SystemExit(1)
+    print(f"Simulator ready after {startup['ready_s']:.2f}s ({startup['attempts']} probes)")
+    return sim_process, startup
+
+
+def take_off(client):
+    client.enableApiControl(True)
+    client.armDisarm(True)
+    client.takeoffAsync().join()
+    client.moveToPositionAsync(0, 0, -2, 2).join()
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Reactive optical flow navigation in AirSim")
+    parser.add_argument('--headless', action='store_true', default=HEADLESS,
+                        help="no GUI, overlay video or debug window; stop/reset via signals or --control-port")
+    parser.add_argument('--control-port', type=int, default=CONTROL_PORT,
+                        help="local TCP port for stop/reset/status commands (0 = disabled)")
+    parser.add_argument('--scheduler', choices=sorted(SCHEDULERS), default=PIPELINE_SCHEDULER)
+    parser.add_argument('--report-interval', type=float, default=10.0,
+                        help="seconds between throughput lines in headless mode (0 = off)")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    debug_display = DEBUG_DISPLAY and not args.headless
+    # GUI state holder
+    param_refs = {
+        'state': [''],
+        'reset_flag': [False]
+    }
+    if args.headless:
+        install_signal_handlers(exit_flag, param_refs['reset_flag'])
+    else:
+        start_gui(param_refs)
+
+    launch_time = time.monotonic()
+    sim_process, startup = launch_simulator()
+
+    client = airsim.MultirotorClient(instrument=RPC_STATS)
+    if tracer.enabled:
+        trace_rpc(client)
+    client.confirmConnection()
+    print("Connected!")
+    # Warm up the RPC path and renderer before the loop's first frame
+    _, first_frame_s = warm_up(client, [ImageRequest("oakd_camera", ImageType.Scene, False, True)])
+    startup['first_frame_s'] = time.monotonic() - launch_time
+    tracer.instant("first_frame", **startup)
+    print(f"Time to first frame: {startup['first_frame_s']:.2f}s (image warm-up {first_frame_s:.2f}s)")
+    take_off(client)
+    start_pose = client.simGetVehiclePose()
+
+    navigator = Navigator(client, blocking=not LOCKSTEP)
+    lockstep = LockstepDriver(client, step=LOCKSTEP)
+    detector = ObstacleDetector(threshold=350.0, grace_frames=GRACE_FRAMES, alpha=0.5)
+    policy = NavigationPolicy(navigator, safe_frames=SAFE_FRAMES)
+    compensator = None
+    if EGO_MOTION == "gyro":
+        compensator = GyroDerotator.from_camera(client, "oakd_camera")
+    elif EGO_MOTION:
+        compensator = EgoMotionCompensator(EGO_MOTION, EGO_MOTION_ITERS)
+    tracker = SparseFlowTracker(ROI, partitions=PARTITIONS, no_feature_limit=NO_FEATURE_LIMIT,
+                                displacement_threshold=2.5, compensator=compensator)
+    range_confirmer = None
+    if DEPTH_CHECK or LIDAR_NAME:
+        range_confirmer = DepthConfirmer(ROI, PARTITIONS, veto_depth=DEPTH_VETO_M,
+                                         trigger_depth=RANGE_TRIGGER_M or None)
+
+    def on_state(state_str):
         param_refs['state'][0] = state_str
 
-        # Overlay
-        debug_print(
-            f"🛰️ Pos({pos.x_val:.2f}, {pos.y_val:.2f}, {pos.z_val:.2f}) "
-            f"Speed: {speed:.2f} m/s State: {state_str}"
-        )
-        if state_str == "blind_forward" and speed < 0.1:
-            debug_print("⚠️ Blind forward but speed is low — possible premature brake")
-        cv2.rectangle(vis_img, (roi[0], roi[1]), (roi[2], roi[3]), (255, 0, 0), 1)
-        for part in roi_parts:
-            cv2.rectangle(vis_img, (part[0], part[1]), (part[2], part[3]), (0, 0, 255), 1)
-        if obstacle_sparse:
-            cv2.putText(vis_img, "Obstacle!", (400, 30), cv2.FONT_HERSHEY_SIMPLEX, 0.7, (0, 0, 255), 2)
-
-        cv2.putText(vis_img, f"Frame: {frame_count}", (10, 25), cv2.FONT_HERSHEY_SIMPLEX, 0.7, (255,255,255), 2)
-        cv2.putText(vis_img, f"Speed: {speed:.2f}", (10, 55), cv2.FONT_HERSHEY_SIMPLEX, 0.7, (255,255,255), 2)
-        cv2.putText(vis_img, f"State: {state_str}", (10, 85), cv2.FONT_HERSHEY_SIMPLEX, 0.7, (255,255,255), 2)
-        cv2.putText(vis_img, f"Sim Time: {time_now-start_time:.2f}s", (10, 115), cv2.FONT_HERSHEY_SIMPLEX, 0.7, (255,255,255), 2)
-        cv2.putText(vis_img, f"Features: {features_detected}", (10, 145), cv2.FONT_HERSHEY_SIMPLEX, 0.7, (255,255,255), 2)
-        cv2.putText(vis_img, f"Flow L: {smooth_L:.2f}", (10, 175), cv2.FONT_HERSHEY_SIMPLEX, 0.7, (255,255,255), 2)
-        cv2.putText(vis_img, f"Flow C: {smooth_C:.2f}", (10, 205), cv2.FONT_HERSHEY_SIMPLEX, 0.7, (255,255,255), 2)
-        cv2.putText(vis_img, f"Flow R: {smooth_R:.2f}", (10, 235), cv2.FONT_HERSHEY_SIMPLEX, 0.7, (255,255,255), 2)
-
-        # Draw flow vectors
-        for pt_old, pt_new in zip(good_old, good_new):
-            x1, y1 = pt_old.ravel()
-            x2, y2 = pt_new.ravel()
-            cv2.arrowedLine(vis_img, (int(x1), int(y1)), (int(x2), int(y2)), (0, 255, 0), 1, tipLength=0.3)
-            cv2.circle(vis_img, (int(x2), int(y2)), 2, (0, 255, 0), -1)
-
-        if DEBUG_DISPLAY and prev_pts is not None:
-            for p in prev_pts:
-                x, y = p.ravel()
-                cv2.circle(vis_img, (int(x), int(y)), 2, (0, 255, 0), -1)
-            cv2.imshow("debug", vis_img)
-            cv2.waitKey(1)
-
-        out.write(vis_img)
-        elapsed = time_now - start_time
-        log_file.write(
-            f"{frame_count},{time_now:.2f},{elapsed:.2f},"
-            f"{pos.x_val:.2f},{pos.y_val:.2f},{pos.z_val:.2f},"
-            f"{yaw:.2f},{vel.x_val:.2f},{vel.y_val:.2f},{vel.z_val:.2f},{speed:.2f},"
-            f"{obstacle_sparse},{features_detected},"
-            f"{smooth_L:.2f},{smooth_C:.2f},{smooth_R:.2f},{state_str},{safe_counter}\n"
-        )
-
-        if param_refs['reset_flag'][0]:
-            print("🔄 Resetting simulation...")
+    def reset_simulation():
+        print("🔄 Resetting simulation...")
+        reset_start = time.monotonic()
+        if FAST_RESET:
+            # Teleport works while paused, so lockstep mode stays engaged
+            navigator.teleport(start_pose)
+        else:
+            lockstep.stop()
             client.landAsync().join()
             client.reset()
-            client.enableApiControl(True)
-            client.armDisarm(True)
-            client.takeoffAsync().join()
-            client.moveToPositionAsync(0, 0, -2, 2).join()
-            prev_gray_sparse = None
-            prev_pts = None
-            frame_count = 0
-            param_refs['reset_flag'][0] = False
-            log_file.close()
-            timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-            log_file = open(f"flow_logs/sparse_log_{timestamp}.csv", 'w')
-            log_file.write(
-                "frame,abs_time,rel_time,pos_x,pos_y,pos_z,yaw,vx,vy,vz,speed,obstacle_detected,features_detected,flow_left,flow_center,flow_right,state,safe_counter\n"
-            )
-            out.release()
-            out = cv2.VideoWriter('sparse_flow_output.avi', fourcc, 8.0, (640, 480))
-
-except KeyboardInterrupt:
-    print("Interrupted.")
+            take_off(client)
+            if LOCKSTEP:
+                lockstep.start()
+        param_refs['reset_flag'][0] = False
+        print(f"Reset took {time.monotonic() - reset_start:.2f}s")
+
+    stages = default_stages(client, tracker, detector, policy, ROI, PARTITIONS,
+                            lockstep=lockstep, record_session=RECORD_SESSION,
+                            debug_display=debug_display, on_state=on_state,
+                            headless=args.headless,
+                            depth_confirmer=range_confirmer if DEPTH_CHECK else None,
+                            lidar_name=LIDAR_NAME or None, lidar_confirmer=range_confirmer,
+                            brake_on=BRAKE_ON, brake_ttc=TTC_BRAKE_S, grace_frames=GRACE_FRAMES,
+                            imu_name=IMU_NAME or None)
+    pipeline = Pipeline(stages, on_reset=reset_simulation)
+    pipeline.start_episode()
+    scheduler = SCHEDULERS[args.scheduler]()
+    meter = ThroughputMeter(args.report_interval if args.headless else 0)
+
+    def should_stop():
+        progress = meter.poll(pipeline.frames)
+        if progress:
+            print(f"📈 {progress} [{param_refs['state'][0]}]")
+        return exit_flag[0]
+
+    control = None
+    if args.control_port:
+        control = ControlServer(param_refs, exit_flag, args.control_port,
+                                status=lambda: {"frames": pipeline.frames,
+                                                "fps": round(meter.fps(pipeline.frames), 1)}).start()
+        print(f"Control socket on 127.0.0.1:{args.control_port} (stop, reset, status)")
+
+    if LOCKSTEP:
+        lockstep.start()
+        print(f"Lockstep mode: {LOCKSTEP:.3f}s of sim time per frame")
 
-finally:
-    print("Landing...")
-    log_file.close()
-    out.release()
     try:
-        client.landAsync().join()
-        client.armDisarm(False)
-        client.enableApiControl(False)
-    except Exception as e:
-        print("Landing error:", e)
-    if sim_process:
-        sim_process.terminate()
-        print("UE4 simulation closed.")
-    if DEBUG_DISPLAY:
-        cv2.destroyAllWindows()
+        scheduler.run(pipeline, should_stop=should_stop,
+                      should_reset=lambda: param_refs['reset_flag'][0])
+    except KeyboardInterrupt:
+        print("Interrupted.")
+
+    finally:
+        print(f"Throughput: {meter.summary(pipeline.frames)}")
+        print("Landing...")
+        if control is not None:
+            control.stop()
+        # Land before closing the stages so the session still records it
+        try:
+            lockstep.stop()
+            client.landAsync().join()
+            client.armDisarm(False)
+            client.enableApiControl(False)
+        except Exception as e:
+            print("Landing error:", e)
+        pipeline.close()
+        if sim_process:
+            sim_process.terminate()
+            print("UE4 simulation closed.")
+        if debug_display:
+            cv2.destroyAllWindows()
+        if range_confirmer is not None:
+            print(f"Range check vetoed {range_confirmer.vetoes} and triggered "
+                  f"{range_confirmer.triggers} obstacle frames")
+        # The process scheduler tracks with a copy in the child process
+        if compensator is not None and args.scheduler != "process":
+            print(compensator.summary())
+        duplicates = pipeline.stage("capture").frame_clock.duplicates
+        if duplicates:
+            print(f"Skipped {duplicates} duplicate frames")
+        if RPC_STATS:
+            print("RPC summary:")
+            print(client.rpc_stats.summary())
+            with open(f"flow_logs/rpc_stats_{pipeline.timestamp}.json", 'w') as f:
+                json.dump(client.getRpcStats(), f, indent=2)
+        if tracer.enabled:
+            tracer.dump(TRACE_OUTPUT)
+            print(f"Trace written to {TRACE_OUTPUT}")
+
+
+if __name__ == '__main__':
+    main()
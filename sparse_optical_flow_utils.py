@@ -13,17 +13,19 @@ lk_params = dict(winSize=(15, 15), maxLevel=2,
                  criteria=(cv2.TERM_CRITERIA_EPS | cv2.TERM_CRITERIA_COUNT, 10, 0.03))
 
 
-def initialize_sparse_features(gray_frame):
+def initialize_sparse_features(gray_frame, feature_params=None):
     """
     Run Shi-Tomasi corner detection on the first grayscale frame.
+    ``feature_params`` overrides the module level ``shitomasi_params``.
     """
     gray_frame = apply_clahe(gray_frame)
-    return cv2.goodFeaturesToTrack(gray_frame, mask=None, **shitomasi_params)
+    params = shitomasi_params if feature_params is None else feature_params
+    return cv2.goodFeaturesToTrack(gray_frame, mask=None, **params)
 
 
 def track_and_detect_obstacle(prev_gray, curr_gray, prev_pts, roi,
                               partitions=1, dt=1.0, drone_speed=0.0,
-                              displacement_threshold=10):
+                              displacement_threshold=10, flow_params=None, compensator=None):
     """Track features and compute average flow for each ROI partition.
 
     Parameters
@@ -36,6 +38,13 @@ def track_and_detect_obstacle(prev_gray, curr_gray, prev_pts, roi,
         Feature points from the previous frame.
     roi : tuple
         ``(x1, y1, x2, y2)`` region of interest.
+    flow_params : dict, optional
+        Overrides the module level ``lk_params``.
+    compensator : object, optional
+        ``compensate(good_old, good_new)`` returning the new points with the
+        global rotational motion removed (see ``uav.egomotion``); partition
+        flow is measured on those, the returned points stay uncompensated.
+        A non-``None`` ``predict(prev_pts)`` seeds Lucas-Kanade.
 
     Returns
     -------
@@ -48,7 +57,13 @@ def track_and_detect_obstacle(prev_gray, curr_gray, prev_pts, roi,
     prev_gray = apply_clahe(prev_gray)
     curr_gray = apply_clahe(curr_gray)
 
-    new_pts, status, _ = cv2.calcOpticalFlowPyrLK(prev_gray, curr_gray, prev_pts, None, **lk_params)
+    params = lk_params if flow_params is None else flow_params
+    guess = None if compensator is None else compensator.predict(prev_pts)
+    if guess is not None:
+        # Start the search at the predicted positions, leaving only the
+        # translational flow for the pyramid to find
+        params = dict(params, flags=params.get('flags', 0) | cv2.OPTFLOW_USE_INITIAL_FLOW)
+    new_pts, status, _ = cv2.calcOpticalFlowPyrLK(prev_gray, curr_gray, prev_pts, guess, **params)
 
     # Filter only good points
     good_old = prev_pts[status == 1]
@@ -57,6 +72,9 @@ def track_and_detect_obstacle(prev_gray, curr_gray, prev_pts, roi,
     if len(good_new) < 5:
         return new_pts, good_old, good_new, [0.0] * partitions
 
+    # The global model is fitted to all tracked points, not just the ROI
+    flow_new = good_new if compensator is None else compensator.compensate(good_old, good_new)
+
     # Filter points in ROI
     roi_mask = (
         (good_new[:, 0] >= roi[0]) &
@@ -71,8 +89,10 @@ def track_and_detect_obstacle(prev_gray, curr_gray, prev_pts, roi,
     if len(roi_new) < 5:
         return new_pts, good_old, good_new, [0.0] * partitions
 
+    roi_flow = flow_new[roi_mask]
+
     # Compute flow magnitude
-    disp = roi_new - roi_old
+    disp = roi_flow - roi_old
     magnitudes = np.linalg.norm(disp, axis=1)
     avg_mag = np.mean(magnitudes)
 
@@ -86,7 +106,7 @@ def track_and_detect_obstacle(prev_gray, curr_gray, prev_pts, roi,
             (roi_new[:, 1] <= py2)
         )
         part_old = roi_old[mask]
-        part_new = roi_new[mask]
+        part_new = roi_flow[mask]
         if len(part_new) == 0:
             partition_avgs.append(0.0)
             continue
@@ -114,3 +134,100 @@ def track_and_detect_obstacle(prev_gray, curr_gray, prev_pts, roi,
         debug_print(f"[DEBUG] Partition flows L/C/R: {flows_str}")
 
     return new_pts, good_old, good_new, partition_avgs
+
+
+class SparseFlowTracker:
+    """Per-frame sparse flow state used by the navigation loop.
+
+    Keeps the previous frame and tracked features between calls, re-detects
+    features when too few survive and resets the tracker after
+    ``no_feature_limit`` consecutive frames without any feature.
+    ``feature_params`` and ``flow_params`` override the module level
+    ``shitomasi_params`` and ``lk_params``; ``compensator`` removes global
+    rotational motion before the partition flow is measured.  After each
+    call ``flow_new`` holds ``good_new`` with that motion removed (the
+    tracked points themselves when nothing was compensated).
+    """
+
+    def __init__(self, roi, partitions=3, min_features=10, no_feature_limit=10,
+                 displacement_threshold=2.5, feature_params=None, flow_params=None, compensator=None):
+        self.roi = roi
+        self.partitions = partitions
+        self.min_features = min_features
+        self.no_feature_limit = no_feature_limit
+        self.displacement_threshold = displacement_threshold
+        self.feature_params = feature_params
+        self.flow_params = flow_params
+        self.compensator = compensator
+        self.reset()
+
+    def reset(self):
+        self.prev_gray = None
+        self.prev_pts = None
+        self.flow_new = np.empty((0, 2), dtype=np.float32)
+        self.no_feature_frames = 0
+
+    def process(self, gray, dt, speed, angular_velocity=None):
+        """Track features into ``gray``.
+
+        ``angular_velocity`` (body rates in rad/s) is passed to the
+        compensator before tracking.
+
+        Returns
+        -------
+        tuple
+            ``(good_old, good_new, part_flows, features_detected)``.
+        """
+        good_old = np.empty((0, 2), dtype=np.float32)
+        good_new = np.empty((0, 2), dtype=np.float32)
+        part_flows = [0.0] * self.partitions
+        features_detected = 0
+        self.flow_new = good_new
+        if self.prev_gray is None:
+            self.prev_gray = gray
+            self.prev_pts = initialize_sparse_features(self.prev_gray, self.feature_params)
+            if self.prev_pts is not None:
+                features_detected = len(self.prev_pts)
+                debug_print(f"🔍 Initialized {features_detected} features")
+            debug_print("🔧 First grayscale frame set")
+        else:
+            if self.compensator is not None:
+                self.compensator.update(angular_velocity, dt)
+            self.prev_pts, good_old, good_new, part_flows = track_and_detect_obstacle(
+                self.prev_gray,
+                gray,
+                self.prev_pts,
+                self.roi,
+                partitions=self.partitions,
+                dt=dt,
+                drone_speed=speed,
+                displacement_threshold=self.displacement_threshold,
+                flow_params=self.flow_params,
+                compensator=self.compensator,
+            )
+            self.flow_new = good_new
+            if self.compensator is not None and self.compensator.compensated is not None:
+                self.flow_new = self.compensator.compensated
+
+            self.prev_gray = gray.copy()
+            if self.prev_pts is not None:
+                features_detected = len(self.prev_pts)
+                if features_detected < self.min_features:
+                    debug_print("🔁 Too few features — reinitializing")
+                    self.prev_pts = initialize_sparse_features(self.prev_gray, self.feature_params)
+                    if self.prev_pts is not None:
+                        features_detected = len(self.prev_pts)
+
+        debug_print(f"📈 Features detected: {features_detected}")
+        if features_detected == 0:
+            self.no_feature_frames += 1
+        else:
+            self.no_feature_frames = 0
+
+        if self.no_feature_frames >= self.no_feature_limit:
+            debug_print("❌ No features for several frames — resetting tracker")
+            self.prev_gray = gray
+            self.prev_pts = initialize_sparse_features(self.prev_gray, self.feature_params)
+            self.no_feature_frames = 0
+
+        return good_old, good_new, part_flows, features_detected
@@ -0,0 +1,244 @@
+# uav/benchmark.py
+"""Micro and macro benchmarks for the sparse optical flow hot path.
+
+Results are written as JSON so runs can be compared against a stored
+baseline::
+
+    python -m uav.benchmark --output bench.json
+    python -m uav.benchmark --compare bench.json --tolerance 0.15
+    python -m uav.benchmark --session flow_logs/session_<timestamp> --quick
+
+A comparison exits with status 1 when any case got slower than the baseline
+by more than the tolerance.  The ``accuracy/*`` cases score each flow engine
+against the exact flow of :mod:`uav.synthetic` scenes (endpoint error in
+pixels next to the time per frame).
+"""
+import argparse
+import json
+import platform
+import sys
+import time
+from datetime import datetime
+
+import cv2
+import numpy as np
+
+from uav.decision import ObstacleDetector
+from uav.perception import FlowHistory, OpticalFlowTracker
+from uav.standin import SyntheticRenderer
+from uav.synthetic import SCENARIOS, endpoint_error, scenario
+from uav.utils import apply_clahe, partition_roi, scaled_roi
+from sparse_optical_flow_utils import (SparseFlowTracker, initialize_sparse_features,
+                                       lk_params, shitomasi_params, track_and_detect_obstacle)
+
+SIZES = [(320, 240), (640, 480), (1280, 720)]
+FEATURE_COUNTS = [50, 200, 500]
+PARTITION_COUNTS = [1, 3, 5]
+
+
+def synthetic_frames(width, height, count=30, speed=0.4, seed=0):
+    """Return ``count`` grayscale frames flying towards a textured wall."""
+    renderer = SyntheticRenderer(width, height, seed=seed)
+    frames = []
+    for i in range(count):
+        img = renderer.render(np.array([i * speed, 0.0, -2.0]), 0.0, 0.0)
+        frames.append(cv2.cvtColor(img, cv2.COLOR_BGR2GRAY))
+    return frames
+
+
+def recorded_frames(path, width, height, count=30):
+    """Return up to ``count`` frames of a frame-store session resized to ``width`` x ``height``."""
+    from uav.framestore import FrameStoreReader
+    reader = FrameStoreReader(path)
+    return [cv2.resize(np.asarray(frame), (width, height))
+            for _, frame, _ in reader.iter_frames(stop=count)]
+
+
+def measure(fn, repeat=20, warmup=2):
+    """Call ``fn`` repeatedly and return timing statistics in microseconds."""
+    for _ in range(warmup):
+        fn()
+    samples = np.empty(repeat)
+    for i in range(repeat):
+        start = time.perf_counter_ns()
+        fn()
+        samples[i] = (time.perf_counter_ns() - start) / 1000.0
+    return {
+        "median_us": float(np.median(samples)),
+        "mean_us": float(samples.mean()),
+        "min_us": float(samples.min()),
+        "p95_us": float(np.percentile(samples, 95)),
+        "repeat": repeat,
+    }
+
+
+def micro_benchmarks(frames_by_size, repeat):
+    results = {}
+    for (width, height), frames in frames_by_size.items():
+        size = f"{width}x{height}"
+        prev, curr = frames[0], frames[1]
+        roi = scaled_roi(width, height)
+
+        results[f"apply_clahe/{size}"] = measure(lambda: apply_clahe(curr), repeat)
+
+        for n in FEATURE_COUNTS:
+            params = dict(shitomasi_params, maxCorners=n)
+            results[f"initialize_sparse_features/{size}/f{n}"] = measure(
+                lambda: initialize_sparse_features(prev, params), repeat)
+
+            pts = initialize_sparse_features(prev, params)
+            if pts is None:
+                continue
+            for parts in PARTITION_COUNTS:
+                results[f"track_and_detect_obstacle/{size}/f{n}/p{parts}"] = measure(
+                    lambda: track_and_detect_obstacle(prev, curr, pts, roi, partitions=parts,
+                                                      dt=0.1, drone_speed=2.0), repeat)
+
+        tracker = OpticalFlowTracker(lk_params, shitomasi_params)
+        state = {"i": 0}
+
+        def process_frame():
+            state["i"] += 1
+            tracker.process_frame(frames[state["i"] % len(frames)], None)
+        results[f"OpticalFlowTracker.process_frame/{size}"] = measure(process_frame, repeat)
+
+    for parts in PARTITION_COUNTS:
+        results[f"partition_roi/p{parts}"] = measure(
+            lambda: partition_roi([60, 60, 580, 420], parts), repeat * 50)
+
+    history = FlowHistory(alpha=0.5)
+    results["FlowHistory.update"] = measure(lambda: history.update(1.0, 2.0, 3.0), repeat * 50)
+    return results
+
+
+def macro_benchmarks(frames_by_size):
+    """Run the full per-frame perception and decision step over each sequence."""
+    results = {}
+    for (width, height), frames in frames_by_size.items():
+        tracker = SparseFlowTracker(scaled_roi(width, height))
+        detector = ObstacleDetector()
+        samples = []
+        for frame_count, gray in enumerate(frames, start=1):
+            start = time.perf_counter_ns()
+            _, _, part_flows, _ = tracker.process(gray, 0.1, 2.0)
+            detector.update(frame_count, part_flows)
+            samples.append((time.perf_counter_ns() - start) / 1000.0)
+        elapsed = sum(samples) / 1e6
+        results[f"pipeline/{width}x{height}"] = {
+            "median_us": float(np.median(samples)),
+            "fps": len(frames) / elapsed,
+            "frames": len(frames),
+        }
+    return results
+
+
+def accuracy_benchmarks(width=640, height=480, frames=12):
+    """Score flow engines against synthetic ground truth: endpoint error vs time."""
+    results = {}
+    roi = scaled_roi(width, height)
+    for name in SCENARIOS:
+        sequence = list(scenario(name, width, height, frames))
+        errors, times = [], []
+        for (prev, gt_flow), (curr, _) in zip(sequence, sequence[1:]):
+            pts = initialize_sparse_features(prev)
+            start = time.perf_counter_ns()
+            _, good_old, good_new, _ = track_and_detect_obstacle(prev, curr, pts, roi, partitions=3)
+            times.append((time.perf_counter_ns() - start) / 1000.0)
+            errors.append(endpoint_error(good_old, good_new, gt_flow))
+        results[f"accuracy/track_and_detect_obstacle/{name}"] = _accuracy(errors, times)
+
+        tracker = OpticalFlowTracker(lk_params, shitomasi_params)
+        tracker.process_frame(sequence[0][0], None)
+        errors, times = [], []
+        for (_, gt_flow), (curr, _) in zip(sequence, sequence[1:]):
+            start = time.perf_counter_ns()
+            points, flow, _, _ = tracker.process_frame(curr, None)
+            times.append((time.perf_counter_ns() - start) / 1000.0)
+            if len(points):
+                points = points.reshape(-1, 2)
+                errors.append(endpoint_error(points, points + flow.reshape(-1, 2), gt_flow))
+        results[f"accuracy/OpticalFlowTracker.process_frame/{name}"] = _accuracy(errors, times)
+    return results
+
+
+def _accuracy(errors, times):
+    errors = np.concatenate(errors) if errors else np.empty(0)
+    median_us = float(np.median(times))
+    epe = float(errors.mean()) if len(errors) else float('nan')
+    return {
+        "median_us": median_us,
+        "epe_px": epe,
+        "epe_p95_px": float(np.percentile(errors, 95)) if len(errors) else float('nan'),
+        "points": int(len(errors)),
+        "epe_x_ms": epe * median_us / 1000.0,
+    }
+
+
+def compare(results, baseline, tolerance):
+    """Return ``(name, baseline_us, current_us, ratio)`` for every regression."""
+    regressions = []
+    for name, current in results.items():
+        base = baseline.get(name)
+        if base is None or base["median_us"] <= 0:
+            continue
+        ratio = current["median_us"] / base["median_us"]
+        if ratio > 1.0 + tolerance:
+            regressions.append((name, base["median_us"], current["median_us"], ratio))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the sparse optical flow hot path")
+    parser.add_argument('--output', help="write results to this JSON file")
+    parser.add_argument('--compare', help="baseline JSON to compare against")
+    parser.add_argument('--tolerance', type=float, default=0.15,
+                        help="allowed slowdown of the median before flagging a regression")
+    parser.add_argument('--session', help="use frames from a recorded frame-store session")
+    parser.add_argument('--repeat', type=int, default=20)
+    parser.add_argument('--quick', action='store_true', help="only benchmark 640x480")
+    args = parser.parse_args(argv)
+
+    sizes = [(640, 480)] if args.quick else SIZES
+    if args.session:
+        frames_by_size = {size: recorded_frames(args.session, *size) for size in sizes}
+    else:
+        frames_by_size = {size: synthetic_frames(*size) for size in sizes}
+
+    results = micro_benchmarks(frames_by_size, args.repeat)
+    results.update(macro_benchmarks(frames_by_size))
+    results.update(accuracy_benchmarks())
+    report = {
+        "meta": {
+            "timestamp": datetime.now().isoformat(timespec='seconds'),
+            "source": args.session or "synthetic",
+            "python": sys.version.split()[0],
+            "numpy": np.__version__,
+            "opencv": cv2.__version__,
+            "platform": platform.platform(),
+        },
+        "results": results,
+    }
+
+    for name, res in results.items():
+        extra = f"  epe {res['epe_px']:.3f} px" if 'epe_px' in res else ""
+        print(f"{name:55s} {res['median_us']:12.1f} us{extra}")
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"Results written to {args.output}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)["results"]
+        regressions = compare(results, baseline, args.tolerance)
+        for name, base, current, ratio in regressions:
+            print(f"REGRESSION {name}: {base:.1f} us -> {current:.1f} us ({ratio:.2f}x)")
+        if regressions:
+            return 1
+        print(f"No regressions beyond {args.tolerance * 100:.0f}% against {args.compare}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
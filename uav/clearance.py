@@ -0,0 +1,271 @@
+# uav/clearance.py
+"""Minimum obstacle clearance of logged trajectories from cached scene geometry.
+
+The static meshes of the scene (``simGetMeshPositionVertexBuffers``) are
+exported once, rasterised into a voxel occupancy grid and turned into a
+Euclidean distance field that is saved next to a small JSON header::
+
+    scene_grid.npy    (nz, nx, ny) float32 distance to the nearest occupied
+                      voxel in metres, memory-mapped when loaded
+    scene_grid.json   origin (NED corner), voxel size, mesh names
+
+Scoring a run is then one vectorized lookup of its ``pos_x/pos_y/pos_z``
+column (or the positions of a recorded session) without any RPCs.
+Clearances are accurate to about half a voxel.
+
+Usage::
+
+    python -m uav.clearance export --voxel 0.5 --exclude "Floor.*" --output scene_grid.npy
+    python -m uav.clearance score scene_grid.npy flow_logs/sparse_log_*.csv
+"""
+import argparse
+import csv
+import json
+import os
+import re
+
+import airsim
+import cv2
+import numpy as np
+
+from uav.framestore import FrameStoreReader
+
+DEFAULT_BOUNDS = (-100.0, 100.0, -100.0, 100.0, -30.0, 2.0)
+
+
+def ue_to_ned(points_cm, origin=(0.0, 0.0, 0.0)):
+    """Unreal world coordinates (cm, Z up) to AirSim NED metres.
+
+    ``origin`` is the NED position of the Unreal world origin, i.e. minus
+    the player start in metres.
+    """
+    points = np.asarray(points_cm, dtype=np.float32).reshape(-1, 3) / 100.0
+    points[:, 2] = -points[:, 2]
+    return points + np.asarray(origin, dtype=np.float32)
+
+
+def estimate_origin(client, meshes):
+    """NED position of the Unreal origin from meshes that are also scene objects.
+
+    Compares each mesh's Unreal position with ``simGetObjectPose`` of the
+    object of the same name and returns the median offset, or zeros if no
+    mesh can be matched.
+    """
+    names = set(client.simListSceneObjects(".*"))
+    offsets = []
+    for mesh in meshes:
+        if mesh.name not in names:
+            continue
+        pose = client.simGetObjectPose(mesh.name)
+        ned = np.array([pose.position.x_val, pose.position.y_val, pose.position.z_val], dtype=np.float32)
+        if np.isnan(ned).any():
+            continue
+        position = mesh.position
+        offsets.append(ned - ue_to_ned([position.x_val, position.y_val, position.z_val])[0])
+    if not offsets:
+        return np.zeros(3, dtype=np.float32)
+    return np.median(offsets, axis=0)
+
+
+def mesh_triangles(meshes, origin=(0.0, 0.0, 0.0), exclude=None):
+    """Stack the triangles of ``meshes`` as a ``(T, 3, 3)`` NED array."""
+    triangles = []
+    for mesh in meshes:
+        if exclude and re.fullmatch(exclude, mesh.name):
+            continue
+        vertices = ue_to_ned(mesh.vertices, origin)
+        indices = np.asarray(mesh.indices, dtype=np.int64).reshape(-1, 3)
+        if len(indices):
+            triangles.append(vertices[indices])
+    if not triangles:
+        return np.empty((0, 3, 3), dtype=np.float32)
+    return np.concatenate(triangles)
+
+
+def sample_triangles(triangles, step):
+    """Points on the triangle surfaces no farther than ``step`` apart along edges.
+
+    Triangles are grouped by subdivision count and each group is sampled on
+    a barycentric lattice one lattice row at a time, so huge ground planes
+    do not need one huge temporary array.
+    """
+    a, b, c = triangles[:, 0], triangles[:, 1], triangles[:, 2]
+    longest = np.max(np.stack([np.linalg.norm(b - a, axis=1), np.linalg.norm(c - a, axis=1),
+                               np.linalg.norm(c - b, axis=1)]), axis=0)
+    divisions = np.maximum(np.ceil(longest / step), 1).astype(np.int64)
+    for n in np.unique(divisions):
+        group = divisions == n
+        ga, gab, gac = a[group], (b - a)[group] / n, (c - a)[group] / n
+        j = np.arange(n + 1, dtype=np.float32)
+        for i in range(n + 1):
+            row = ga[:, None] + i * gab[:, None] + j[None, :n + 1 - i, None] * gac[:, None]
+            yield row.reshape(-1, 3)
+
+
+def distance_field(occupied, voxel):
+    """Exact Euclidean distance (metres) from every voxel to the nearest occupied one.
+
+    ``occupied`` is ``(nz, nx, ny)``.  Each z slice gets a 2-D distance
+    transform; the squared distances are then combined along z
+    (``d(z)^2 = min_z' d2(z')^2 + (z - z')^2``).
+    """
+    nz = occupied.shape[0]
+    far = float(sum(occupied.shape))
+    planar = np.full(occupied.shape, far, dtype=np.float32)
+    for k in range(nz):
+        if occupied[k].any():
+            planar[k] = cv2.distanceTransform((~occupied[k]).astype(np.uint8), cv2.DIST_L2,
+                                              cv2.DIST_MASK_PRECISE)
+    planar *= planar
+    squared = planar.copy()
+    for dz in range(1, nz):
+        offset = float(dz * dz)
+        if offset >= squared.max():
+            break
+        np.minimum(squared[dz:], planar[:-dz] + offset, out=squared[dz:])
+        np.minimum(squared[:-dz], planar[dz:] + offset, out=squared[:-dz])
+    return np.sqrt(squared) * voxel
+
+
+class ClearanceGrid:
+    """Distance field over an axis-aligned NED box.
+
+    Parameters
+    ----------
+    distance : ndarray
+        ``(nz, nx, ny)`` distances in metres.
+    origin : sequence
+        NED position of the low corner of voxel ``(0, 0, 0)``.
+    voxel : float
+        Voxel edge length in metres.
+    """
+
+    def __init__(self, distance, origin, voxel, meta=None):
+        self.distance = distance
+        self.origin = np.asarray(origin, dtype=np.float64)
+        self.voxel = float(voxel)
+        self.meta = meta or {}
+
+    @classmethod
+    def from_triangles(cls, triangles, voxel=0.5, bounds=DEFAULT_BOUNDS, **meta):
+        xmin, xmax, ymin, ymax, zmin, zmax = bounds
+        lo = np.array([xmin, ymin, zmin], dtype=np.float64)
+        shape_xyz = np.ceil((np.array([xmax, ymax, zmax]) - lo) / voxel).astype(np.int64)
+        occupied = np.zeros((shape_xyz[2], shape_xyz[0], shape_xyz[1]), dtype=bool)
+        if len(triangles):
+            for points in sample_triangles(triangles, voxel / 2.0):
+                index = np.floor((points - lo) / voxel).astype(np.int64)
+                keep = ((index >= 0) & (index < shape_xyz)).all(axis=1)
+                ix, iy, iz = index[keep].T
+                occupied[iz, ix, iy] = True
+        meta['occupied_voxels'] = int(occupied.sum())
+        return cls(distance_field(occupied, voxel), lo, voxel, meta)
+
+    def save(self, path):
+        np.save(path, self.distance.astype(np.float32))
+        meta = dict(self.meta, origin=self.origin.tolist(), voxel=self.voxel,
+                    shape=list(self.distance.shape))
+        with open(os.path.splitext(path)[0] + ".json", "w") as f:
+            json.dump(meta, f, indent=2)
+
+    @classmethod
+    def load(cls, path):
+        with open(os.path.splitext(path)[0] + ".json") as f:
+            meta = json.load(f)
+        distance = np.load(path, mmap_mode='r')
+        return cls(distance, meta.pop('origin'), meta.pop('voxel'), meta)
+
+    def query(self, points):
+        """Clearance in metres of each NED point; NaN outside the grid."""
+        points = np.asarray(points, dtype=np.float64).reshape(-1, 3)
+        index = np.floor((points - self.origin) / self.voxel).astype(np.int64)
+        nz, nx, ny = self.distance.shape
+        inside = ((index >= 0) & (index < (nx, ny, nz))).all(axis=1)
+        result = np.full(len(points), np.nan, dtype=np.float32)
+        ix, iy, iz = index[inside].T
+        result[inside] = self.distance[iz, ix, iy]
+        return result
+
+
+def load_trajectory(path):
+    """NED positions ``(N, 3)`` of a flow log CSV or a recorded session directory."""
+    if os.path.isdir(path):
+        return FrameStoreReader(path).records()['pos'].astype(np.float64)
+    with open(path, newline='') as f:
+        rows = list(csv.DictReader(f))
+    return np.array([[float(r['pos_x']), float(r['pos_y']), float(r['pos_z'])] for r in rows],
+                    dtype=np.float64).reshape(-1, 3)
+
+
+def score_trajectory(grid, points):
+    """Minimum, 5th percentile and mean clearance of a trajectory."""
+    clearance = grid.query(points)
+    valid = ~np.isnan(clearance)
+    if not valid.any():
+        return {'frames': len(points), 'outside': len(points), 'min_clearance_m': float('nan'),
+                'p5_clearance_m': float('nan'), 'mean_clearance_m': float('nan'), 'min_frame': None}
+    values = clearance[valid]
+    return {
+        'frames': len(points),
+        'outside': int((~valid).sum()),
+        'min_clearance_m': float(values.min()),
+        'p5_clearance_m': float(np.percentile(values, 5)),
+        'mean_clearance_m': float(values.mean()),
+        'min_frame': int(np.flatnonzero(valid)[np.argmin(values)]),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Scene clearance grid export and trajectory scoring")
+    sub = parser.add_subparsers(dest='command', required=True)
+    exp = sub.add_parser('export', help="fetch the scene meshes and build the distance field")
+    exp.add_argument('--ip', default='')
+    exp.add_argument('--port', type=int, default=41451)
+    exp.add_argument('--voxel', type=float, default=0.5, help="voxel edge in metres")
+    exp.add_argument('--bounds', default=",".join(str(b) for b in DEFAULT_BOUNDS),
+                     help="xmin,xmax,ymin,ymax,zmin,zmax of the grid in NED metres")
+    exp.add_argument('--exclude', help="regex of mesh names to leave out (e.g. the ground)")
+    exp.add_argument('--origin', help="NED x,y,z of the Unreal origin (default: from scene object poses)")
+    exp.add_argument('--output', default="scene_grid.npy")
+    sc = sub.add_parser('score', help="minimum clearance of flow logs or recorded sessions")
+    sc.add_argument('grid')
+    sc.add_argument('runs', nargs='+', help="flow_logs CSVs or session directories")
+    sc.add_argument('--output', help="write the scores to this JSON file")
+    args = parser.parse_args(argv)
+
+    if args.command == 'export':
+        client = airsim.MultirotorClient(args.ip, args.port)
+        client.confirmConnection()
+        meshes = client.simGetMeshPositionVertexBuffers()
+        if args.origin:
+            origin = np.array([float(v) for v in args.origin.split(',')], dtype=np.float32)
+        else:
+            origin = estimate_origin(client, meshes)
+        triangles = mesh_triangles(meshes, origin, args.exclude)
+        bounds = tuple(float(v) for v in args.bounds.split(','))
+        grid = ClearanceGrid.from_triangles(
+            triangles, args.voxel, bounds, meshes=[m.name for m in meshes],
+            exclude=args.exclude, ue_origin_ned=[float(v) for v in origin])
+        grid.save(args.output)
+        print(f"{len(meshes)} meshes, {len(triangles)} triangles, "
+              f"{grid.meta['occupied_voxels']} occupied voxels of {grid.distance.size}; "
+              f"written to {args.output}")
+        return
+
+    grid = ClearanceGrid.load(args.grid)
+    scores = []
+    for run in args.runs:
+        scores.append(dict(run=run, **score_trajectory(grid, load_trajectory(run))))
+    scores.sort(key=lambda s: -np.inf if np.isnan(s['min_clearance_m']) else s['min_clearance_m'])
+    print(f"{'min (m)':>8}  {'p5 (m)':>7}  {'mean (m)':>8}  {'frame':>6}  {'outside':>7}  run")
+    for s in scores:
+        frame = '' if s['min_frame'] is None else s['min_frame']
+        print(f"{s['min_clearance_m']:8.2f}  {s['p5_clearance_m']:7.2f}  {s['mean_clearance_m']:8.2f}  "
+              f"{frame:>6}  {s['outside']:>7}  {s['run']}")
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(scores, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
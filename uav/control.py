@@ -0,0 +1,128 @@
+# uav/control.py
+"""Stop/reset control and throughput reporting for headless runs.
+
+Without the Tk window a run is controlled through signals::
+
+    kill -TERM <pid>    # stop, land and write the summary
+    kill -USR1 <pid>    # reset the episode (POSIX only)
+
+or through a line-based TCP socket on localhost::
+
+    echo reset  | nc 127.0.0.1 47000
+    echo status | nc 127.0.0.1 47000   # {"state": ..., "frames": ..., "fps": ...}
+    echo stop   | nc 127.0.0.1 47000
+
+Both only set the same flags the GUI buttons set, so the loop reacts at
+the next frame boundary.
+"""
+import json
+import signal
+import socketserver
+import threading
+import time
+
+from uav.logging import debug_print
+
+
+def install_signal_handlers(exit_flag, reset_flag):
+    """Map SIGTERM (and SIGBREAK on Windows) to stop and SIGUSR1 to reset.
+
+    Must be called from the main thread.  SIGINT keeps raising
+    ``KeyboardInterrupt`` so Ctrl+C behaves as before.
+    """
+    def on_stop(signum, _frame):
+        debug_print(f"🛑 Signal {signum}: stop requested")
+        exit_flag[0] = True
+
+    def on_reset(signum, _frame):
+        debug_print(f"🔄 Signal {signum}: reset requested")
+        reset_flag[0] = True
+
+    for name in ("SIGTERM", "SIGBREAK"):
+        if hasattr(signal, name):
+            signal.signal(getattr(signal, name), on_stop)
+    if hasattr(signal, "SIGUSR1"):
+        signal.signal(signal.SIGUSR1, on_reset)
+
+
+class ThroughputMeter:
+    """Frames per second over the whole run and since the last report."""
+
+    def __init__(self, interval=10.0):
+        self.interval = interval
+        self.start = time.perf_counter()
+        self.last_report = self.start
+        self.last_frames = 0
+
+    def elapsed(self):
+        return time.perf_counter() - self.start
+
+    def fps(self, frames):
+        elapsed = self.elapsed()
+        return frames / elapsed if elapsed > 0 else 0.0
+
+    def poll(self, frames):
+        """Return a progress line every ``interval`` seconds, else ``None``."""
+        now = time.perf_counter()
+        if not self.interval or now - self.last_report < self.interval:
+            return None
+        window = (frames - self.last_frames) / (now - self.last_report)
+        self.last_report, self.last_frames = now, frames
+        return f"{frames} frames, {window:.1f} FPS (avg {self.fps(frames):.1f})"
+
+    def summary(self, frames):
+        return f"{frames} frames in {self.elapsed():.1f}s ({self.fps(frames):.1f} FPS)"
+
+
+class _ControlHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        for line in self.rfile:
+            command = line.decode(errors="replace").strip().lower()
+            if not command:
+                continue
+            reply = self.server.dispatch(command)
+            self.wfile.write((json.dumps(reply) + "\n").encode())
+
+
+class ControlServer(socketserver.ThreadingTCPServer):
+    """Accept ``stop``, ``reset`` and ``status`` commands on a local port.
+
+    Parameters
+    ----------
+    param_refs : dict
+        The ``state`` and ``reset_flag`` holders shared with the GUI.
+    exit_flag : list
+        Stop flag polled by the scheduler.
+    status : callable, optional
+        Returns extra fields (e.g. frame count and FPS) for ``status``.
+    """
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, param_refs, exit_flag, port, host="127.0.0.1", status=None):
+        super().__init__((host, port), _ControlHandler)
+        self.param_refs = param_refs
+        self.exit_flag = exit_flag
+        self.status = status
+        self.thread = None
+
+    def dispatch(self, command):
+        if command == "stop":
+            self.exit_flag[0] = True
+        elif command == "reset":
+            self.param_refs['reset_flag'][0] = True
+        elif command != "status":
+            return {"error": f"unknown command {command!r}"}
+        reply = {"state": self.param_refs['state'][0]}
+        if self.status is not None:
+            reply.update(self.status())
+        return reply
+
+    def start(self):
+        self.thread = threading.Thread(target=self.serve_forever, name="control", daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
@@ -0,0 +1,161 @@
+# uav/decision.py
+import numpy as np
+
+from uav.perception import FlowHistory
+from uav.logging import debug_print
+from uav.utils import partition_roi
+
+
+class ObstacleDetector:
+    """Turn per-partition flow into an obstacle decision.
+
+    Flow is smoothed with :class:`FlowHistory`, obstacle checks are skipped
+    during the first ``grace_frames`` frames and a centre flow above
+    ``threshold`` is reported as an obstacle unless both sides are above it
+    too (a corridor).
+    """
+
+    def __init__(self, threshold=350.0, grace_frames=10, alpha=0.5):
+        self.threshold = threshold
+        self.grace_frames = grace_frames
+        self.alpha = alpha
+        self.flow_history = FlowHistory(alpha=alpha)
+
+    def reset(self):
+        self.flow_history = FlowHistory(alpha=self.alpha)
+
+    def smooth(self, frame_count, part_flows):
+        """Update the flow history and return the smoothed ``(L, C, R)`` flows."""
+        # Reset flow history on first frame
+        if frame_count == 1:
+            self.reset()
+        if part_flows:
+            self.flow_history.update(*part_flows)
+        smooth_L, smooth_C, smooth_R = self.flow_history.average()
+        debug_print(
+            f"[DEBUG] smoothed flows L/C/R: {smooth_L:.2f}, "
+            f"{smooth_C:.2f}, {smooth_R:.2f}"
+        )
+        return smooth_L, smooth_C, smooth_R
+
+    def decide(self, frame_count, smooth_L, smooth_C, smooth_R):
+        """Return ``True`` when the smoothed flows indicate an obstacle ahead."""
+        # threshold = max(MIN_FLOW_THRESHOLD, 2.5 * max(speed, 0.2))
+        # Determine threshold first
+        if frame_count < self.grace_frames:
+            threshold = float('inf')
+        else:
+            threshold = self.threshold  # keep it fixed for now
+
+        # Then calculate corridor condition
+        corridor = (
+            smooth_C <= threshold
+            and smooth_L > threshold
+            and smooth_R > threshold
+        )
+
+        # Obstacle decision logic
+        if frame_count < self.grace_frames:
+            return False
+        if smooth_C > threshold:
+            return not corridor
+        return False
+
+    def update(self, frame_count, part_flows):
+        """Smooth ``part_flows`` and decide.  Returns ``(obstacle, (L, C, R))``."""
+        smoothed = self.smooth(frame_count, part_flows)
+        return self.decide(frame_count, *smoothed), smoothed
+
+
+class DepthConfirmer:
+    """Confirm or veto flow-based obstacle decisions with measured range.
+
+    Ranges come per ROI partition, either from a depth image (a low
+    percentile of the depth in each partition, robust to single bad pixels)
+    or from LiDAR sectors.  A flow obstacle is vetoed when the centre
+    partition is clear beyond ``veto_depth`` metres; with ``trigger_depth``
+    set, a centre closer than that is an obstacle even without flow.
+
+    Parameters
+    ----------
+    roi : sequence
+        ``(x1, y1, x2, y2)`` in scene image pixels.
+    image_size : tuple
+        ``(width, height)`` of the scene image the ROI refers to; the depth
+        image may have a different (usually lower) resolution.
+    """
+
+    def __init__(self, roi, partitions=3, image_size=(640, 480), veto_depth=8.0, percentile=5.0,
+                 trigger_depth=None):
+        self.roi = roi
+        self.partitions = partitions
+        self.image_size = image_size
+        self.veto_depth = veto_depth
+        self.percentile = percentile
+        self.trigger_depth = trigger_depth
+        self.vetoes = 0
+        self.triggers = 0
+
+    def clearances(self, depth):
+        """Return the clearance in metres of each ROI partition."""
+        height, width = depth.shape[:2]
+        sx, sy = width / self.image_size[0], height / self.image_size[1]
+        x1, y1, x2, y2 = self.roi
+        roi = (int(x1 * sx), int(y1 * sy), max(int(x2 * sx), int(x1 * sx) + self.partitions),
+               max(int(y2 * sy), int(y1 * sy) + 1))
+        return [float(np.percentile(depth[py1:py2, px1:px2], self.percentile))
+                for px1, py1, px2, py2 in partition_roi(roi, self.partitions)]
+
+    def fuse(self, obstacle, clearances):
+        """Return the obstacle decision given per-partition ``clearances``."""
+        centre = clearances[len(clearances) // 2]
+        if obstacle and centre > self.veto_depth:
+            self.vetoes += 1
+            debug_print(f"[DEBUG] range veto: centre clear for {centre:.1f} m")
+            return False
+        if not obstacle and self.trigger_depth is not None and centre < self.trigger_depth:
+            self.triggers += 1
+            debug_print(f"[DEBUG] range trigger: centre blocked at {centre:.1f} m")
+            return True
+        return obstacle
+
+    def check(self, obstacle, depth):
+        """Return ``(obstacle, clearances)`` after the depth check."""
+        clearances = self.clearances(depth)
+        return self.fuse(obstacle, clearances), clearances
+
+
+class NavigationPolicy:
+    """Dodge on obstacles and resume after ``safe_frames`` clear frames."""
+
+    def __init__(self, navigator, safe_frames=5):
+        self.navigator = navigator
+        self.safe_frames = safe_frames
+        self.safe_counter = 0
+
+    def reset(self):
+        self.safe_counter = 0
+
+    def step(self, obstacle, smooth_L, smooth_C, smooth_R):
+        """Issue the navigation command for this frame and return the state string."""
+        navigator = self.navigator
+        state_str = "forward"
+        if obstacle:
+            self.safe_counter = 0
+            state_str = navigator.dodge(smooth_L, smooth_C, smooth_R)
+        else:
+            if navigator.braked or navigator.dodging:
+                self.safe_counter += 1
+                debug_print(f"[DEBUG] clear frames: {self.safe_counter}/{self.safe_frames}")
+
+                if self.safe_counter >= self.safe_frames:
+                    state_str = navigator.resume_forward()
+                    self.safe_counter = 0
+                else:
+                    if navigator.braked:
+                        state_str = navigator.brake()
+                    else:
+                        state_str = "dodge"
+            else:
+                state_str = navigator.blind_forward()
+        return state_str
@@ -0,0 +1,293 @@
+# uav/egomotion.py
+"""Remove the rotational part of the global image motion from tracked points.
+
+Yaw and pitch corrections shift the whole image and roll turns it, which
+raises the flow of every partition alike.  The compensator fits one global
+model to the tracked pairs with RANSAC (a bounded number of iterations, so
+the cost per frame is fixed) and subtracts only its rotational part:
+
+``affine``
+    A 4-DOF similarity (rotation, uniform scale, translation) about the
+    image centre.  For small angles pan/tilt appear as the translation and
+    roll as the rotation; the scale is the looming expansion the detector
+    needs, so it is kept.
+``homography``
+    A full homography, reduced to the camera rotation ``R`` nearest to
+    ``K^-1 H K``; the flow ``K R K^-1`` predicts is subtracted.  Needs the
+    focal length (from the field of view).
+
+Points that do not fit the global model -- a close obstacle -- are RANSAC
+outliers and keep their own flow.  Usage::
+
+    compensator = EgoMotionCompensator("homography", max_iters=100)
+    tracker = SparseFlowTracker(roi, compensator=compensator)
+
+:class:`GyroDerotator` needs no fit: the body rates of the state (or an
+IMU) and the camera intrinsics give the rotation ``R`` of the frame
+interval directly, so ``K R^T K^-1`` predicts every point's rotational
+motion in one transform.  The prediction is also handed to Lucas-Kanade as
+the initial guess, which then only has to find the translational flow::
+
+    derotator = GyroDerotator.from_camera(client, "oakd_camera")
+    tracker = SparseFlowTracker(roi, compensator=derotator)
+"""
+import math
+import time
+
+import cv2
+import numpy as np
+
+from uav.trace import tracer
+
+MODELS = ("affine", "homography")
+
+# Body FRD axes to OpenCV camera axes (x right, y down, z along the view)
+_BODY_TO_CV = np.array([[0.0, 1.0, 0.0], [0.0, 0.0, 1.0], [1.0, 0.0, 0.0]])
+
+
+def quaternion_matrix(q):
+    """Rotation matrix of a ``Quaternionr`` or ``(w, x, y, z)`` tuple."""
+    if hasattr(q, 'w_val'):
+        q = (q.w_val, q.x_val, q.y_val, q.z_val)
+    w, x, y, z = np.asarray(q, dtype=np.float64) / np.linalg.norm(q)
+    return np.array([
+        [1 - 2 * (y * y + z * z), 2 * (x * y - w * z), 2 * (x * z + w * y)],
+        [2 * (x * y + w * z), 1 - 2 * (x * x + z * z), 2 * (y * z - w * x)],
+        [2 * (x * z - w * y), 2 * (y * z + w * x), 1 - 2 * (x * x + y * y)],
+    ])
+
+
+def matrix_quaternion(r):
+    """``(w, x, y, z)`` of a rotation matrix, with ``w >= 0``."""
+    r = np.asarray(r, dtype=np.float64)
+    q = np.array([
+        1.0 + r[0, 0] + r[1, 1] + r[2, 2],
+        1.0 + r[0, 0] - r[1, 1] - r[2, 2],
+        1.0 - r[0, 0] + r[1, 1] - r[2, 2],
+        1.0 - r[0, 0] - r[1, 1] + r[2, 2],
+    ])
+    # Magnitudes from the diagonal, signs from the off-diagonal terms
+    q = np.sqrt(np.maximum(q, 0.0)) / 2.0
+    q[1] = math.copysign(q[1], r[2, 1] - r[1, 2])
+    q[2] = math.copysign(q[2], r[0, 2] - r[2, 0])
+    q[3] = math.copysign(q[3], r[1, 0] - r[0, 1])
+    return tuple(float(v) for v in q / np.linalg.norm(q))
+
+
+def camera_mount(client, camera, vehicle_name=''):
+    """Camera-to-body rotation from ``simGetCameraInfo`` and the current vehicle pose.
+
+    Returns ``(mount, info)``; a recorded camera orientation ``R_cam``
+    belongs to the vehicle orientation ``R_cam @ mount.T``.
+    """
+    info = client.simGetCameraInfo(camera, vehicle_name)
+    body = client.simGetVehiclePose(vehicle_name).orientation
+    return quaternion_matrix(body).T @ quaternion_matrix(info.pose.orientation), info
+
+
+def body_rates(q_prev, q_curr, dt):
+    """Mean angular velocity (rad/s, body axes) between two orientations ``dt`` apart."""
+    relative = quaternion_matrix(q_prev).T @ quaternion_matrix(q_curr)
+    rvec, _ = cv2.Rodrigues(relative)
+    return rvec.ravel() / dt
+
+
+class _TimedCompensator:
+    """Timing statistics and the no-op hooks shared by the compensators.
+
+    ``compensated`` holds the result of the last :meth:`compensate` that
+    removed any motion since the last :meth:`update`, else ``None``.
+    """
+    compensated = None
+
+    def reset_stats(self):
+        self.calls = 0
+        self.total_us = 0.0
+        self.max_us = 0.0
+        self.last_us = 0.0
+
+    def _record(self, start):
+        self.last_us = (time.perf_counter_ns() - start) / 1000.0
+        self.calls += 1
+        self.total_us += self.last_us
+        self.max_us = max(self.max_us, self.last_us)
+
+    def update(self, angular_velocity, dt):
+        """Take the body rates of the frame about to be tracked."""
+        self.compensated = None
+
+    def predict(self, points):
+        """Expected positions of ``points`` in the next frame, or ``None``."""
+        return None
+
+
+class EgoMotionCompensator(_TimedCompensator):
+    """Fit a global motion model and derotate ``good_new``.
+
+    Parameters
+    ----------
+    model : str
+        ``"homography"`` (exact for pure rotation) or the cheaper
+        ``"affine"``, which misses the perspective part of wide-angle yaw.
+    max_iters : int
+        RANSAC iteration bound.
+    threshold : float
+        RANSAC inlier threshold in pixels.
+    image_size : tuple
+        ``(width, height)``; the principal point is its centre.
+    fov_deg : float
+        Horizontal field of view, used by the homography model.
+    min_points : int
+        Fewer tracked pairs leave the points unchanged.
+    """
+
+    def __init__(self, model="homography", max_iters=100, threshold=1.0, image_size=(640, 480),
+                 fov_deg=90.0, min_points=8):
+        if model not in MODELS:
+            raise ValueError(f"unknown ego-motion model {model!r}")
+        self.model = model
+        self.max_iters = max_iters
+        self.threshold = threshold
+        self.min_points = min_points
+        width, height = image_size
+        self.center = np.array([width / 2.0, height / 2.0], dtype=np.float32)
+        self.focal = (width / 2.0) / math.tan(math.radians(fov_deg) / 2.0)
+        self.reset_stats()
+
+    def reset_stats(self):
+        super().reset_stats()
+        self.inlier_ratio = float('nan')
+
+    def _affine_rotation(self, old, new):
+        matrix, inliers = cv2.estimateAffinePartial2D(
+            old, new, method=cv2.RANSAC, ransacReprojThreshold=self.threshold,
+            maxIters=self.max_iters, refineIters=0)
+        if matrix is None:
+            return None, None
+        a, b = matrix[0, 0], matrix[1, 0]
+        scale = math.hypot(a, b)
+        # Same rotation and translation without the scale
+        rotation = matrix.copy()
+        rotation[:, :2] /= scale
+        return old @ rotation[:, :2].T + rotation[:, 2], inliers
+
+    def _homography_rotation(self, old, new):
+        h, inliers = cv2.findHomography(old, new, cv2.RANSAC, self.threshold, maxIters=self.max_iters)
+        if h is None:
+            return None, None
+        k = np.array([[self.focal, 0.0, 0.0], [0.0, self.focal, 0.0], [0.0, 0.0, 1.0]])
+        k_inv = np.array([[1.0 / self.focal, 0.0, 0.0], [0.0, 1.0 / self.focal, 0.0], [0.0, 0.0, 1.0]])
+        u, _, vt = np.linalg.svd(k_inv @ h @ k)
+        r = u @ vt
+        if np.linalg.det(r) < 0:
+            r = -r
+        projected = np.c_[old, np.ones(len(old))] @ (k @ r @ k_inv).T
+        return (projected[:, :2] / projected[:, 2:3]).astype(np.float32), inliers
+
+    def compensate(self, good_old, good_new):
+        """Return ``good_new`` with the rotational flow removed.
+
+        The result is only meant for flow measurement; keep tracking the
+        uncompensated points.
+        """
+        if len(good_new) < self.min_points:
+            return good_new
+        start = time.perf_counter_ns()
+        with tracer.span("ego_motion", model=self.model, points=len(good_new)):
+            old = np.asarray(good_old, dtype=np.float32).reshape(-1, 2) - self.center
+            new = np.asarray(good_new, dtype=np.float32).reshape(-1, 2) - self.center
+            if self.model == "affine":
+                rotated, inliers = self._affine_rotation(old, new)
+            else:
+                rotated, inliers = self._homography_rotation(old, new)
+            result = good_new
+            if rotated is not None:
+                # new - (rotated - old): the flow left after the rotation
+                result = (new - rotated + old + self.center).reshape(np.shape(good_new))
+                self.inlier_ratio = float(np.count_nonzero(inliers)) / len(inliers)
+                self.compensated = result
+        self._record(start)
+        return result
+
+    def summary(self):
+        if not self.calls:
+            return f"ego-motion ({self.model}): not used"
+        return (f"ego-motion ({self.model}, {self.max_iters} iters): {self.calls} frames, "
+                f"mean {self.total_us / self.calls:.0f} us, max {self.max_us:.0f} us, "
+                f"last inliers {self.inlier_ratio * 100:.0f}%")
+
+
+class GyroDerotator(_TimedCompensator):
+    """Predict and remove rotational flow from measured angular velocity.
+
+    Parameters
+    ----------
+    image_size : tuple
+        ``(width, height)`` of the tracked frames; the principal point is
+        its centre.
+    fov_deg : float
+        Horizontal field of view of the camera.
+    mount : ndarray, optional
+        Camera-to-body rotation (camera FRD axes in body axes); identity
+        for a forward-looking camera.
+    """
+    model = "gyro"
+
+    def __init__(self, image_size=(640, 480), fov_deg=90.0, mount=None):
+        width, height = image_size
+        focal = (width / 2.0) / math.tan(math.radians(fov_deg) / 2.0)
+        self.k = np.array([[focal, 0.0, width / 2.0], [0.0, focal, height / 2.0], [0.0, 0.0, 1.0]])
+        self.k_inv = np.linalg.inv(self.k)
+        mount = np.eye(3) if mount is None else np.asarray(mount, dtype=np.float64)
+        self.to_camera = _BODY_TO_CV @ mount.T
+        self.homography = None
+        self.reset_stats()
+
+    @classmethod
+    def from_camera(cls, client, camera, vehicle_name='', image_size=(640, 480)):
+        """Build from ``simGetCameraInfo``, fetched once since it does not change in flight.
+
+        The mount is the camera pose relative to the vehicle pose read at the
+        same time.
+        """
+        mount, info = camera_mount(client, camera, vehicle_name)
+        return cls(image_size, info.fov, mount)
+
+    def update(self, angular_velocity, dt):
+        """Set the rotation of the coming frame interval from body rates in rad/s.
+
+        ``angular_velocity`` is a ``Vector3r`` or an ``(x, y, z)`` sequence;
+        ``None`` or a non-positive ``dt`` disables the prediction.
+        """
+        super().update(angular_velocity, dt)
+        if angular_velocity is None or not dt or dt <= 0:
+            self.homography = None
+            return
+        if hasattr(angular_velocity, 'x_val'):
+            angular_velocity = (angular_velocity.x_val, angular_velocity.y_val, angular_velocity.z_val)
+        rotation, _ = cv2.Rodrigues(self.to_camera @ np.asarray(angular_velocity, dtype=np.float64) * dt)
+        # Static points turn the opposite way in the rotated camera
+        self.homography = self.k @ rotation.T @ self.k_inv
+
+    def predict(self, points):
+        if self.homography is None or points is None or not len(points):
+            return None
+        points = np.asarray(points, dtype=np.float32)
+        return cv2.perspectiveTransform(points.reshape(-1, 1, 2), self.homography).reshape(points.shape)
+
+    def compensate(self, good_old, good_new):
+        """Return ``good_new`` minus the predicted rotational motion of ``good_old``."""
+        if self.homography is None or not len(good_new):
+            return good_new
+        start = time.perf_counter_ns()
+        with tracer.span("ego_motion", model=self.model, points=len(good_new)):
+            result = good_new - (self.predict(good_old) - good_old)
+        self.compensated = result
+        self._record(start)
+        return result
+
+    def summary(self):
+        if not self.calls:
+            return "ego-motion (gyro): not used"
+        return (f"ego-motion (gyro): {self.calls} frames, mean {self.total_us / self.calls:.0f} us, "
+                f"max {self.max_us:.0f} us")
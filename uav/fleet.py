@@ -0,0 +1,203 @@
+# uav/fleet.py
+"""Fly several drones in one simulator, each with its own pipeline.
+
+Every vehicle gets a :class:`VehiclePipeline` holding its tracker, flow
+history, navigation policy and CSV log.  :class:`FleetScheduler` drives them
+in rounds: the state and image requests of all vehicles are sent back to
+back on the one RPC connection before any reply is awaited, so the
+simulator renders and answers them while earlier replies are processed.
+
+Usage::
+
+    python -m uav.fleet --vehicles 3 --frames 600
+"""
+import argparse
+import os
+import time
+from datetime import datetime
+
+import airsim
+import cv2
+import numpy as np
+from airsim import ImageRequest, ImageResponse, ImageType, MultirotorState
+
+from uav.decision import NavigationPolicy, ObstacleDetector
+from uav.egomotion import EgoMotionCompensator, GyroDerotator
+from uav.logging import LOG_HEADER, debug_print, format_log_row
+from uav.navigation import Navigator
+from uav.utils import FrameClock, unpack_state
+from sparse_optical_flow_utils import SparseFlowTracker
+
+
+class VehiclePipeline:
+    """Perception, decision and logging state of one vehicle.
+
+    Motion commands are never joined so one vehicle braking or dodging does
+    not stall the others.  ``ego_motion`` (``"homography"``, ``"affine"`` or
+    ``"gyro"``) removes rotational flow like ``EGO_MOTION`` in ``main.py``;
+    the gyro model uses the angular velocity of the state fetched each round.
+    """
+
+    def __init__(self, client, vehicle_name, log_path, camera="oakd_camera",
+                 roi=(60, 60, 580, 420), partitions=3, threshold=350.0,
+                 grace_frames=10, safe_frames=5, no_feature_limit=10, ego_motion=None):
+        self.client = client
+        self.vehicle_name = vehicle_name
+        self.requests = [ImageRequest(camera, ImageType.Scene, False, True)]
+        self.navigator = Navigator(client, blocking=False, vehicle_name=vehicle_name)
+        self.compensator = None
+        if ego_motion == "gyro":
+            self.compensator = GyroDerotator.from_camera(client, camera, vehicle_name)
+        elif ego_motion:
+            self.compensator = EgoMotionCompensator(ego_motion)
+        self.tracker = SparseFlowTracker(list(roi), partitions=partitions,
+                                         no_feature_limit=no_feature_limit, compensator=self.compensator)
+        self.detector = ObstacleDetector(threshold=threshold, grace_frames=grace_frames)
+        self.policy = NavigationPolicy(self.navigator, safe_frames=safe_frames)
+        self.frame_clock = FrameClock()
+        self.frame_count = 0
+        self.state_str = ""
+        self.start_time = time.time()
+        self.log_file = open(log_path, 'w')
+        self.log_file.write(LOG_HEADER)
+
+    def step(self, state, response):
+        """Process one frame.  Returns the navigation state or ``None`` if skipped."""
+        if response.width == 0 or len(response.image_data_uint8) == 0:
+            debug_print(f"⚠️ [{self.vehicle_name}] Empty image response")
+            return None
+        time_now = time.time()
+        dt = self.frame_clock.tick(response.time_stamp, time_now)
+        if dt is None:
+            return None
+        sim_time = self.frame_clock.last_time
+        img = cv2.imdecode(np.frombuffer(response.image_data_uint8, dtype=np.uint8), cv2.IMREAD_COLOR)
+        if img is None:
+            debug_print(f"❌ [{self.vehicle_name}] Failed to decode image")
+            return None
+        self.frame_count += 1
+        gray = cv2.cvtColor(cv2.resize(img, (640, 480)), cv2.COLOR_BGR2GRAY)
+
+        pos, yaw, speed, vel = unpack_state(state)
+        _, _, part_flows, features_detected = self.tracker.process(
+            gray, dt, speed, state.kinematics_estimated.angular_velocity)
+        obstacle, (smooth_L, smooth_C, smooth_R) = self.detector.update(self.frame_count, part_flows)
+        self.state_str = self.policy.step(obstacle, smooth_L, smooth_C, smooth_R)
+        self.log_file.write(format_log_row(
+            self.frame_count, time_now, time_now - self.start_time, pos, yaw, vel, speed,
+            obstacle, features_detected, smooth_L, smooth_C, smooth_R, self.state_str,
+            self.policy.safe_counter, sim_time,
+        ))
+        return self.state_str
+
+    def close(self):
+        self.log_file.close()
+
+
+class FleetScheduler:
+    """Run a list of :class:`VehiclePipeline` objects against one client."""
+
+    def __init__(self, client, pipelines):
+        self.client = client
+        self.pipelines = pipelines
+        self.rounds = 0
+
+    def tick(self):
+        """Run one frame of every vehicle."""
+        rpc = self.client.client
+        pending = [
+            (p, rpc.call_async('getMultirotorState', p.vehicle_name),
+             rpc.call_async('simGetImages', p.requests, p.vehicle_name, False))
+            for p in self.pipelines
+        ]
+        for pipeline, state_future, images_future in pending:
+            state = MultirotorState.from_msgpack(state_future.get())
+            responses = [ImageResponse.from_msgpack(r) for r in images_future.get()]
+            pipeline.step(state, responses[0])
+        self.rounds += 1
+
+    def run(self, frames=None, should_stop=lambda: False):
+        start = time.perf_counter()
+        while not should_stop() and (frames is None or self.rounds < frames):
+            self.tick()
+        return time.perf_counter() - start
+
+    def close(self):
+        for pipeline in self.pipelines:
+            pipeline.close()
+
+
+def prepare_vehicles(client, count, names=None, spacing=4.0):
+    """Return ``count`` vehicle names, spawning missing vehicles side by side."""
+    existing = client.listVehicles()
+    names = list(names or existing)
+    index = 1
+    while len(names) < count:
+        candidate = f"Drone{index}"
+        index += 1
+        if candidate not in names:
+            names.append(candidate)
+    names = names[:count]
+    for i, name in enumerate(names):
+        if name not in existing:
+            pose = airsim.Pose(airsim.Vector3r(0.0, i * spacing, 0.0))
+            client.simAddVehicle(name, "simpleflight", pose)
+    for name in names:
+        client.enableApiControl(True, name)
+        client.armDisarm(True, name)
+    for future in [client.takeoffAsync(vehicle_name=name) for name in names]:
+        future.join()
+    for future in [client.moveToZAsync(-2, 2, vehicle_name=name) for name in names]:
+        future.join()
+    return names
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Fly several vehicles with one pipeline each")
+    parser.add_argument('--ip', default='')
+    parser.add_argument('--port', type=int, default=41451)
+    parser.add_argument('--vehicles', type=int, default=2)
+    parser.add_argument('--names', help="comma separated vehicle names (default: existing, then Drone1..N)")
+    parser.add_argument('--spacing', type=float, default=4.0, help="lateral spacing of spawned vehicles (m)")
+    parser.add_argument('--frames', type=int, help="stop after this many rounds")
+    parser.add_argument('--camera', default="oakd_camera")
+    parser.add_argument('--ego-motion', choices=['homography', 'affine', 'gyro'],
+                        help="remove global rotational flow before partition averaging")
+    args = parser.parse_args(argv)
+
+    client = airsim.MultirotorClient(args.ip, args.port)
+    client.confirmConnection()
+    names = prepare_vehicles(client, args.vehicles, args.names.split(',') if args.names else None,
+                             args.spacing)
+
+    log_dir = f"flow_logs/fleet_{datetime.now().strftime('%Y%m%d_%H%M%S')}"
+    os.makedirs(log_dir, exist_ok=True)
+    pipelines = [VehiclePipeline(client, name, os.path.join(log_dir, f"{name}.csv"), camera=args.camera,
+                                 ego_motion=args.ego_motion)
+                 for name in names]
+    scheduler = FleetScheduler(client, pipelines)
+    elapsed = 0.0
+    try:
+        elapsed = scheduler.run(args.frames)
+    except KeyboardInterrupt:
+        print("Interrupted.")
+    finally:
+        scheduler.close()
+        for name in names:
+            try:
+                client.landAsync(vehicle_name=name)
+            except Exception as e:
+                print(f"Landing error ({name}):", e)
+    frames = sum(p.frame_count for p in pipelines)
+    if elapsed > 0:
+        print(f"{len(names)} vehicles, {frames} frames in {elapsed:.1f}s "
+              f"({frames / elapsed:.1f} FPS total, {scheduler.rounds / elapsed:.1f} rounds/s)")
+    for pipeline in pipelines:
+        print(f"  {pipeline.vehicle_name}: {pipeline.frame_count} frames, last state {pipeline.state_str}")
+        if pipeline.compensator is not None:
+            print(f"    {pipeline.compensator.summary()}")
+    print(f"Logs written to {log_dir}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,209 @@
+# uav/flow_eval.py
+"""Score sparse LK configurations against ground-truth optical flow.
+
+Frame pairs with ground-truth flow are captured once and every
+configuration is evaluated on the same pairs.  Sources:
+
+``standin``
+    The local stand-in in lockstep; flow comes from its known geometry.
+``airsim``
+    A running simulator.  The scene and ``ImageType.OpticalFlow`` (float)
+    are requested in one ``simGetImages`` call, one rendered frame apart.
+``synthetic:<scenario>``
+    Procedural frames from :mod:`uav.synthetic`.
+
+For each configuration and ROI partition the harness reports the mean
+endpoint error of the tracked points, the error of the partition flow
+magnitude that ``track_and_detect_obstacle`` returns against the
+ground-truth flow at the same points, and against the dense ground-truth
+mean of the partition.
+
+Usage::
+
+    python -m uav.flow_eval --source standin --frames 60 --win-size 9,15,21 --max-level 1,2
+    python -m uav.flow_eval --source airsim --camera oakd_camera --output flow_eval.json
+"""
+import argparse
+import json
+import time
+
+import airsim
+import cv2
+import numpy as np
+from airsim import ImageRequest, ImageType
+
+from uav.sweep import CASTS, grid, replay_params
+from uav.synthetic import SCENARIOS, sample_flow, scenario
+from uav.utils import partition_roi, scaled_roi
+from sparse_optical_flow_utils import initialize_sparse_features, track_and_detect_obstacle
+
+# Sweep parameters that change the flow estimate
+FLOW_PARAMS = ('max_corners', 'quality_level', 'win_size', 'max_level')
+RESULT_FIELDS = list(FLOW_PARAMS) + [
+    'partition', 'points', 'epe_px', 'magnitude_error_px', 'dense_error_px', 'us_per_call',
+]
+
+
+def capture_simulator(client, frames, camera="0", speed=2.0, yaw_rate=0.0, warmup=15, flow_scale=1.0):
+    """Fly forward in lockstep and return ``(prev_gray, curr_gray, flow)`` triples.
+
+    The simulation is advanced one rendered frame per capture, so the
+    ground-truth flow of each capture describes the motion since the
+    previous one.  ``flow_scale`` converts the simulator's flow units to
+    pixels (use a negative value if it points from current to previous).
+    """
+    requests = [ImageRequest(camera, ImageType.Scene, False, True),
+                ImageRequest(camera, ImageType.OpticalFlow, True, False)]
+    client.enableApiControl(True)
+    client.armDisarm(True)
+    client.takeoffAsync().join()
+    client.simPause(True)
+    yaw_mode = airsim.YawMode(True, yaw_rate)
+    client.moveByVelocityBodyFrameAsync(speed, 0, 0, (frames + warmup) / 10.0, yaw_mode=yaw_mode)
+    triples = []
+    prev = None
+    try:
+        for i in range(frames + warmup + 1):
+            client.simContinueForFrames(1)
+            scene, flow = client.simGetImages(requests)
+            if scene.width == 0 or flow.width == 0:
+                raise RuntimeError(f"empty image response: {flow.message or scene.message}")
+            img = cv2.imdecode(np.frombuffer(scene.image_data_uint8, np.uint8), cv2.IMREAD_GRAYSCALE)
+            if prev is not None and i > warmup:
+                triples.append((prev, img, airsim.get_flow_array(flow)[..., :2] * flow_scale))
+            prev = img
+    finally:
+        client.simPause(False)
+        client.hoverAsync()
+    return triples
+
+
+def capture_synthetic(name, frames, width=640, height=480):
+    sequence = list(scenario(name, width, height, frames + 1))
+    return [(prev, curr, flow) for (prev, flow), (curr, _) in zip(sequence, sequence[1:])]
+
+
+def partition_errors(good_old, good_new, flow, roi, partitions=3):
+    """Per-partition point count, endpoint error and flow magnitude error.
+
+    Points are assigned to partitions by their new position like
+    ``track_and_detect_obstacle`` does.  Returns a dict of arrays of length
+    ``partitions``; partitions without points hold NaN.
+    """
+    old = np.asarray(good_old, dtype=np.float32).reshape(-1, 2)
+    new = np.asarray(good_new, dtype=np.float32).reshape(-1, 2)
+    parts = partition_roi(roi, partitions)
+    x1, y1, x2, y2 = roi
+    inside = (new[:, 0] >= x1) & (new[:, 0] <= x2) & (new[:, 1] >= y1) & (new[:, 1] <= y2)
+    old, new = old[inside], new[inside]
+    estimate = new - old
+    truth = sample_flow(flow, old)
+    index = np.searchsorted(np.array([p[2] for p in parts[:-1]]), new[:, 0], side='right')
+    counts = np.bincount(index, minlength=partitions).astype(np.float64)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        epe = np.bincount(index, np.linalg.norm(estimate - truth, axis=1), partitions) / counts
+        est_mag = np.bincount(index, np.linalg.norm(estimate, axis=1), partitions) / counts
+        true_mag = np.bincount(index, np.linalg.norm(truth, axis=1), partitions) / counts
+    magnitude = np.linalg.norm(flow, axis=2)
+    dense = np.array([magnitude[py1:py2, px1:px2].mean() for px1, py1, px2, py2 in parts])
+    return {
+        'points': counts.astype(int),
+        'epe': epe,
+        'magnitude_error': est_mag - true_mag,
+        'dense_error': np.where(counts > 0, est_mag, 0.0) - dense,
+    }
+
+
+def evaluate(triples, config, roi, partitions=3):
+    """Run ``track_and_detect_obstacle`` with ``config`` on every pair and aggregate."""
+    params = replay_params(config)
+    totals = {key: [] for key in ('points', 'epe', 'magnitude_error', 'dense_error')}
+    times = []
+    for prev, curr, flow in triples:
+        pts = initialize_sparse_features(prev, params['feature_params'])
+        if pts is None:
+            continue
+        start = time.perf_counter_ns()
+        _, good_old, good_new, _ = track_and_detect_obstacle(
+            prev, curr, pts, roi, partitions, flow_params=params['flow_params'])
+        times.append((time.perf_counter_ns() - start) / 1000.0)
+        for key, values in partition_errors(good_old, good_new, flow, roi, partitions).items():
+            totals[key].append(values)
+    rows = []
+    points = np.sum(totals['points'], axis=0) if times else np.zeros(partitions, dtype=int)
+    for p in range(partitions):
+        row = {name: config[name] for name in FLOW_PARAMS}
+        row.update(partition=p, points=int(points[p]),
+                   us_per_call=float(np.median(times)) if times else float('nan'))
+        for key in ('epe', 'magnitude_error', 'dense_error'):
+            values = np.array([v[p] for v in totals[key]], dtype=np.float64) if times else np.empty(0)
+            weights = np.array([v[p] for v in totals['points']], dtype=np.float64) if times else np.empty(0)
+            ok = ~np.isnan(values) & (weights > 0)
+            field = 'epe_px' if key == 'epe' else f"{key}_px"
+            row[field] = float(np.average(np.abs(values[ok]), weights=weights[ok])) if ok.any() else float('nan')
+        rows.append(row)
+    return rows
+
+
+def print_table(rows):
+    header = list(FLOW_PARAMS) + ['part', 'points', 'epe', 'mag_err', 'dense_err', 'us/call']
+    print("  ".join(f"{h:>9}" for h in header))
+    for r in rows:
+        values = [r[name] for name in FLOW_PARAMS] + [
+            r['partition'], r['points'],
+            f"{r['epe_px']:.3f}", f"{r['magnitude_error_px']:.3f}", f"{r['dense_error_px']:.3f}",
+            f"{r['us_per_call']:.0f}",
+        ]
+        print("  ".join(f"{v:>9}" for v in values))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Score LK configurations against ground-truth flow")
+    parser.add_argument('--source', default='standin',
+                        help="standin, airsim or synthetic:<%s>" % "|".join(SCENARIOS))
+    parser.add_argument('--ip', default='')
+    parser.add_argument('--port', type=int, default=41451)
+    parser.add_argument('--camera', default="0")
+    parser.add_argument('--frames', type=int, default=30)
+    parser.add_argument('--speed', type=float, default=2.0, help="forward speed while capturing (m/s)")
+    parser.add_argument('--yaw-rate', type=float, default=0.0, help="yaw rate while capturing (deg/s)")
+    parser.add_argument('--flow-scale', type=float, default=1.0,
+                        help="multiplier from the simulator's flow units to pixels")
+    parser.add_argument('--partitions', type=int, default=3)
+    for name in FLOW_PARAMS:
+        parser.add_argument('--' + name.replace('_', '-'), help="comma separated values")
+    parser.add_argument('--output', help="write the rows to this JSON file")
+    args = parser.parse_args(argv)
+
+    if args.source.startswith('synthetic:'):
+        triples = capture_synthetic(args.source.split(':', 1)[1], args.frames)
+    else:
+        port = args.port
+        if args.source == 'standin':
+            from uav.standin import StandInSimulator, start_background
+            # Binary float payloads: a float list of a 640x480x2 flow image is slow to unpack
+            start_background(StandInSimulator(binary_floats=True), port)
+        client = airsim.MultirotorClient(args.ip, port)
+        client.confirmConnection()
+        triples = capture_simulator(client, args.frames, args.camera, args.speed, args.yaw_rate,
+                                    flow_scale=args.flow_scale)
+    height, width = triples[0][0].shape[:2]
+    roi = scaled_roi(width, height)
+
+    values = {}
+    for name in FLOW_PARAMS:
+        raw = getattr(args, name)
+        if raw:
+            values[name] = [CASTS[name](v) for v in raw.split(',')]
+    rows = []
+    for config in grid(values):
+        rows.extend(evaluate(triples, config, roi, args.partitions))
+    print(f"{len(triples)} frame pairs from {args.source}, ROI {roi}")
+    print_table(rows)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(rows, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,317 @@
+# uav/framestore.py
+"""Chunked memory-mapped store of raw grayscale frames for offline replay.
+
+A session directory holds::
+
+    meta.json            frame size, chunk size and frame count
+    frames_00000.npy     (chunk_size, H, W) uint8 frames
+    records_00000.npy    per-frame kinematics, timestamps and state
+    commands.jsonl       motion commands issued, tagged with the frame index
+                         they were issued for
+    depth.pfms           optional float depth per frame, a multi-frame PFM
+                         container (see ``airsim.pfm``)
+    labels.npy           optional (count, partitions) float32 obstacle
+                         coverage per ROI partition from segmentation images
+                         (see ``uav.labels``); how they were made is kept
+                         under ``labels`` in meta.json
+
+Chunks are standard ``.npy`` files so they can be memory-mapped by the reader
+and streamed back without copying.
+"""
+import json
+import os
+import time
+
+import numpy as np
+
+from airsim.pfm import PfmSequenceReader, PfmSequenceWriter
+
+DEPTH_FILE = "depth.pfms"
+LABELS_FILE = "labels.npy"
+RECORD_DTYPE = np.dtype([
+    ('frame', np.int32),
+    ('wall_time', np.float64),
+    ('sim_time', np.float64),
+    ('pos', np.float32, 3),
+    ('vel', np.float32, 3),
+    ('orientation', np.float32, 4),  # camera orientation at capture: w, x, y, z
+    ('yaw', np.float32),
+    ('speed', np.float32),
+    ('state', 'U24'),
+])
+
+# RPC names treated as commands by record_commands()
+COMMAND_PREFIXES = ('move', 'takeoff', 'land', 'hover', 'rotate', 'goHome', 'reset',
+                    'simSetVehiclePose', 'simSetKinematics')
+
+
+class FrameStoreWriter:
+    """Append grayscale frames and their metadata to a session directory.
+
+    Parameters
+    ----------
+    path : str
+        Session directory, created if missing.
+    width, height : int
+        Frame size.  Every appended frame must have shape ``(height, width)``.
+    chunk_size : int
+        Number of frames per memory-mapped chunk file.
+
+    Raises ``FileExistsError`` if ``path`` already holds a session, which
+    would otherwise be overwritten (and its depth file appended to).
+    """
+
+    def __init__(self, path, width=640, height=480, chunk_size=256):
+        self.path = path
+        self.width = width
+        self.height = height
+        self.chunk_size = chunk_size
+        self.count = 0
+        self._frames = None
+        self._records = None
+        self._depth = None
+        self._depth_shape = None
+        if os.path.exists(os.path.join(path, "meta.json")):
+            raise FileExistsError(f"{path} already holds a recorded session")
+        os.makedirs(path, exist_ok=True)
+        self._commands = open(os.path.join(path, "commands.jsonl"), "w")
+        self._write_meta()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _write_meta(self):
+        meta = {
+            'version': 1,
+            'width': self.width,
+            'height': self.height,
+            'chunk_size': self.chunk_size,
+            'count': self.count,
+        }
+        with open(os.path.join(self.path, "meta.json"), "w") as f:
+            json.dump(meta, f, indent=2)
+
+    def _open_chunk(self, index):
+        if self._frames is not None:
+            self._frames.flush()
+            self._records.flush()
+            # Keep the count current so a crash loses at most one chunk
+            self._write_meta()
+        self._frames = np.lib.format.open_memmap(
+            os.path.join(self.path, f"frames_{index:05d}.npy"), mode='w+',
+            dtype=np.uint8, shape=(self.chunk_size, self.height, self.width))
+        self._records = np.lib.format.open_memmap(
+            os.path.join(self.path, f"records_{index:05d}.npy"), mode='w+',
+            dtype=RECORD_DTYPE, shape=(self.chunk_size,))
+
+    def append(self, gray, sim_time=0.0, pos=(0, 0, 0), vel=(0, 0, 0),
+               orientation=(1, 0, 0, 0), yaw=0.0, speed=0.0, state='',
+               wall_time=None, depth=None):
+        """Store one frame and return its index.
+
+        Once a ``depth`` image has been stored every later frame gets one
+        too (NaN where none is given) so depth stays indexed by frame.
+        """
+        if depth is not None or self._depth is not None:
+            self._append_depth(depth)
+        slot = self.count % self.chunk_size
+        if slot == 0:
+            self._open_chunk(self.count // self.chunk_size)
+        self._frames[slot] = gray
+        rec = self._records[slot]
+        rec['frame'] = self.count
+        rec['wall_time'] = time.time() if wall_time is None else wall_time
+        rec['sim_time'] = sim_time
+        rec['pos'] = pos
+        rec['vel'] = vel
+        rec['orientation'] = orientation
+        rec['yaw'] = yaw
+        rec['speed'] = speed
+        rec['state'] = state
+        self.count += 1
+        return self.count - 1
+
+    def _append_depth(self, depth):
+        if self._depth is None:
+            self._depth = PfmSequenceWriter(os.path.join(self.path, DEPTH_FILE))
+            self._depth_shape = depth.shape
+            # Frames stored before depth was available
+            for _ in range(self.count):
+                self._depth.append(np.full(self._depth_shape, np.nan, dtype=np.float32))
+        if depth is None:
+            depth = np.full(self._depth_shape, np.nan, dtype=np.float32)
+        self._depth.append(np.asarray(depth, dtype=np.float32))
+
+    def log_command(self, name, args=()):
+        """Record a command issued while processing the next frame to be appended.
+
+        Commands sent after :meth:`close` are not recorded.
+        """
+        if self._commands.closed:
+            return
+        self._commands.write(json.dumps({
+            'frame': self.count, 'time': time.time(), 'name': name,
+            'args': [a if isinstance(a, (int, float, str, bool)) or a is None else repr(a) for a in args],
+        }) + "\n")
+
+    def close(self):
+        if self._frames is not None:
+            self._frames.flush()
+            self._records.flush()
+            self._frames = self._records = None
+        if not self._commands.closed:
+            self._commands.close()
+        if self._depth is not None:
+            self._depth.close()
+        self._write_meta()
+
+
+class FrameStoreReader:
+    """Read a session written by :class:`FrameStoreWriter`.
+
+    Frames are returned as read-only views into the memory-mapped chunks, so
+    iterating a session does not copy pixel data.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, "meta.json")) as f:
+            self.meta = json.load(f)
+        self.width = self.meta['width']
+        self.height = self.meta['height']
+        self.chunk_size = self.meta['chunk_size']
+        self.count = self.meta['count']
+        self._chunks = {}
+        self._depth = None
+
+    def __len__(self):
+        return self.count
+
+    def _chunk(self, index):
+        chunk = self._chunks.get(index)
+        if chunk is None:
+            chunk = (
+                np.load(os.path.join(self.path, f"frames_{index:05d}.npy"), mmap_mode='r'),
+                np.load(os.path.join(self.path, f"records_{index:05d}.npy"), mmap_mode='r'),
+            )
+            self._chunks[index] = chunk
+        return chunk
+
+    def frame(self, index):
+        if not 0 <= index < self.count:
+            raise IndexError(index)
+        return self._chunk(index // self.chunk_size)[0][index % self.chunk_size]
+
+    def record(self, index):
+        if not 0 <= index < self.count:
+            raise IndexError(index)
+        return self._chunk(index // self.chunk_size)[1][index % self.chunk_size]
+
+    def records(self):
+        """Return all per-frame records as one structured array."""
+        chunks = [self._chunk(i)[1] for i in range((self.count + self.chunk_size - 1) // self.chunk_size)]
+        if not chunks:
+            return np.empty(0, dtype=RECORD_DTYPE)
+        return np.concatenate(chunks)[:self.count]
+
+    def iter_frames(self, start=0, stop=None):
+        """Yield ``(index, frame, record)`` tuples in order."""
+        stop = self.count if stop is None else min(stop, self.count)
+        for index in range(start, stop):
+            frames, records = self._chunk(index // self.chunk_size)
+            slot = index % self.chunk_size
+            yield index, frames[slot], records[slot]
+
+    @property
+    def has_depth(self):
+        return os.path.exists(os.path.join(self.path, DEPTH_FILE))
+
+    def depth(self, index):
+        """Depth image of frame ``index`` (memory-mapped), or ``None`` if not recorded."""
+        if not 0 <= index < self.count:
+            raise IndexError(index)
+        if self._depth is None:
+            if not self.has_depth:
+                return None
+            self._depth = PfmSequenceReader(os.path.join(self.path, DEPTH_FILE))
+        return self._depth[index]
+
+    @property
+    def has_labels(self):
+        return os.path.exists(os.path.join(self.path, LABELS_FILE))
+
+    def labels(self):
+        """Return ``(coverage, params)`` written by :func:`write_labels`, or ``None``.
+
+        ``coverage`` is a memory-mapped ``(count, partitions)`` array.
+        """
+        if not self.has_labels:
+            return None
+        return np.load(os.path.join(self.path, LABELS_FILE), mmap_mode='r'), self.meta.get('labels', {})
+
+    def commands(self):
+        path = os.path.join(self.path, "commands.jsonl")
+        if not os.path.exists(path):
+            return []
+        with open(path) as f:
+            return [json.loads(line) for line in f if line.strip()]
+
+
+def write_labels(path, coverage, **params):
+    """Store per-frame obstacle coverage for the session at ``path``.
+
+    ``params`` (ROI, partitions, object pattern, ...) are recorded in
+    meta.json so scores can say what the labels mean.
+    """
+    coverage = np.asarray(coverage, dtype=np.float32)
+    meta_path = os.path.join(path, "meta.json")
+    with open(meta_path) as f:
+        meta = json.load(f)
+    if len(coverage) != meta['count']:
+        raise ValueError(f"{len(coverage)} labels for {meta['count']} frames")
+    np.save(os.path.join(path, LABELS_FILE), coverage)
+    meta['labels'] = params
+    with open(meta_path, "w") as f:
+        json.dump(meta, f, indent=2)
+
+
+class _CommandRecordingRpcClient:
+    """Proxy around ``msgpackrpc.Client`` logging motion commands."""
+
+    def __init__(self, rpc, writer):
+        self._rpc = rpc
+        self._writer = writer
+
+    def _log(self, method, args):
+        if method.startswith(COMMAND_PREFIXES):
+            self._writer.log_command(method, args)
+
+    def call(self, method, *args):
+        self._log(method, args)
+        return self._rpc.call(method, *args)
+
+    def call_async(self, method, *args):
+        self._log(method, args)
+        return self._rpc.call_async(method, *args)
+
+    def __getattr__(self, name):
+        return getattr(self._rpc, name)
+
+
+def record_commands(client, writer):
+    """Log every motion command sent through ``client`` into ``writer``."""
+    if isinstance(client.client, _CommandRecordingRpcClient):
+        client.client._writer = writer
+    else:
+        client.client = _CommandRecordingRpcClient(client.client, writer)
+    return client
+
+
+def stop_recording_commands(client):
+    """Undo :func:`record_commands`, putting back the original rpc client."""
+    if isinstance(client.client, _CommandRecordingRpcClient):
+        client.client = client.client._rpc
+    return client
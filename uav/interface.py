@@ -1,10 +1,12 @@
 # uav/interface.py
-import tkinter as tk
 from threading import Thread
 
 exit_flag = [False]
 
 def launch_control_gui(param_refs):
+    # Imported here so headless runs work on hosts without Tk
+    import tkinter as tk
+
     def on_stop():
         exit_flag[0] = True
 
@@ -37,6 +39,8 @@ def start_gui(param_refs=None):
         Thread(target=lambda: launch_control_gui(param_refs), daemon=True).start()
 
 def gui_exit():
+    import tkinter as tk
+
     root = tk.Tk()
     root.title("Stop UAV")
     root.geometry("200x100")
@@ -0,0 +1,233 @@
+# uav/labels.py
+"""Ground-truth obstacle labels from segmentation and detector scoring.
+
+Labelling revisits every recorded pose of a frame-store session (see
+:mod:`uav.framestore`) in a paused simulator, captures a ``Segmentation``
+image after giving the obstacle meshes their own ID with
+``simSetSegmentationObjectID``, and stores the fraction of each ROI
+partition the obstacle covers.  A frame is labelled as an obstacle when the
+centre partition coverage reaches ``min_fraction``; the threshold is applied
+at scoring time, so it can be changed without labelling again.
+
+Scoring compares a decision trace (``uav.replay``) with the labels:
+
+* detection latency -- frames (and sim seconds) from the start of a
+  labelled episode to the first obstacle decision,
+* miss rate -- labelled episodes without any obstacle decision,
+* false-brake rate -- obstacle decision onsets outside labelled episodes.
+
+Usage::
+
+    python -m uav.labels label flow_logs/session_<timestamp> --object "Cube.*" --max-range 10
+    python -m uav.labels score flow_logs/session_<timestamp> --threshold 300
+    python -m uav.labels score flow_logs/session_<timestamp> --trace trace.csv
+"""
+import argparse
+import csv
+import json
+
+import airsim
+import cv2
+import numpy as np
+from airsim import ImageRequest, ImageType, Pose, Quaternionr, Vector3r
+
+from uav.egomotion import camera_mount, matrix_quaternion, quaternion_matrix
+from uav.framestore import FrameStoreReader, write_labels
+from uav.utils import partition_roi, scaled_roi
+
+
+def obstacle_mask(seg, color=None):
+    """Boolean mask of obstacle pixels in a BGR segmentation image.
+
+    Without ``color`` every pixel that is not black (ID 0) counts, which is
+    what remains after all other meshes were set to ID 0.
+    """
+    if color is None:
+        return seg.any(axis=2)
+    return (seg == np.asarray(color, dtype=seg.dtype)).all(axis=2)
+
+
+def coverage(mask, roi, partitions=3):
+    """Fraction of each ROI partition covered by ``mask``."""
+    parts = partition_roi(roi, partitions)
+    x1, y1, x2, y2 = roi
+    columns = mask[y1:y2, x1:x2].sum(axis=0, dtype=np.int64)
+    starts = [part[0] - x1 for part in parts]
+    widths = np.diff(starts + [x2 - x1])
+    return np.add.reduceat(columns, starts) / (widths * (y2 - y1)).astype(np.float64)
+
+
+def label_session(client, reader, camera="0", object_pattern=None, object_id=1,
+                  color=None, max_range=None, partitions=3, vehicle_name=''):
+    """Capture segmentation at every recorded pose and return ``(count, partitions)`` coverage.
+
+    With ``object_pattern`` every mesh is set to ID 0 and the matching
+    meshes to ``object_id`` first.  With ``max_range`` a ``DepthPlanar``
+    image is requested in the same call and obstacle pixels farther away
+    are ignored.  The recorded orientations are the camera's; the camera
+    mount read from ``simGetCameraInfo`` turns them back into vehicle poses.
+    """
+    if object_pattern:
+        client.simSetSegmentationObjectID(".*", 0, True)
+        if not client.simSetSegmentationObjectID(object_pattern, object_id, True):
+            raise ValueError(f"no mesh matches {object_pattern!r}")
+    requests = [ImageRequest(camera, ImageType.Segmentation, False, False)]
+    if max_range:
+        requests.append(ImageRequest(camera, ImageType.DepthPlanar, True, False))
+    result = np.zeros((len(reader), partitions), dtype=np.float32)
+    mount, _ = camera_mount(client, camera, vehicle_name)
+    client.simPause(True)
+    try:
+        for index, _, rec in reader.iter_frames():
+            w, x, y, z = matrix_quaternion(quaternion_matrix(rec['orientation']) @ mount.T)
+            pose = Pose(Vector3r(*map(float, rec['pos'])), Quaternionr(x, y, z, w))
+            client.simSetVehiclePose(pose, True, vehicle_name)
+            # Let the renderer pick up the new pose before capturing
+            client.simContinueForFrames(1)
+            responses = client.simGetImages(requests, vehicle_name)
+            seg = responses[0]
+            if seg.width == 0:
+                raise RuntimeError(f"empty segmentation image: {seg.message}")
+            mask = obstacle_mask(airsim.string_to_uint8_array(seg.image_data_uint8)
+                                 .reshape(seg.height, seg.width, -1)[..., :3], color)
+            if max_range:
+                depth = airsim.get_pfm_array(responses[1])
+                if depth.shape != mask.shape:
+                    depth = cv2.resize(depth, (seg.width, seg.height), interpolation=cv2.INTER_NEAREST)
+                mask &= depth <= max_range
+            result[index] = coverage(mask, scaled_roi(seg.width, seg.height), partitions)
+    finally:
+        client.simPause(False)
+    return result
+
+
+def _onsets(flags):
+    return np.flatnonzero(flags & ~np.concatenate(([False], flags[:-1])))
+
+
+def score(detected, labels, sim_time=None, lead=0):
+    """Detection latency, miss rate and false-brake rate of per-frame decisions.
+
+    Parameters
+    ----------
+    detected, labels : array_like of bool
+        Obstacle decision and ground-truth label per frame.
+    sim_time : array_like, optional
+        Simulator time per frame, for latencies and rates in seconds.
+    lead : int
+        Decisions up to ``lead`` frames before an episode starts count as
+        (early) detections of it rather than false brakes.
+    """
+    detected = np.asarray(detected, dtype=bool)
+    labels = np.asarray(labels, dtype=bool)
+    n = len(labels)
+    starts = _onsets(labels)
+    ends = np.flatnonzero(labels & ~np.concatenate((labels[1:], [False]))) + 1
+    # First decision at or after each episode start (minus the lead), n if none
+    hits = np.append(np.flatnonzero(detected), n)
+    first = hits[np.searchsorted(hits, np.maximum(starts - lead, 0))]
+    found = first < ends
+    latency = first[found] - starts[found]
+
+    # A brake onset is false unless it falls inside an episode or its lead-in
+    brakes = _onsets(detected)
+    next_start = np.append(starts, np.iinfo(np.int64).max)[np.searchsorted(starts, brakes)]
+    false_brakes = int((~labels[brakes] & (next_start - brakes > lead)).sum())
+
+    result = {
+        'frames': n,
+        'episodes': len(starts),
+        'detected': int(found.sum()),
+        'miss_rate': float(1.0 - found.mean()) if len(starts) else float('nan'),
+        'latency_frames_mean': float(latency.mean()) if len(latency) else float('nan'),
+        'latency_frames_max': int(latency.max()) if len(latency) else None,
+        'brake_onsets': len(brakes),
+        'false_brakes': false_brakes,
+        'false_brake_rate': false_brakes / len(brakes) if len(brakes) else 0.0,
+    }
+    if sim_time is not None and n:
+        sim_time = np.asarray(sim_time, dtype=np.float64)
+        seconds = sim_time[first[found]] - sim_time[starts[found]]
+        result['latency_s_mean'] = float(seconds.mean()) if len(seconds) else float('nan')
+        minutes = (sim_time[-1] - sim_time[0]) / 60.0
+        result['false_brakes_per_min'] = float(false_brakes / minutes) if minutes > 0 else float('nan')
+    return result
+
+
+def read_trace(path):
+    """Load a decision trace CSV written by ``uav.replay --trace``."""
+    with open(path, newline='') as f:
+        rows = list(csv.DictReader(f))
+    for row in rows:
+        row['frame'] = int(row['frame'])
+        row['sim_time'] = float(row['sim_time'])
+        row['obstacle_detected'] = row['obstacle_detected'] == 'True'
+    return rows
+
+
+def score_trace(trace, cover, min_fraction=0.3, partition=None, lead=0):
+    """Score a replay trace (1-based ``frame``) against session coverage."""
+    cover = np.asarray(cover)
+    partition = cover.shape[1] // 2 if partition is None else partition
+    index = np.array([row['frame'] - 1 for row in trace], dtype=np.int64)
+    detected = np.array([row['obstacle_detected'] for row in trace], dtype=bool)
+    sim_time = np.array([row['sim_time'] for row in trace], dtype=np.float64)
+    labels = cover[index, partition] >= min_fraction
+    return score(detected, labels, sim_time, lead)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Segmentation labels and detector latency scoring")
+    sub = parser.add_subparsers(dest='command', required=True)
+    lab = sub.add_parser('label', help="capture segmentation labels for a recorded session")
+    lab.add_argument('session')
+    lab.add_argument('--ip', default='')
+    lab.add_argument('--port', type=int, default=41451)
+    lab.add_argument('--camera', default="oakd_camera")
+    lab.add_argument('--object', help="regex of obstacle mesh names (default: keep the scene's IDs)")
+    lab.add_argument('--object-id', type=int, default=1)
+    lab.add_argument('--color', help="B,G,R of the obstacle in the segmentation image (default: not black)")
+    lab.add_argument('--max-range', type=float, help="ignore obstacle pixels farther than this (m)")
+    lab.add_argument('--partitions', type=int, default=3)
+    sc = sub.add_parser('score', help="score decisions against stored labels")
+    sc.add_argument('session')
+    sc.add_argument('--trace', help="decision trace CSV (default: replay the session)")
+    sc.add_argument('--min-fraction', type=float, default=0.3,
+                    help="centre partition coverage that makes a frame an obstacle frame")
+    sc.add_argument('--lead', type=int, default=0,
+                    help="frames before an episode in which a decision counts as early detection")
+    sc.add_argument('--threshold', type=float, default=350.0)
+    sc.add_argument('--grace-frames', type=int, default=10)
+    sc.add_argument('--safe-frames', type=int, default=5)
+    args = parser.parse_args(argv)
+
+    reader = FrameStoreReader(args.session)
+    if args.command == 'label':
+        client = airsim.MultirotorClient(args.ip, args.port)
+        client.confirmConnection()
+        color = tuple(int(c) for c in args.color.split(',')) if args.color else None
+        cover = label_session(client, reader, args.camera, args.object, args.object_id,
+                              color, args.max_range, args.partitions)
+        write_labels(args.session, cover, object=args.object, object_id=args.object_id,
+                     color=color, max_range=args.max_range, partitions=args.partitions,
+                     camera=args.camera)
+        centre = cover[:, args.partitions // 2]
+        print(f"Labelled {len(cover)} frames; centre coverage max {centre.max():.2f}, "
+              f"mean {centre.mean():.2f}")
+        return
+
+    labels = reader.labels()
+    if labels is None:
+        raise SystemExit(f"{args.session} has no labels; run 'label' first")
+    cover, _ = labels
+    if args.trace:
+        trace = read_trace(args.trace)
+    else:
+        from uav.replay import replay_session
+        trace, _ = replay_session(reader, threshold=args.threshold, grace_frames=args.grace_frames,
+                                  safe_frames=args.safe_frames)
+    print(json.dumps(score_trace(trace, cover, args.min_fraction, lead=args.lead), indent=2))
+
+
+if __name__ == '__main__':
+    main()
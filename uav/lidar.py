@@ -0,0 +1,78 @@
+# uav/lidar.py
+"""Nearest LiDAR range per optical-flow ROI partition.
+
+Points are projected into the camera image with a pinhole model (the LiDAR
+is assumed to sit at the camera and look forward) and binned by the same
+vertical partitions the flow tracker uses, so the decision stage can compare
+flow and range sector by sector::
+
+    sectors = LidarSectors(roi, partitions=3)
+    ranges = sectors.nearest(get_point_cloud(client.getLidarData("lidar")))
+"""
+import math
+
+import numpy as np
+
+from uav.utils import partition_roi
+
+
+def to_sensor_frame(points, pose):
+    """Transform ``VehicleInertialFrame`` points into the sensor frame of ``pose``."""
+    q = pose.orientation
+    p = pose.position
+    w, x, y, z = q.w_val, q.x_val, q.y_val, q.z_val
+    # Rows of the sensor-to-world rotation; its transpose maps world to sensor
+    rot = np.array([
+        [1 - 2 * (y * y + z * z), 2 * (x * y - z * w), 2 * (x * z + y * w)],
+        [2 * (x * y + z * w), 1 - 2 * (x * x + z * z), 2 * (y * z - x * w)],
+        [2 * (x * z - y * w), 2 * (y * z + x * w), 1 - 2 * (x * x + y * y)],
+    ], dtype=np.float32)
+    offset = np.array([p.x_val, p.y_val, p.z_val], dtype=np.float32)
+    return (points - offset) @ rot
+
+
+class LidarSectors:
+    """Bin points into the ROI partitions and report the nearest range of each.
+
+    Parameters
+    ----------
+    roi : sequence
+        ``(x1, y1, x2, y2)`` in image pixels, as used by the flow tracker.
+    image_size : tuple
+        ``(width, height)`` of the camera image.
+    fov_deg : float
+        Horizontal field of view of the camera.
+    min_range, max_range : float
+        Points closer than ``min_range`` (the vehicle itself) are ignored;
+        empty sectors report ``max_range``.
+    """
+
+    def __init__(self, roi, partitions=3, image_size=(640, 480), fov_deg=90.0,
+                 min_range=0.3, max_range=100.0):
+        width, height = image_size
+        self.focal = (width / 2.0) / math.tan(math.radians(fov_deg) / 2.0)
+        self.cx, self.cy = width / 2.0, height / 2.0
+        self.min_range = min_range
+        self.max_range = max_range
+        parts = partition_roi(roi, partitions)
+        self.partitions = partitions
+        # Inner column boundaries for np.searchsorted
+        self.edges = np.array([part[2] for part in parts[:-1]], dtype=np.float32)
+        self.x1, self.y1, self.x2, self.y2 = roi
+
+    def nearest(self, points):
+        """Nearest range in metres per partition for sensor-frame ``(N, 3)`` points."""
+        nearest = np.full(self.partitions, self.max_range, dtype=np.float32)
+        if len(points) == 0:
+            return nearest.tolist()
+        x, y, z = points[:, 0], points[:, 1], points[:, 2]
+        ahead = x > 1e-3
+        inv_x = np.where(ahead, 1.0 / np.where(ahead, x, 1.0), 0.0)
+        u = self.cx + self.focal * y * inv_x
+        v = self.cy + self.focal * z * inv_x
+        rng = np.sqrt(x * x + y * y + z * z)
+        keep = ahead & (u >= self.x1) & (u < self.x2) & (v >= self.y1) & (v < self.y2) & (rng >= self.min_range)
+        if keep.any():
+            sector = np.searchsorted(self.edges, u[keep], side='right')
+            np.minimum.at(nearest, sector, rng[keep])
+        return nearest.tolist()
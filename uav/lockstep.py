@@ -0,0 +1,81 @@
+# uav/lockstep.py
+"""Deterministic lockstep stepping of the simulation.
+
+In real-time mode the time spent processing a frame changes how far the
+drone flies before the next command, so runs are not reproducible.  The
+:class:`LockstepDriver` keeps the simulation paused while a frame is
+captured, processed and commanded, then advances it by a fixed step::
+
+    driver = LockstepDriver(client, step=1 / 30)
+    driver.start()
+    while running:
+        driver.advance()
+        ...  # capture, process, command
+    driver.stop()
+
+Combined with a high ``ClockSpeed`` in ``settings.json`` batch runs finish
+faster than real time and repeat exactly.  Motion commands must not be
+joined while paused (see ``Navigator(client, blocking=False)``).
+"""
+import time
+
+from uav.logging import debug_print
+
+
+class LockstepDriver:
+    """Pause the simulation between frames and advance it by fixed steps.
+
+    Parameters
+    ----------
+    client : airsim.VehicleClient
+        Connected client.
+    step : float
+        Simulation seconds per frame, used when ``frames`` is not given.
+    frames : int, optional
+        Advance by this many rendered frames instead of by time.
+    timeout : float
+        Wall-clock seconds to wait for the simulation to pause again after
+        a step before giving up.
+    """
+
+    def __init__(self, client, step=1.0 / 30, frames=None, timeout=5.0):
+        self.client = client
+        self.step = step
+        self.frames = frames
+        self.timeout = timeout
+        self.active = False
+        self.steps = 0
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def start(self):
+        """Pause the simulation and enter lockstep mode."""
+        self.client.simPause(True)
+        self.active = True
+
+    def stop(self):
+        """Release the simulation back to real time."""
+        if self.active:
+            self.client.simPause(False)
+            self.active = False
+
+    def advance(self):
+        """Run the simulation for one step and wait until it pauses again."""
+        if not self.active:
+            return
+        if self.frames:
+            self.client.simContinueForFrames(self.frames)
+        else:
+            self.client.simContinueForTime(self.step)
+        deadline = time.monotonic() + self.timeout
+        while not self.client.simIsPause():
+            if time.monotonic() > deadline:
+                raise TimeoutError(f"simulation did not pause within {self.timeout:.1f}s")
+            time.sleep(0.001)
+        self.steps += 1
+        debug_print(f"⏭ Lockstep step {self.steps}")
@@ -5,3 +5,22 @@ DEBUG_LOGGING = os.environ.get("DEBUG_LOGGING", "0") == "1"
 def debug_print(*args, **kwargs):
     if DEBUG_LOGGING:
         print(*args, **kwargs)
+
+# Columns of the per-run flow_logs/sparse_log_*.csv files
+LOG_HEADER = (
+    "frame,abs_time,rel_time,pos_x,pos_y,pos_z,yaw,vx,vy,vz,speed,obstacle_detected,"
+    "features_detected,flow_left,flow_center,flow_right,state,safe_counter,sim_time\n"
+)
+
+
+def format_log_row(frame_count, time_now, elapsed, pos, yaw, vel, speed, obstacle,
+                   features_detected, smooth_L, smooth_C, smooth_R, state_str,
+                   safe_counter, sim_time):
+    """Format one row matching :data:`LOG_HEADER`."""
+    return (
+        f"{frame_count},{time_now:.2f},{elapsed:.2f},"
+        f"{pos.x_val:.2f},{pos.y_val:.2f},{pos.z_val:.2f},"
+        f"{yaw:.2f},{vel.x_val:.2f},{vel.y_val:.2f},{vel.z_val:.2f},{speed:.2f},"
+        f"{obstacle},{features_detected},"
+        f"{smooth_L:.2f},{smooth_C:.2f},{smooth_R:.2f},{state_str},{safe_counter},{sim_time:.3f}\n"
+    )
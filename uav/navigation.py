@@ -5,14 +5,45 @@ import airsim
 from uav.logging import debug_print
 
 class Navigator:
-    def __init__(self, client):
+    def __init__(self, client, blocking=True, vehicle_name=''):
         self.client = client
+        self.vehicle_name = vehicle_name
+        # Wait for motion commands to finish.  Lockstep mode turns this off
+        # because commands never complete while the simulation is paused.
+        self.blocking = blocking
         self.braked = False
         self.dodging = False
         self.last_movement_time = time.time()
 
+    def _wait(self, future):
+        if self.blocking:
+            future.join()
+
+    def reset(self):
+        self.braked = False
+        self.dodging = False
+        self.last_movement_time = time.time()
+
+    def teleport(self, pose):
+        """Put the vehicle back at ``pose`` at rest, without a land/takeoff cycle."""
+        debug_print("⏮ Teleporting to start pose")
+        self.client.cancelLastTask(self.vehicle_name)
+        self.client.simSetVehiclePose(pose, True, self.vehicle_name)
+        # Only instance attributes are serialized, so set every field
+        state = airsim.KinematicsState()
+        state.position = pose.position
+        state.orientation = pose.orientation
+        state.linear_velocity = airsim.Vector3r()
+        state.angular_velocity = airsim.Vector3r()
+        state.linear_acceleration = airsim.Vector3r()
+        state.angular_acceleration = airsim.Vector3r()
+        self.client.simSetKinematics(state, True, self.vehicle_name)
+        self.client.hoverAsync(self.vehicle_name)
+        self.reset()
+        return "reset"
+
     def get_state(self):
-        state = self.client.getMultirotorState()
+        state = self.client.getMultirotorState(vehicle_name=self.vehicle_name)
         pos = state.kinematics_estimated.position
         ori = state.kinematics_estimated.orientation
         yaw = math.degrees(airsim.to_eularian_angles(ori)[2])
@@ -22,7 +53,7 @@ class Navigator:
 
     def brake(self):
         debug_print("🛑 Braking")
-        self.client.moveByVelocityAsync(0, 0, 0, 1).join()
+        self._wait(self.client.moveByVelocityAsync(0, 0, 0, 1, vehicle_name=self.vehicle_name))
         self.braked = True
         return "brake"
 
@@ -39,18 +70,19 @@ class Navigator:
         strength = 0.5 if max(smooth_L, smooth_R) > 100 else 1.0
 
         # Cut existing motion before dodge
-        self.client.moveByVelocityBodyFrameAsync(0, 0, 0, 0.2).join()  # brief stop
+        self._wait(self.client.moveByVelocityBodyFrameAsync(0, 0, 0, 0.2, vehicle_name=self.vehicle_name))  # brief stop
 
         # Decide forward speed
         forward_speed = 0.0 if smooth_C > 1.0 else 0.3
 
         debug_print(f"🔀 Dodging {direction} (strength {strength:.1f}, forward {forward_speed:.1f})")
-        self.client.moveByVelocityBodyFrameAsync(
+        self._wait(self.client.moveByVelocityBodyFrameAsync(
             forward_speed,
             lateral * strength,
             0,
-            2.0
-        ).join()
+            2.0,
+            vehicle_name=self.vehicle_name,
+        ))
 
         self.dodging = True
         self.braked = False
@@ -62,7 +94,7 @@ class Navigator:
         debug_print("✅ Resuming forward motion")
         self.client.moveByVelocityAsync(2, 0, 0, duration=3,
             drivetrain=airsim.DrivetrainType.ForwardOnly,
-            yaw_mode=airsim.YawMode(False, 0))
+            yaw_mode=airsim.YawMode(False, 0), vehicle_name=self.vehicle_name)
         self.braked = False
         self.dodging = False
         self.last_movement_time = time.time()
@@ -82,6 +114,7 @@ class Navigator:
             duration=2,
             drivetrain=airsim.DrivetrainType.ForwardOnly,
             yaw_mode=airsim.YawMode(False, 0),
+            vehicle_name=self.vehicle_name,
         )
         pos_after, _, speed_after = self.get_state()
         debug_print(
@@ -95,7 +128,7 @@ class Navigator:
 
     def nudge(self):
         debug_print("⚠️ Low flow + zero velocity — nudging forward")
-        self.client.moveByVelocityAsync(0.5, 0, 0, 1).join()
+        self._wait(self.client.moveByVelocityAsync(0.5, 0, 0, 1, vehicle_name=self.vehicle_name))
         self.last_movement_time = time.time()
         return "nudge"
 
@@ -103,13 +136,13 @@ class Navigator:
         debug_print("🔁 Reinforcing forward motion")
         self.client.moveByVelocityAsync(2, 0, 0, duration=3,
             drivetrain=airsim.DrivetrainType.ForwardOnly,
-            yaw_mode=airsim.YawMode(False, 0))
+            yaw_mode=airsim.YawMode(False, 0), vehicle_name=self.vehicle_name)
         self.last_movement_time = time.time()
         return "resume_reinforce"
 
     def timeout_recover(self):
         debug_print("⏳ Timeout — forcing recovery motion")
-        self.client.moveByVelocityAsync(0.5, 0, 0, 1).join()
+        self._wait(self.client.moveByVelocityAsync(0.5, 0, 0, 1, vehicle_name=self.vehicle_name))
         self.last_movement_time = time.time()
         return "timeout_nudge"
 
@@ -0,0 +1,241 @@
+# uav/orchestrator.py
+"""Run batches of flights across several simulator instances.
+
+K worker processes each own one simulator instance on its own port (a
+launched Blocks build, an already running simulator, or the in-process
+stand-in) and pull jobs from a shared queue.  A job is a scenario plus a
+parameter set::
+
+    [
+      {"scenario": {"name": "wall20", "wall_x": 20}, "params": {"threshold": 300}, "frames": 300},
+      {"scenario": {"name": "wall30", "wall_x": 30, "seed": 3}, "frames": 300}
+    ]
+
+Every run writes a regular flow log and one row in ``flow_logs/catalog.csv``.
+
+Usage::
+
+    python -m uav.orchestrator jobs.json --instances 4 --backend standin
+    python -m uav.orchestrator jobs.json --instances 2 --backend blocks --base-port 41451
+    python -m uav.orchestrator jobs.json --backend attach --ports 41451,41452
+"""
+import argparse
+import csv
+import json
+import multiprocessing
+import os
+import subprocess
+import tempfile
+import time
+from datetime import datetime
+
+import airsim
+
+from uav.fleet import FleetScheduler, VehiclePipeline, prepare_vehicles
+from uav.startup import wait_for_simulator
+
+CATALOG_PATH = os.path.join("flow_logs", "catalog.csv")
+CATALOG_FIELDS = [
+    "run_id", "started", "backend", "port", "scenario", "params", "frames",
+    "obstacle_frames", "dodges", "brakes", "distance_m", "duration_s", "fps",
+    "log", "status", "error",
+]
+# Keyword arguments of VehiclePipeline a job may override
+PIPELINE_PARAMS = ("threshold", "grace_frames", "safe_frames", "partitions", "no_feature_limit", "roi")
+
+
+def load_jobs(path):
+    """Read jobs from a JSON list or a JSON-lines file.
+
+    Raises ``ValueError`` for params outside ``PIPELINE_PARAMS``, which a
+    run could not apply.
+    """
+    with open(path) as f:
+        text = f.read()
+    if text.lstrip().startswith('['):
+        jobs = json.loads(text)
+    else:
+        jobs = [json.loads(line) for line in text.splitlines() if line.strip()]
+    for index, job in enumerate(jobs):
+        unknown = sorted(set(job.get("params", {})) - set(PIPELINE_PARAMS))
+        if unknown:
+            raise ValueError(f"job {index}: unsupported params {', '.join(unknown)} "
+                             f"(supported: {', '.join(PIPELINE_PARAMS)})")
+    return jobs
+
+
+def launch_blocks(exe, port):
+    """Launch a Blocks instance serving the API on ``port``."""
+    settings = {"SettingsVersion": 1.2, "SimMode": "Multirotor"}
+    user_settings = os.path.join(os.path.expanduser("~"), "Documents", "AirSim", "settings.json")
+    if os.path.exists(user_settings):
+        with open(user_settings) as f:
+            settings = json.load(f)
+    settings["ApiServerPort"] = port
+    fd, path = tempfile.mkstemp(prefix=f"airsim_{port}_", suffix=".json")
+    with os.fdopen(fd, 'w') as f:
+        json.dump(settings, f)
+    return subprocess.Popen([exe, "-windowed", "-ResX=640", "-ResY=480", f"-settings={path}"])
+
+
+def _standin_renderer(scenario):
+    from uav.standin import SyntheticRenderer, VideoRenderer
+    if scenario.get("video"):
+        return VideoRenderer(scenario["video"])
+    return SyntheticRenderer(wall_x=scenario.get("wall_x", 30.0), seed=scenario.get("seed", 0))
+
+
+def summarize_log(path):
+    """Frame, obstacle and state counts plus distance flown from a flow log."""
+    with open(path, newline='') as f:
+        rows = list(csv.DictReader(f))
+    summary = {"frames": len(rows), "obstacle_frames": 0, "dodges": 0, "brakes": 0, "distance_m": 0.0}
+    if not rows:
+        return summary
+    summary["obstacle_frames"] = sum(1 for r in rows if r["obstacle_detected"] == "True")
+    summary["dodges"] = sum(1 for r in rows if r["state"].startswith("dodge"))
+    summary["brakes"] = sum(1 for r in rows if r["state"] == "brake")
+    first, last = rows[0], rows[-1]
+    summary["distance_m"] = round(sum(
+        (float(last[k]) - float(first[k])) ** 2 for k in ("pos_x", "pos_y", "pos_z")) ** 0.5, 2)
+    return summary
+
+
+def run_job(client, job, run_id, log_dir, simulator=None):
+    """Fly one job on a connected client and return its catalog row."""
+    scenario = job.get("scenario", {})
+    params = job.get("params", {})
+    if simulator is not None:
+        simulator.renderer = _standin_renderer(scenario)
+    client.reset()
+    name = prepare_vehicles(client, 1)[0]
+    if "start" in scenario:
+        x, y, z = scenario["start"]
+        client.simSetVehiclePose(airsim.Pose(airsim.Vector3r(x, y, z)), True, name)
+
+    log_path = os.path.join(log_dir, f"sparse_log_{run_id}.csv")
+    pipeline = VehiclePipeline(client, name, log_path, **params)
+    scheduler = FleetScheduler(client, [pipeline])
+    try:
+        elapsed = scheduler.run(job.get("frames", 300))
+    finally:
+        scheduler.close()
+        client.landAsync(vehicle_name=name)
+    row = summarize_log(log_path)
+    row.update({
+        "duration_s": round(elapsed, 2),
+        "fps": round(pipeline.frame_count / elapsed, 1) if elapsed > 0 else 0.0,
+        "log": log_path,
+    })
+    return row
+
+
+def _worker(backend, port, exe, clock_speed, jobs, results, log_dir):
+    simulator = sim_process = None
+    if backend == "standin":
+        from uav.standin import StandInSimulator, start_background
+        simulator = StandInSimulator(clock_speed=clock_speed)
+        start_background(simulator, port)
+    elif backend == "blocks":
+        sim_process = launch_blocks(exe, port)
+    try:
+        wait_for_simulator(port=port, process=sim_process)
+        client = airsim.MultirotorClient(port=port)
+        while True:
+            job = jobs.get()
+            if job is None:
+                break
+            job_index, job = job
+            run_id = f"{datetime.now().strftime('%Y%m%d_%H%M%S')}_{job_index:04d}_p{port}"
+            row = {
+                "run_id": run_id, "started": datetime.now().isoformat(timespec='seconds'),
+                "backend": backend, "port": port, "scenario": json.dumps(job.get("scenario", {})),
+                "params": json.dumps(job.get("params", {})), "status": "ok", "error": "",
+            }
+            try:
+                row.update(run_job(client, job, run_id, log_dir, simulator))
+            except Exception as e:
+                row.update(status="error", error=repr(e))
+            results.put(row)
+    finally:
+        if sim_process:
+            sim_process.terminate()
+
+
+def append_catalog(rows, path=CATALOG_PATH):
+    """Append run rows to the catalog, writing the header for a new file."""
+    new = not os.path.exists(path)
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with open(path, 'a', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=CATALOG_FIELDS, extrasaction='ignore')
+        if new:
+            writer.writeheader()
+        writer.writerows(rows)
+
+
+def orchestrate(jobs, ports, backend="standin", exe=None, clock_speed=1.0, log_dir="flow_logs"):
+    """Run ``jobs`` on one worker process per port and return the catalog rows."""
+    ctx = multiprocessing.get_context("spawn")
+    job_queue, results = ctx.Queue(), ctx.Queue()
+    for item in enumerate(jobs):
+        job_queue.put(item)
+    for _ in ports:
+        job_queue.put(None)
+    os.makedirs(log_dir, exist_ok=True)
+    workers = [ctx.Process(target=_worker, name=f"sim-{port}",
+                           args=(backend, port, exe, clock_speed, job_queue, results, log_dir))
+               for port in ports]
+    for w in workers:
+        w.start()
+    rows = []
+    while len(rows) < len(jobs):
+        if not any(w.is_alive() for w in workers) and results.empty():
+            break
+        try:
+            row = results.get(timeout=1.0)
+        except Exception:
+            continue
+        rows.append(row)
+        print(f"[{len(rows)}/{len(jobs)}] {row['run_id']} {row['status']} "
+              f"frames={row.get('frames', 0)} obstacles={row.get('obstacle_frames', 0)}"
+              + (f" error={row['error']}" if row['error'] else ""))
+    for w in workers:
+        w.join()
+    return rows
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run flight jobs across several simulator instances")
+    parser.add_argument('jobs', help="JSON or JSON-lines file of jobs")
+    parser.add_argument('--backend', choices=("standin", "blocks", "attach"), default="standin")
+    parser.add_argument('--instances', type=int, default=max(1, (os.cpu_count() or 2) // 2))
+    parser.add_argument('--base-port', type=int, default=41451)
+    parser.add_argument('--ports', help="comma separated ports of running simulators (attach backend)")
+    parser.add_argument('--exe', default=os.environ.get("BLOCKS_EXE_PATH"), help="Blocks executable")
+    parser.add_argument('--clock-speed', type=float, default=1.0, help="stand-in clock speed")
+    parser.add_argument('--repeat', type=int, default=1, help="run every job this many times")
+    parser.add_argument('--catalog', default=CATALOG_PATH)
+    args = parser.parse_args(argv)
+
+    if args.ports:
+        ports = [int(p) for p in args.ports.split(',')]
+    else:
+        ports = [args.base_port + i for i in range(args.instances)]
+    if args.backend == "blocks" and not args.exe:
+        parser.error("--exe or BLOCKS_EXE_PATH is required for the blocks backend")
+    try:
+        jobs = load_jobs(args.jobs) * args.repeat
+    except ValueError as e:
+        parser.error(str(e))
+
+    start = time.perf_counter()
+    rows = orchestrate(jobs, ports, args.backend, args.exe, args.clock_speed,
+                       os.path.dirname(args.catalog) or ".")
+    append_catalog(rows, args.catalog)
+    failed = sum(1 for r in rows if r["status"] != "ok")
+    print(f"{len(rows)} runs on {len(ports)} instances in {time.perf_counter() - start:.1f}s, "
+          f"{failed} failed; catalog: {args.catalog}")
+
+
+if __name__ == '__main__':
+    main()
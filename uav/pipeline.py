@@ -0,0 +1,796 @@
+# uav/pipeline.py
+"""Staged per-frame perception and navigation pipeline.
+
+A frame passes through a list of stages (capture, preprocess, flow, decide,
+optional TTC/depth/LiDAR checks, act, record, log).  Each stage fills in its part of a :class:`FrameResult`
+and returns it, or returns ``None`` to drop the frame (empty image,
+duplicate timestamp, decode failure).  How the stages are executed is up to
+the scheduler:
+
+``SerialScheduler``
+    One frame at a time, the stages in order.  This is the default and
+    behaves like the original ``main.py`` loop.
+``ThreadedScheduler``
+    One thread per stage with bounded queues between them, so capturing the
+    next frame overlaps processing the current one.  Stages that talk to the
+    simulator share one lock since an RPC client is not thread-safe.
+``ProcessScheduler``
+    Runs the CPU-heavy stages (preprocess and flow by default) in a child
+    process while the parent captures the next frame and acts on the
+    previous one.
+"""
+import multiprocessing
+import os
+import queue
+import signal
+import threading
+import time
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Any, List, Optional, Tuple
+
+import cv2
+import numpy as np
+from airsim import ImageRequest, ImageType, ImuData, LidarData, get_pfm_array, get_point_cloud
+
+from uav.framestore import FrameStoreWriter, record_commands, stop_recording_commands
+from uav.decision import DepthConfirmer
+from uav.lidar import LidarSectors, to_sensor_frame
+from uav.ttc import TimeToContact
+from uav.logging import LOG_HEADER, debug_print, format_log_row
+from uav.trace import tracer
+from uav.utils import FrameClock, partition_roi, unpack_state
+
+
+def _empty_points():
+    return np.empty((0, 2), dtype=np.float32)
+
+
+@dataclass
+class FrameResult:
+    """Everything known about one frame, filled in stage by stage."""
+    # capture
+    frame_count: int = 0
+    time_now: float = 0.0
+    sim_time: float = 0.0
+    sim_elapsed: float = 0.0
+    dt: float = 0.0
+    pos: Any = None
+    yaw: float = 0.0
+    speed: float = 0.0
+    vel: Any = None
+    angular_velocity: Any = None
+    response: Any = None
+    depth_response: Any = None
+    lidar: Any = None
+    # preprocess
+    img: Optional[np.ndarray] = None
+    gray: Optional[np.ndarray] = None
+    # flow
+    good_old: np.ndarray = field(default_factory=_empty_points)
+    good_new: np.ndarray = field(default_factory=_empty_points)
+    flow_new: Optional[np.ndarray] = None  # good_new minus compensated rotation
+    part_flows: List[float] = field(default_factory=list)
+    features_detected: int = 0
+    tracked_pts: Optional[np.ndarray] = None
+    # decide
+    obstacle: bool = False
+    smooth: Tuple[float, float, float] = (0.0, 0.0, 0.0)
+    depth: Optional[np.ndarray] = None
+    clearances: List[float] = field(default_factory=list)
+    lidar_ranges: List[float] = field(default_factory=list)
+    foe: Optional[Tuple[float, float]] = None
+    ttc: List[float] = field(default_factory=list)
+    # act
+    state_str: str = ""
+    safe_counter: int = 0
+
+
+class Stage:
+    """Base class of pipeline stages.
+
+    ``process`` returns the frame (or ``None`` to drop it), ``reset`` clears
+    per-episode state, ``open``/``close`` start and finish per-episode
+    outputs.  Stages with ``uses_client`` set issue simulator RPCs.
+    """
+    name = "stage"
+    uses_client = False
+
+    def process(self, frame):
+        return frame
+
+    def reset(self):
+        pass
+
+    def open(self, timestamp):
+        pass
+
+    def close(self):
+        pass
+
+
+class CaptureStage(Stage):
+    """Read vehicle state and the camera image, stamp the frame with sim time.
+
+    With ``depth`` set a float planar depth image is requested in the same
+    ``simGetImages`` call, so it costs no extra round trip.  With
+    ``lidar_name`` set the LiDAR request is sent before the image request
+    and both are answered on the same connection.  The body rates come from
+    the state, or from ``getImuData`` (sent the same way) with ``imu_name``.
+    """
+    name = "capture"
+    uses_client = True
+
+    def __init__(self, client, camera="oakd_camera", vehicle_name='', lockstep=None, depth=False,
+                 lidar_name=None, imu_name=None):
+        self.client = client
+        self.vehicle_name = vehicle_name
+        self.lockstep = lockstep
+        self.lidar_name = lidar_name
+        self.imu_name = imu_name
+        self.requests = [ImageRequest(camera, ImageType.Scene, False, True)]
+        if depth:
+            self.requests.append(ImageRequest(camera, ImageType.DepthPlanar, True, False))
+        self.frame_clock = FrameClock()
+        self.frame_count = 0
+        self.start_sim_time = None
+
+    def reset(self):
+        self.frame_clock.reset()
+        self.frame_count = 0
+        self.start_sim_time = None
+
+    def process(self, frame):
+        if self.lockstep is not None:
+            with tracer.span("step"):
+                self.lockstep.advance()
+        with tracer.span("state"):
+            state = self.client.getMultirotorState(vehicle_name=self.vehicle_name)
+            frame.pos, frame.yaw, frame.speed, frame.vel = unpack_state(state)
+            frame.angular_velocity = state.kinematics_estimated.angular_velocity
+        lidar_future = imu_future = None
+        if self.lidar_name is not None:
+            lidar_future = self.client.client.call_async('getLidarData', self.lidar_name, self.vehicle_name)
+        if self.imu_name is not None:
+            imu_future = self.client.client.call_async('getImuData', self.imu_name, self.vehicle_name)
+        responses = self.client.simGetImages(self.requests, self.vehicle_name)
+        if lidar_future is not None:
+            frame.lidar = LidarData.from_msgpack(lidar_future.get())
+        if imu_future is not None:
+            frame.angular_velocity = ImuData.from_msgpack(imu_future.get()).angular_velocity
+        response = responses[0]
+        if response.width == 0 or len(response.image_data_uint8) == 0:
+            print("⚠️ Empty image response")
+            return None
+
+        # dt between rendered frames from the simulator clock; a repeated
+        # timestamp means no new frame, so skip the whole flow pass
+        frame.time_now = time.time()
+        dt = self.frame_clock.tick(response.time_stamp, frame.time_now)
+        if dt is None:
+            debug_print(f"⏸ Duplicate frame at {response.time_stamp} skipped "
+                        f"({self.frame_clock.duplicates} total)")
+            return None
+        frame.dt = dt
+        frame.sim_time = self.frame_clock.last_time
+        if self.start_sim_time is None:
+            self.start_sim_time = frame.sim_time
+        frame.sim_elapsed = frame.sim_time - self.start_sim_time
+        self.frame_count += 1
+        frame.frame_count = self.frame_count
+        frame.response = response
+        if len(responses) > 1:
+            frame.depth_response = responses[1]
+        tracer.instant("frame", frame=frame.frame_count)
+        return frame
+
+
+class PreprocessStage(Stage):
+    """Decode the compressed image and convert it to grayscale.
+
+    With ``keep_color`` off the image is decoded straight to grayscale and
+    no colour frame is kept (nothing draws on it in headless runs).
+    """
+    name = "preprocess"
+
+    def __init__(self, size=(640, 480), keep_color=True):
+        self.size = size
+        self.keep_color = keep_color
+
+    def process(self, frame):
+        img1d = np.frombuffer(frame.response.image_data_uint8, dtype=np.uint8)
+        img = cv2.imdecode(img1d, cv2.IMREAD_COLOR if self.keep_color else cv2.IMREAD_GRAYSCALE)
+        if img is None:
+            print("❌ Failed to decode image")
+            return None
+        debug_print(f"🖼 Frame {frame.frame_count} captured and decoded")
+        if (img.shape[1], img.shape[0]) != self.size:
+            img = cv2.resize(img, self.size)
+        if self.keep_color:
+            frame.img = img
+            frame.gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+        else:
+            frame.gray = img
+        return frame
+
+
+class FlowStage(Stage):
+    """Sparse optical flow per ROI partition."""
+    name = "flow"
+
+    def __init__(self, tracker):
+        self.tracker = tracker
+
+    def reset(self):
+        self.tracker.reset()
+
+    def process(self, frame):
+        frame.good_old, frame.good_new, frame.part_flows, frame.features_detected = \
+            self.tracker.process(frame.gray, frame.dt, frame.speed, frame.angular_velocity)
+        frame.tracked_pts = self.tracker.prev_pts
+        frame.flow_new = self.tracker.flow_new
+        return frame
+
+
+class DecideStage(Stage):
+    """Smooth the partition flows and make the obstacle decision."""
+    name = "decide"
+
+    def __init__(self, detector):
+        self.detector = detector
+
+    def reset(self):
+        self.detector.reset()
+
+    def process(self, frame):
+        frame.obstacle, frame.smooth = self.detector.update(frame.frame_count, frame.part_flows)
+        return frame
+
+
+class TTCStage(Stage):
+    """Focus of expansion and per-partition time to contact.
+
+    ``brake_on`` says how the centre TTC enters the decision: ``"flow"``
+    leaves the flow decision alone (TTC is only shown), ``"ttc"`` replaces
+    it and ``"either"`` adds an obstacle when the centre TTC drops below
+    ``brake_ttc`` seconds.  Nothing is decided during ``grace_frames``.
+    The FOE is fitted to the flow with the tracker's ego-motion
+    compensation applied, so turns do not corrupt it.
+    """
+    name = "ttc"
+
+    def __init__(self, estimator, brake_ttc=2.0, brake_on="either", grace_frames=10):
+        if brake_on not in ("flow", "ttc", "either"):
+            raise ValueError(f"unknown brake_on {brake_on!r}")
+        self.estimator = estimator
+        self.brake_ttc = brake_ttc
+        self.brake_on = brake_on
+        self.grace_frames = grace_frames
+
+    def reset(self):
+        self.estimator.reset()
+
+    def process(self, frame):
+        good_new = frame.good_new if frame.flow_new is None else frame.flow_new
+        frame.foe, frame.ttc = self.estimator.estimate(frame.good_old, good_new, frame.dt)
+        if self.brake_on == "flow" or frame.frame_count < self.grace_frames:
+            return frame
+        close = frame.ttc[len(frame.ttc) // 2] < self.brake_ttc
+        if self.brake_on == "ttc":
+            frame.obstacle = close
+        elif close and not frame.obstacle:
+            debug_print(f"[DEBUG] TTC trigger: centre contact in {frame.ttc[len(frame.ttc) // 2]:.1f}s")
+            frame.obstacle = True
+        return frame
+
+
+class DepthStage(Stage):
+    """Confirm or veto the obstacle decision with the ROI of the depth image."""
+    name = "depth"
+
+    def __init__(self, confirmer):
+        self.confirmer = confirmer
+
+    def process(self, frame):
+        response = frame.depth_response
+        if response is None or response.width == 0:
+            return frame
+        frame.depth = get_pfm_array(response)
+        frame.obstacle, frame.clearances = self.confirmer.check(frame.obstacle, frame.depth)
+        return frame
+
+
+class LidarStage(Stage):
+    """Fuse the nearest LiDAR range of each ROI partition with the flow decision.
+
+    ``local`` says the point cloud is already in the sensor frame
+    (``"DataFrame": "SensorLocalFrame"``); otherwise it is transformed with
+    the pose that comes with the scan.
+    """
+    name = "lidar"
+
+    def __init__(self, sectors, confirmer, local=True):
+        self.sectors = sectors
+        self.confirmer = confirmer
+        self.local = local
+
+    def process(self, frame):
+        if frame.lidar is None:
+            return frame
+        points = get_point_cloud(frame.lidar)
+        if not self.local and len(points):
+            points = to_sensor_frame(points, frame.lidar.pose)
+        frame.lidar_ranges = self.sectors.nearest(points)
+        frame.obstacle = self.confirmer.fuse(frame.obstacle, frame.lidar_ranges)
+        return frame
+
+
+class ActStage(Stage):
+    """Issue the navigation command for the decision."""
+    name = "navigate"
+    uses_client = True
+
+    def __init__(self, policy, on_state=None):
+        self.policy = policy
+        self.on_state = on_state
+
+    def reset(self):
+        self.policy.reset()
+        self.policy.navigator.reset()
+
+    def process(self, frame):
+        frame.state_str = self.policy.step(frame.obstacle, *frame.smooth)
+        frame.safe_counter = self.policy.safe_counter
+        if self.on_state is not None:
+            self.on_state(frame.state_str)
+        pos = frame.pos
+        debug_print(
+            f"🛰️ Pos({pos.x_val:.2f}, {pos.y_val:.2f}, {pos.z_val:.2f}) "
+            f"Speed: {frame.speed:.2f} m/s State: {frame.state_str}"
+        )
+        if frame.state_str == "blind_forward" and frame.speed < 0.1:
+            debug_print("⚠️ Blind forward but speed is low — possible premature brake")
+        return frame
+
+
+class RecordStage(Stage):
+    """Draw the overlay, write the video and (optionally) the session store.
+
+    With ``video`` off no overlay is drawn and only the session store is
+    written.
+    """
+    name = "record"
+
+    def __init__(self, client, roi, partitions=3, video_path='sparse_flow_output.avi',
+                 record_session=False, debug_display=False, log_dir="flow_logs", video=True):
+        self.client = client
+        self.video = video
+        self.roi = roi
+        self.roi_parts = partition_roi(roi, partitions)
+        self.video_path = video_path
+        self.record_session = record_session
+        self.debug_display = debug_display
+        self.log_dir = log_dir
+        self.fourcc = cv2.VideoWriter_fourcc(*'MJPG')
+        self.out = None
+        self.session = None
+
+    def open(self, timestamp):
+        if self.video:
+            self.out = cv2.VideoWriter(self.video_path, self.fourcc, 8.0, (640, 480))
+        if self.record_session:
+            self.session = FrameStoreWriter(os.path.join(self.log_dir, f"session_{timestamp}"))
+            record_commands(self.client, self.session)
+
+    def close(self):
+        if self.out is not None:
+            self.out.release()
+            self.out = None
+        if self.session is not None:
+            stop_recording_commands(self.client)
+            self.session.close()
+            self.session = None
+
+    def overlay(self, frame):
+        roi = self.roi
+        vis_img = frame.img.copy()
+        smooth_L, smooth_C, smooth_R = frame.smooth
+        cv2.rectangle(vis_img, (roi[0], roi[1]), (roi[2], roi[3]), (255, 0, 0), 1)
+        for part in self.roi_parts:
+            cv2.rectangle(vis_img, (part[0], part[1]), (part[2], part[3]), (0, 0, 255), 1)
+        if frame.obstacle:
+            cv2.putText(vis_img, "Obstacle!", (400, 30), cv2.FONT_HERSHEY_SIMPLEX, 0.7, (0, 0, 255), 2)
+
+        cv2.putText(vis_img, f"Frame: {frame.frame_count}", (10, 25), cv2.FONT_HERSHEY_SIMPLEX, 0.7, (255,255,255), 2)
+        cv2.putText(vis_img, f"Speed: {frame.speed:.2f}", (10, 55), cv2.FONT_HERSHEY_SIMPLEX, 0.7, (255,255,255), 2)
+        cv2.putText(vis_img, f"State: {frame.state_str}", (10, 85), cv2.FONT_HERSHEY_SIMPLEX, 0.7, (255,255,255), 2)
+        cv2.putText(vis_img, f"Sim Time: {frame.sim_elapsed:.2f}s", (10, 115), cv2.FONT_HERSHEY_SIMPLEX, 0.7, (255,255,255), 2)
+        cv2.putText(vis_img, f"Features: {frame.features_detected}", (10, 145), cv2.FONT_HERSHEY_SIMPLEX, 0.7, (255,255,255), 2)
+        cv2.putText(vis_img, f"Flow L: {smooth_L:.2f}", (10, 175), cv2.FONT_HERSHEY_SIMPLEX, 0.7, (255,255,255), 2)
+        cv2.putText(vis_img, f"Flow C: {smooth_C:.2f}", (10, 205), cv2.FONT_HERSHEY_SIMPLEX, 0.7, (255,255,255), 2)
+        cv2.putText(vis_img, f"Flow R: {smooth_R:.2f}", (10, 235), cv2.FONT_HERSHEY_SIMPLEX, 0.7, (255,255,255), 2)
+        if frame.clearances:
+            centre = frame.clearances[len(frame.clearances) // 2]
+            cv2.putText(vis_img, f"Depth C: {centre:.1f} m", (10, 265), cv2.FONT_HERSHEY_SIMPLEX, 0.7, (255,255,255), 2)
+        if frame.lidar_ranges:
+            ranges = " ".join(f"{r:.1f}" for r in frame.lidar_ranges)
+            cv2.putText(vis_img, f"LiDAR: {ranges} m", (10, 295), cv2.FONT_HERSHEY_SIMPLEX, 0.7, (255,255,255), 2)
+        if frame.ttc:
+            centre = frame.ttc[len(frame.ttc) // 2]
+            cv2.putText(vis_img, f"TTC C: {centre:.1f}s", (10, 325), cv2.FONT_HERSHEY_SIMPLEX, 0.7, (255,255,255), 2)
+        if frame.foe is not None:
+            cv2.circle(vis_img, (int(frame.foe[0]), int(frame.foe[1])), 6, (0, 255, 255), 2)
+
+        # Draw flow vectors
+        for pt_old, pt_new in zip(frame.good_old, frame.good_new):
+            x1, y1 = pt_old.ravel()
+            x2, y2 = pt_new.ravel()
+            cv2.arrowedLine(vis_img, (int(x1), int(y1)), (int(x2), int(y2)), (0, 255, 0), 1, tipLength=0.3)
+            cv2.circle(vis_img, (int(x2), int(y2)), 2, (0, 255, 0), -1)
+
+        if self.debug_display and frame.tracked_pts is not None:
+            for p in frame.tracked_pts:
+                x, y = p.ravel()
+                cv2.circle(vis_img, (int(x), int(y)), 2, (0, 255, 0), -1)
+            cv2.imshow("debug", vis_img)
+            cv2.waitKey(1)
+        return vis_img
+
+    def process(self, frame):
+        if self.out is not None:
+            with tracer.span("overlay"):
+                vis_img = self.overlay(frame)
+            self.out.write(vis_img)
+        if self.session is not None:
+            pos, vel = frame.pos, frame.vel
+            ori = frame.response.camera_orientation
+            self.session.append(
+                frame.gray,
+                sim_time=frame.sim_time,
+                pos=(pos.x_val, pos.y_val, pos.z_val),
+                vel=(vel.x_val, vel.y_val, vel.z_val),
+                orientation=(ori.w_val, ori.x_val, ori.y_val, ori.z_val),
+                yaw=frame.yaw,
+                speed=frame.speed,
+                state=frame.state_str,
+                wall_time=frame.time_now,
+                depth=frame.depth,
+            )
+        return frame
+
+
+class LogStage(Stage):
+    """Append one row per frame to ``flow_logs/sparse_log_<timestamp>.csv``."""
+    name = "log"
+
+    def __init__(self, log_dir="flow_logs"):
+        self.log_dir = log_dir
+        self.start_time = time.time()
+        self.log_file = None
+        self.path = None
+
+    def open(self, timestamp):
+        os.makedirs(self.log_dir, exist_ok=True)
+        self.path = os.path.join(self.log_dir, f"sparse_log_{timestamp}.csv")
+        self.log_file = open(self.path, 'w')
+        self.log_file.write(LOG_HEADER)
+
+    def close(self):
+        if self.log_file is not None:
+            self.log_file.close()
+            self.log_file = None
+
+    def process(self, frame):
+        self.log_file.write(format_log_row(
+            frame.frame_count, frame.time_now, frame.time_now - self.start_time, frame.pos,
+            frame.yaw, frame.vel, frame.speed, frame.obstacle, frame.features_detected,
+            *frame.smooth, frame.state_str, frame.safe_counter, frame.sim_time,
+        ))
+        return frame
+
+
+class Pipeline:
+    """An ordered list of stages plus episode bookkeeping.
+
+    ``on_reset`` is called before the stages are reset when an episode is
+    restarted, e.g. to put the vehicle back at its start pose.
+    """
+
+    def __init__(self, stages, on_reset=None):
+        self.stages = list(stages)
+        self.on_reset = on_reset
+        self.timestamp = None
+        self._repeats = 0
+        self.frames = 0
+
+    def stage(self, name):
+        for stage in self.stages:
+            if stage.name == name:
+                return stage
+        raise KeyError(name)
+
+    def run_stage(self, stage, frame):
+        with tracer.span(stage.name):
+            return stage.process(frame)
+
+    def run_frame(self):
+        """Run every stage on a new frame.  Returns it, or ``None`` if dropped."""
+        frame = FrameResult()
+        for stage in self.stages:
+            frame = self.run_stage(stage, frame)
+            if frame is None:
+                return None
+        self.frames += 1
+        return frame
+
+    def start_episode(self):
+        """Close the outputs of the previous episode and open new ones.
+
+        Episodes started within the same second get a ``_1``, ``_2``, ...
+        suffix so their logs and sessions do not overwrite each other.
+        """
+        timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+        if self.timestamp is not None and self.timestamp.startswith(timestamp):
+            self._repeats += 1
+            timestamp = f"{timestamp}_{self._repeats}"
+        else:
+            self._repeats = 0
+        self.timestamp = timestamp
+        for stage in self.stages:
+            stage.close()
+            stage.reset()
+            stage.open(self.timestamp)
+
+    def reset_episode(self):
+        if self.on_reset is not None:
+            self.on_reset()
+        self.start_episode()
+
+    def close(self):
+        for stage in self.stages:
+            stage.close()
+
+
+def _never():
+    return False
+
+
+class SerialScheduler:
+    """Run the stages of one frame after another on the calling thread."""
+
+    def run(self, pipeline, should_stop=_never, should_reset=_never):
+        while not should_stop():
+            pipeline.run_frame()
+            if should_reset():
+                pipeline.reset_episode()
+
+
+_STOP = object()
+
+
+class ThreadedScheduler:
+    """Run every stage on its own thread, connected by bounded queues.
+
+    Parameters
+    ----------
+    queue_size : int
+        Frames allowed to wait in front of each stage.
+    """
+
+    def __init__(self, queue_size=2):
+        self.queue_size = queue_size
+
+    def run(self, pipeline, should_stop=_never, should_reset=_never):
+        head, rest = pipeline.stages[0], pipeline.stages[1:]
+        queues = [queue.Queue(self.queue_size) for _ in rest]
+        rpc_lock = threading.Lock()
+        idle = threading.Condition()
+        state = {'in_flight': 0, 'error': None}
+
+        def run_stage(stage, frame):
+            if stage.uses_client:
+                with rpc_lock:
+                    return pipeline.run_stage(stage, frame)
+            return pipeline.run_stage(stage, frame)
+
+        def finished():
+            with idle:
+                state['in_flight'] -= 1
+                idle.notify_all()
+
+        def worker(index, stage):
+            inbox = queues[index]
+            outbox = queues[index + 1] if index + 1 < len(queues) else None
+            while True:
+                frame = inbox.get()
+                if frame is _STOP:
+                    if outbox is not None:
+                        outbox.put(_STOP)
+                    return
+                try:
+                    frame = run_stage(stage, frame)
+                except Exception as e:
+                    state['error'] = e
+                    frame = None
+                if frame is None or outbox is None:
+                    if frame is not None:
+                        pipeline.frames += 1
+                    finished()
+                else:
+                    outbox.put(frame)
+
+        threads = [threading.Thread(target=worker, args=(i, stage), name=f"stage-{stage.name}", daemon=True)
+                   for i, stage in enumerate(rest)]
+        for t in threads:
+            t.start()
+        try:
+            while not should_stop() and state['error'] is None:
+                if should_reset():
+                    with idle:
+                        idle.wait_for(lambda: state['in_flight'] == 0)
+                    pipeline.reset_episode()
+                frame = run_stage(head, FrameResult())
+                if frame is None:
+                    continue
+                if not queues:
+                    pipeline.frames += 1
+                    continue
+                with idle:
+                    state['in_flight'] += 1
+                queues[0].put(frame)
+        finally:
+            if queues:
+                queues[0].put(_STOP)
+            for t in threads:
+                t.join()
+        if state['error'] is not None:
+            raise state['error']
+
+
+def _offload_worker(conn, stages):
+    """Child process loop of :class:`ProcessScheduler`.
+
+    Ctrl-C and process-group signals are left to the parent, which shuts
+    the child down by sending ``None``.
+    """
+    for name in ("SIGINT", "SIGTERM"):
+        if hasattr(signal, name):
+            signal.signal(getattr(signal, name), signal.SIG_IGN)
+    while True:
+        message = conn.recv()
+        if message is None:
+            return
+        kind, frame = message
+        if kind == 'reset':
+            for stage in stages:
+                stage.reset()
+            continue
+        for stage in stages:
+            frame = stage.process(frame)
+            if frame is None:
+                break
+        conn.send(frame)
+
+
+class ProcessScheduler:
+    """Run a contiguous group of CPU-bound stages in a child process.
+
+    While the child works on frame ``n`` the parent captures frame ``n + 1``,
+    then runs the stages after the group (decide, act, record, log) on frame
+    ``n`` before handing frame ``n + 1`` to the child.  The offloaded stages keep their state (e.g. the
+    tracker's previous frame) in the child, so the parent's copies (and any
+    statistics they keep) stay untouched.  A child that dies raises
+    ``RuntimeError`` within ``poll_interval`` seconds instead of hanging.
+    """
+
+    def __init__(self, offload=("preprocess", "flow"), poll_interval=0.5):
+        self.offload = tuple(offload)
+        self.poll_interval = poll_interval
+
+    def _split(self, stages):
+        names = [s.name for s in stages]
+        indices = [names.index(n) for n in self.offload]
+        first, last = min(indices), max(indices) + 1
+        if last - first != len(indices):
+            raise ValueError(f"offloaded stages {self.offload} must be adjacent")
+        return stages[:first], stages[first:last], stages[last:]
+
+    def run(self, pipeline, should_stop=_never, should_reset=_never):
+        head, middle, tail = self._split(pipeline.stages)
+        ctx = multiprocessing.get_context("spawn")
+        conn, child_conn = ctx.Pipe()
+        child = ctx.Process(target=_offload_worker, args=(child_conn, middle), name="pipeline-offload", daemon=True)
+        child.start()
+        pending = False
+
+        def run_stages(stages, frame):
+            for stage in stages:
+                frame = pipeline.run_stage(stage, frame)
+                if frame is None:
+                    return None
+            return frame
+
+        def finish_pending():
+            nonlocal pending
+            with tracer.span("offload_wait"):
+                while not conn.poll(self.poll_interval):
+                    if not child.is_alive():
+                        raise RuntimeError(f"pipeline offload process exited with code {child.exitcode}")
+                frame = conn.recv()
+            pending = False
+            if frame is not None and run_stages(tail, frame) is not None:
+                pipeline.frames += 1
+
+        try:
+            while not should_stop():
+                if should_reset():
+                    if pending:
+                        finish_pending()
+                    conn.send(('reset', None))
+                    pipeline.reset_episode()
+                frame = run_stages(head, FrameResult())
+                # Collect the previous result before sending the next frame:
+                # both are larger than the pipe buffer, so sending while the
+                # child is still writing its reply would block both ends.
+                if pending:
+                    finish_pending()
+                if frame is not None:
+                    conn.send(('frame', frame))
+                    pending = True
+            if pending:
+                finish_pending()
+        finally:
+            try:
+                conn.send(None)
+            except (BrokenPipeError, OSError):
+                pass
+            child.join(timeout=5)
+            if child.is_alive():
+                child.terminate()
+
+
+SCHEDULERS = {
+    'serial': SerialScheduler,
+    'threaded': ThreadedScheduler,
+    'process': ProcessScheduler,
+}
+
+
+def default_stages(client, tracker, detector, policy, roi, partitions=3, camera="oakd_camera",
+                   lockstep=None, record_session=False, debug_display=False, on_state=None,
+                   log_dir="flow_logs", headless=False, depth_confirmer=None, lidar_name=None,
+                   lidar_sectors=None, lidar_confirmer=None, lidar_local=True,
+                   brake_on="flow", brake_ttc=2.0, ttc=False, grace_frames=10, imu_name=None):
+    """The stage list matching the original ``main.py`` loop.
+
+    ``headless`` drops the overlay video and debug window; the record stage
+    is kept only if the session store is wanted.  A ``depth_confirmer``
+    adds a depth request to the capture and a depth stage after decide.
+    ``lidar_name`` adds a LiDAR request and a fusion stage; its confirmer
+    defaults to the depth confirmer.  ``brake_on`` other than ``"flow"``
+    adds a time-to-contact stage after decide, before the range checks;
+    ``ttc`` adds it for display only.  ``imu_name`` reads the body rates
+    for the tracker's compensator from that IMU instead of the state.
+    """
+    stages = [
+        CaptureStage(client, camera, lockstep=lockstep, depth=depth_confirmer is not None,
+                     lidar_name=lidar_name, imu_name=imu_name),
+        PreprocessStage(keep_color=not headless),
+        FlowStage(tracker),
+        DecideStage(detector),
+    ]
+    if ttc or brake_on != "flow":
+        stages.append(TTCStage(TimeToContact(roi, partitions), brake_ttc, brake_on, grace_frames))
+    if depth_confirmer is not None:
+        stages.append(DepthStage(depth_confirmer))
+    if lidar_name is not None:
+        stages.append(LidarStage(lidar_sectors or LidarSectors(roi, partitions),
+                                 lidar_confirmer or depth_confirmer or DepthConfirmer(roi, partitions),
+                                 local=lidar_local))
+    stages.append(ActStage(policy, on_state))
+    if not headless or record_session:
+        stages.append(RecordStage(client, roi, partitions, record_session=record_session,
+                                  debug_display=debug_display and not headless,
+                                  log_dir=log_dir, video=not headless))
+    stages.append(LogStage(log_dir))
+    return stages
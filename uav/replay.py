@@ -0,0 +1,304 @@
+# uav/replay.py
+"""Offline replay of the perception and decision pipeline.
+
+Feeds a recorded frame-store session (see :mod:`uav.framestore`) or the flow
+columns of a ``flow_logs`` CSV through the same tracker, detector and
+navigation policy that ``main.py`` uses, without a simulator and as fast as
+possible.  Motion commands are captured by :class:`ReplayClient` instead of
+being sent anywhere.
+
+Usage::
+
+    python -m uav.replay flow_logs/session_20250604_204643 --trace trace.csv
+    python -m uav.replay flow_logs/sparse_log_20250604_204643.csv
+    python -m uav.replay synthetic:obstacle --max-frames 60
+"""
+import argparse
+import csv
+import time
+
+import numpy as np
+
+from airsim import KinematicsState, MultirotorState, Quaternionr, Vector3r
+
+from uav.decision import NavigationPolicy, ObstacleDetector
+from uav.egomotion import EgoMotionCompensator, GyroDerotator, body_rates
+from uav.navigation import Navigator
+from uav.framestore import FrameStoreReader
+from uav.synthetic import endpoint_error, scenario
+from uav.utils import FrameClock
+from sparse_optical_flow_utils import SparseFlowTracker
+
+# Columns replay_log needs: the smoothed partition flows
+LOG_FLOW_FIELDS = ("flow_left", "flow_center", "flow_right")
+# States NavigationPolicy.step can return; older logs use other names
+# ("none", "nudge", ...) that cannot be compared
+POLICY_STATES = frozenset({"forward", "blind_forward", "brake", "dodge", "dodge_left",
+                           "dodge_right", "no_dodge", "resume"})
+
+TRACE_FIELDS = [
+    "frame", "sim_time", "speed", "features_detected", "flow_left", "flow_center",
+    "flow_right", "obstacle_detected", "state", "safe_counter", "reference_state",
+]
+
+
+class _DoneFuture:
+    def join(self):
+        return None
+
+    def get(self):
+        return True
+
+
+class ReplayClient:
+    """Stand-in for ``airsim.MultirotorClient`` answering from recorded state.
+
+    Every motion command is appended to :attr:`commands` and completes
+    immediately so the navigation logic runs unchanged.
+    """
+
+    def __init__(self):
+        self.commands = []
+        self._state = MultirotorState()
+        self.set_state((0.0, 0.0, 0.0), (0.0, 0.0, 0.0))
+
+    def set_state(self, pos, vel, orientation=(1.0, 0.0, 0.0, 0.0)):
+        kin = KinematicsState()
+        kin.position = Vector3r(*map(float, pos))
+        kin.linear_velocity = Vector3r(*map(float, vel))
+        w, x, y, z = map(float, orientation)
+        kin.orientation = Quaternionr(x, y, z, w)
+        self._state = MultirotorState()
+        self._state.kinematics_estimated = kin
+
+    def getMultirotorState(self, vehicle_name=''):
+        return self._state
+
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+
+        def command(*args, **kwargs):
+            self.commands.append((name, args))
+            return _DoneFuture()
+        return command
+
+
+def make_pipeline(client, threshold=350.0, grace_frames=10, safe_frames=5, alpha=0.5,
+                  roi=(60, 60, 580, 420), partitions=3, no_feature_limit=10,
+                  displacement_threshold=2.5, feature_params=None, flow_params=None, ego_motion=None):
+    """Build the tracker, detector and policy with ``main.py``'s defaults.
+
+    ``ego_motion`` (``"homography"``, ``"affine"`` or ``"gyro"``) enables
+    rotational flow compensation.
+    """
+    compensator = None
+    if ego_motion == "gyro":
+        compensator = GyroDerotator()
+    elif ego_motion:
+        compensator = EgoMotionCompensator(ego_motion)
+    tracker = SparseFlowTracker(list(roi), partitions=partitions, no_feature_limit=no_feature_limit,
+                                displacement_threshold=displacement_threshold,
+                                feature_params=feature_params, flow_params=flow_params,
+                                compensator=compensator)
+    detector = ObstacleDetector(threshold=threshold, grace_frames=grace_frames, alpha=alpha)
+    policy = NavigationPolicy(Navigator(client), safe_frames=safe_frames)
+    return tracker, detector, policy
+
+
+def replay_session(path, max_frames=None, **params):
+    """Run the full perception and decision pipeline on a recorded session.
+
+    ``path`` is a session directory or an open :class:`FrameStoreReader`.
+    The tracker gets body rates from consecutive recorded orientations.
+
+    Returns
+    -------
+    tuple
+        ``(trace, stats)`` where ``trace`` is a list of per-frame dicts and
+        ``stats`` holds frame count, elapsed time and frames per second.
+    """
+    reader = path if isinstance(path, FrameStoreReader) else FrameStoreReader(path)
+    client = ReplayClient()
+    tracker, detector, policy = make_pipeline(client, **params)
+    trace = []
+    frame_clock = FrameClock()
+    prev_orientation = None
+    start = time.perf_counter()
+    for index, gray, rec in reader.iter_frames(stop=max_frames):
+        frame_count = index + 1
+        # Same dt as the live loop: simulator time, wall clock if missing.
+        # Recorded frames are never duplicates, so tick() always returns dt.
+        dt = frame_clock.tick(int(round(float(rec['sim_time']) * 1e9)), float(rec['wall_time'])) or 0.0
+        speed = float(rec['speed'])
+        client.set_state(rec['pos'], rec['vel'], rec['orientation'])
+        rates = None
+        if prev_orientation is not None and dt > 0:
+            rates = body_rates(prev_orientation, rec['orientation'], dt)
+        prev_orientation = rec['orientation']
+
+        _, _, part_flows, features_detected = tracker.process(gray, dt, speed, rates)
+        obstacle, (smooth_L, smooth_C, smooth_R) = detector.update(frame_count, part_flows)
+        state_str = policy.step(obstacle, smooth_L, smooth_C, smooth_R)
+        trace.append({
+            "frame": frame_count, "sim_time": float(rec['sim_time']), "speed": speed,
+            "features_detected": features_detected, "flow_left": smooth_L,
+            "flow_center": smooth_C, "flow_right": smooth_R, "obstacle_detected": obstacle,
+            "state": state_str, "safe_counter": policy.safe_counter,
+            "reference_state": str(rec['state']),
+        })
+    elapsed = time.perf_counter() - start
+    return trace, _stats(trace, elapsed)
+
+
+def replay_synthetic(name, max_frames=None, dt=1 / 30.0, speed=2.0, **params):
+    """Run the pipeline on a :mod:`uav.synthetic` scenario.
+
+    Besides the usual statistics, ``stats`` holds the mean endpoint error of
+    the tracked features against the scenario's ground-truth flow.
+    """
+    client = ReplayClient()
+    client.set_state((0.0, 0.0, -2.0), (speed, 0.0, 0.0))
+    tracker, detector, policy = make_pipeline(client, **params)
+    trace, errors = [], []
+    prev_flow = None
+    start = time.perf_counter()
+    for index, (gray, flow) in enumerate(scenario(name, frames=max_frames or 120)):
+        frame_count = index + 1
+        good_old, good_new, part_flows, features_detected = tracker.process(gray, dt, speed)
+        if prev_flow is not None and len(good_old):
+            errors.append(endpoint_error(good_old, good_new, prev_flow))
+        prev_flow = flow
+        obstacle, (smooth_L, smooth_C, smooth_R) = detector.update(frame_count, part_flows)
+        state_str = policy.step(obstacle, smooth_L, smooth_C, smooth_R)
+        trace.append({
+            "frame": frame_count, "sim_time": index * dt, "speed": speed,
+            "features_detected": features_detected, "flow_left": smooth_L,
+            "flow_center": smooth_C, "flow_right": smooth_R, "obstacle_detected": obstacle,
+            "state": state_str, "safe_counter": policy.safe_counter, "reference_state": "",
+        })
+    elapsed = time.perf_counter() - start
+    stats = _stats(trace, elapsed)
+    if errors:
+        stats["endpoint_error_px"] = float(np.concatenate(errors).mean())
+    return trace, stats
+
+
+def replay_log(path, max_frames=None, threshold=350.0, grace_frames=10, safe_frames=5):
+    """Run the decision stage on the smoothed flow triples of a CSV log.
+
+    The logged ``flow_left/center/right`` columns are already smoothed, so
+    they go straight into :meth:`ObstacleDetector.decide` without another
+    pass through the flow history.  Raises ``ValueError`` if the log has
+    no flow columns.
+    """
+    client = ReplayClient()
+    detector = ObstacleDetector(threshold=threshold, grace_frames=grace_frames)
+    policy = NavigationPolicy(Navigator(client), safe_frames=safe_frames)
+    with open(path, newline='') as f:
+        reader = csv.DictReader(f)
+        rows = list(reader)
+        missing = [name for name in LOG_FLOW_FIELDS if name not in (reader.fieldnames or ())]
+    if missing:
+        raise ValueError(f"{path} has no {', '.join(missing)} column(s); only flow logs with "
+                         f"smoothed partition flows can be replayed")
+    if max_frames is not None:
+        rows = rows[:max_frames]
+    trace = []
+    start = time.perf_counter()
+    for i, row in enumerate(rows):
+        frame_count = int(row.get('frame') or i + 1)
+        smooth_L = float(row['flow_left'])
+        smooth_C = float(row['flow_center'])
+        smooth_R = float(row['flow_right'])
+        speed = float(row.get('speed') or 0.0)
+        client.set_state(
+            (float(row.get('pos_x') or 0.0), float(row.get('pos_y') or 0.0), float(row.get('pos_z') or 0.0)),
+            (float(row.get('vx') or speed), float(row.get('vy') or 0.0), float(row.get('vz') or 0.0)),
+        )
+        obstacle = detector.decide(frame_count, smooth_L, smooth_C, smooth_R)
+        state_str = policy.step(obstacle, smooth_L, smooth_C, smooth_R)
+        trace.append({
+            "frame": frame_count, "sim_time": float(row.get('sim_time') or row.get('rel_time') or row.get('time') or 0.0),
+            "speed": speed, "features_detected": int(float(row.get('features_detected') or row.get('features') or 0)),
+            "flow_left": smooth_L, "flow_center": smooth_C, "flow_right": smooth_R,
+            "obstacle_detected": obstacle, "state": state_str, "safe_counter": policy.safe_counter,
+            "reference_state": row.get('state', ''),
+        })
+    elapsed = time.perf_counter() - start
+    return trace, _stats(trace, elapsed)
+
+
+def _stats(trace, elapsed):
+    frames = len(trace)
+    stats = {
+        "frames": frames,
+        "elapsed_s": elapsed,
+        "fps": frames / elapsed if elapsed > 0 else float('inf'),
+        "obstacle_frames": sum(1 for t in trace if t["obstacle_detected"]),
+        # Clear-to-obstacle transitions, i.e. brake/resume cycles
+        "obstacle_onsets": sum(1 for prev, t in zip([None] + trace, trace)
+                               if t["obstacle_detected"] and not (prev and prev["obstacle_detected"])),
+    }
+    with_ref = [t for t in trace if t["reference_state"]]
+    unknown = {t["reference_state"] for t in with_ref} - POLICY_STATES
+    if unknown:
+        stats["unknown_reference_states"] = sorted(unknown)
+    elif with_ref:
+        stats["reference_agreement"] = sum(
+            1 for t in with_ref if t["state"] == t["reference_state"]) / len(with_ref)
+    return stats
+
+
+def write_trace(trace, path):
+    with open(path, 'w', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=TRACE_FIELDS)
+        writer.writeheader()
+        writer.writerows(trace)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Replay recorded flights through the decision pipeline")
+    parser.add_argument('source', help="frame-store session directory, flow_logs CSV "
+                                       "or synthetic:<scenario>")
+    parser.add_argument('--trace', help="write the per-frame decision trace to this CSV")
+    parser.add_argument('--max-frames', type=int)
+    parser.add_argument('--threshold', type=float, default=350.0)
+    parser.add_argument('--grace-frames', type=int, default=10)
+    parser.add_argument('--safe-frames', type=int, default=5)
+    parser.add_argument('--ego-motion', choices=['homography', 'affine', 'gyro'],
+                        help="remove global rotational flow before partition averaging")
+    args = parser.parse_args(argv)
+    if args.ego_motion and args.source.endswith('.csv'):
+        parser.error("--ego-motion needs tracked frames; CSV logs only hold the smoothed flows")
+
+    params = dict(threshold=args.threshold, grace_frames=args.grace_frames, safe_frames=args.safe_frames)
+    if args.ego_motion:
+        params['ego_motion'] = args.ego_motion
+    if args.source.startswith('synthetic:'):
+        trace, stats = replay_synthetic(args.source.split(':', 1)[1], args.max_frames, **params)
+    elif args.source.endswith('.csv'):
+        try:
+            trace, stats = replay_log(args.source, args.max_frames, **params)
+        except ValueError as e:
+            parser.error(str(e))
+    else:
+        trace, stats = replay_session(args.source, args.max_frames, **params)
+
+    print(f"Replayed {stats['frames']} frames in {stats['elapsed_s']:.2f}s "
+          f"({stats['fps']:.1f} FPS), obstacle frames: {stats['obstacle_frames']} "
+          f"in {stats['obstacle_onsets']} episodes")
+    if 'reference_agreement' in stats:
+        print(f"State agreement with recorded run: {stats['reference_agreement'] * 100:.1f}%")
+    elif 'unknown_reference_states' in stats:
+        print("State agreement skipped: the recorded run uses states the current policy does not "
+              f"have ({', '.join(stats['unknown_reference_states'])})")
+    if 'endpoint_error_px' in stats:
+        print(f"Mean endpoint error against ground truth: {stats['endpoint_error_px']:.3f} px")
+    if args.trace:
+        write_trace(trace, args.trace)
+        print(f"Decision trace written to {args.trace}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,728 @@
+# uav/standin.py
+"""Local msgpack-rpc stand-in for the AirSim server.
+
+Implements the subset of the AirSim RPC surface used by this project so that
+``main.py`` and the offline tools can run on a plain Linux box without
+Unreal.  Frames come from a synthetic renderer (a textured wall ahead of the
+drone) or from recorded footage, and velocity commands drive a simple
+point-mass model.
+
+Run with ``python -m uav.standin --port 41451`` and point the client at it.
+"""
+import argparse
+import math
+import re
+import threading
+import time
+
+import cv2
+import msgpack
+import msgpackrpc
+import numpy as np
+from msgpackrpc.server import AsyncResult
+
+NS_PER_SEC = 1_000_000_000
+PHYSICS_STEP = 0.01  # seconds of sim time per integration substep
+
+
+def _vec(x, y, z):
+    return {'x_val': float(x), 'y_val': float(y), 'z_val': float(z)}
+
+
+def _quat_from_yaw(yaw):
+    return {'w_val': math.cos(yaw / 2), 'x_val': 0.0, 'y_val': 0.0, 'z_val': math.sin(yaw / 2)}
+
+
+def _yaw_from_quat(q):
+    w, x, y, z = q['w_val'], q['x_val'], q['y_val'], q['z_val']
+    return math.atan2(2.0 * (w * z + x * y), 1.0 - 2.0 * (y * y + z * z))
+
+
+def segmentation_color(object_id):
+    """BGR colour of a segmentation ID in the stand-in palette (ID 0 is black).
+
+    The colours are deterministic but are not AirSim's palette.
+    """
+    if object_id <= 0:
+        return (0, 0, 0)
+    return tuple(int(c) for c in np.random.default_rng(object_id).integers(1, 256, 3))
+
+
+class SyntheticRenderer:
+    """Render a textured wall ``wall_x`` metres ahead of the start position.
+
+    Flying forward makes the texture expand around the focus of expansion,
+    which is what the flow-based obstacle detector reacts to.
+    """
+    meshes = ('Wall',)
+
+    def __init__(self, width=640, height=480, fov_deg=90.0, wall_x=30.0,
+                 texture_size=1024, pixels_per_meter=64.0, seed=0):
+        self.width = width
+        self.height = height
+        self.fov_deg = fov_deg
+        self.wall_x = wall_x
+        self.pixels_per_meter = pixels_per_meter
+        self.focal = (width / 2.0) / math.tan(math.radians(fov_deg) / 2.0)
+        rng = np.random.default_rng(seed)
+        noise = rng.random((texture_size, texture_size)).astype(np.float32)
+        texture = cv2.GaussianBlur(noise, (0, 0), 3) * 0.6 + noise * 0.4
+        self.texture = cv2.normalize(texture, None, 0, 255, cv2.NORM_MINMAX).astype(np.uint8)
+        # Mip levels: sampling the full-resolution texture from afar aliases,
+        # so frames one step apart share little apart from the true motion
+        self.mips = [self.texture]
+        while self.mips[-1].shape[0] > 16:
+            self.mips.append(cv2.pyrDown(self.mips[-1]))
+        u, v = np.meshgrid(np.arange(width, dtype=np.float32), np.arange(height, dtype=np.float32))
+        self._a = (u - width / 2.0) / self.focal
+        self._b = (v - height / 2.0) / self.focal
+
+    def wall_coords(self, pos, yaw):
+        """Return wall coordinates ``(Y, Z)`` in metres seen by each pixel."""
+        c, s = math.cos(yaw), math.sin(yaw)
+        dx = c - s * self._a
+        dy = s + c * self._a
+        dist = max(self.wall_x - pos[0], 0.1)
+        t = dist / np.maximum(dx, 1e-3)
+        return pos[1] + t * dy, pos[2] + t * self._b
+
+    def depth(self, pos, yaw, perspective=False):
+        """Distance to the wall per pixel in metres (float32).
+
+        Planar depth is measured along the camera axis, perspective depth
+        along each pixel's ray.
+        """
+        c, s = math.cos(yaw), math.sin(yaw)
+        dx = c - s * self._a
+        dist = max(self.wall_x - pos[0], 0.1)
+        # Rays are parametrised with a unit forward component, so t is planar depth
+        t = np.where(dx > 1e-3, dist / np.maximum(dx, 1e-3), np.inf)
+        if perspective:
+            t = t * np.sqrt(1.0 + self._a ** 2 + self._b ** 2)
+        return t.astype(np.float32)
+
+    def segmentation(self, pos, yaw):
+        """Per-pixel mesh index (``uint8``): 1 + index into :attr:`meshes`, 0 for none."""
+        c, s = math.cos(yaw), math.sin(yaw)
+        return ((c - s * self._a) > 1e-3).astype(np.uint8)
+
+    def mesh_geometry(self, half_width=100.0, height=40.0):
+        """Static geometry per mesh name: ``(vertices, indices)`` in NED metres.
+
+        The wall is rendered as infinite; its mesh is a ``2 * half_width`` by
+        ``height`` metre quad standing on the ground.
+        """
+        x = self.wall_x
+        vertices = np.array([[x, -half_width, 0.0], [x, half_width, 0.0],
+                             [x, half_width, -height], [x, -half_width, -height]], dtype=np.float32)
+        return {'Wall': (vertices, np.array([0, 1, 2, 0, 2, 3], dtype=np.int32))}
+
+    def project(self, wall_y, wall_z, pos, yaw):
+        """Pixel coordinates of wall points ``(wall_x, wall_y, wall_z)`` seen from ``pos``/``yaw``."""
+        c, s = math.cos(yaw), math.sin(yaw)
+        dx = max(self.wall_x - pos[0], 0.1)
+        dy = wall_y - pos[1]
+        forward = c * dx + s * dy
+        right = -s * dx + c * dy
+        u = self.width / 2.0 + self.focal * right / forward
+        v = self.height / 2.0 + self.focal * (wall_z - pos[2]) / forward
+        return u, v
+
+    def flow(self, prev_pos, prev_yaw, pos, yaw):
+        """Ground-truth flow ``(H, W, 2)`` from the previous to the current pose,
+        indexed by pixel of the previous frame."""
+        wall_y, wall_z = self.wall_coords(prev_pos, prev_yaw)
+        u, v = self.project(wall_y, wall_z, pos, yaw)
+        flow = np.empty((self.height, self.width, 2), dtype=np.float32)
+        flow[..., 0] = u - (self._a * self.focal + self.width / 2.0)
+        flow[..., 1] = v - (self._b * self.focal + self.height / 2.0)
+        return flow
+
+    def lidar_points(self, pos, yaw, channels=16, points_per_channel=360,
+                     vertical_fov=(-15.0, 15.0), max_range=100.0):
+        """Wall hits of a spinning LiDAR as sensor-frame ``(N, 3)`` points."""
+        azimuth = np.radians(np.linspace(-180.0, 180.0, points_per_channel, endpoint=False))
+        elevation = np.radians(np.linspace(vertical_fov[0], vertical_fov[1], channels))
+        az, el = np.meshgrid(azimuth, elevation)
+        # Unit rays in the sensor frame (x forward, y right, z down)
+        ray = np.stack([np.cos(el) * np.cos(az), np.cos(el) * np.sin(az), -np.sin(el)], axis=-1).reshape(-1, 3)
+        world_x = ray[:, 0] * math.cos(yaw) - ray[:, 1] * math.sin(yaw)
+        dist = self.wall_x - pos[0]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            t = dist / world_x
+        hit = (world_x > 1e-6) & (t > 0) & (t <= max_range)
+        return (ray[hit] * t[hit, None]).astype(np.float32)
+
+    def render(self, pos, yaw, sim_time):
+        wall_y, wall_z = self.wall_coords(pos, yaw)
+        # Texels per image pixel at the image centre pick the mip level (at
+        # most about half a texel per pixel, so LK has texture to lock on to)
+        texels = max(self.wall_x - pos[0], 0.1) * self.pixels_per_meter / self.focal
+        level = min(max(int(math.log2(texels)) + 1, 0), len(self.mips) - 1)
+        scale = self.pixels_per_meter / (1 << level)
+        map_x = (wall_y * scale).astype(np.float32)
+        map_y = (wall_z * scale).astype(np.float32)
+        gray = cv2.remap(self.mips[level], map_x, map_y, cv2.INTER_LINEAR, borderMode=cv2.BORDER_WRAP)
+        return cv2.cvtColor(gray, cv2.COLOR_GRAY2BGR)
+
+
+class VideoRenderer:
+    """Serve frames from recorded footage, indexed by simulation time."""
+
+    def __init__(self, path, width=640, height=480, fps=None):
+        cap = cv2.VideoCapture(path)
+        self.fps = fps or cap.get(cv2.CAP_PROP_FPS) or 8.0
+        self.frames = []
+        while True:
+            ok, frame = cap.read()
+            if not ok:
+                break
+            self.frames.append(cv2.resize(frame, (width, height)))
+        cap.release()
+        if not self.frames:
+            raise ValueError(f"No frames could be read from {path}")
+        self.width = width
+        self.height = height
+        self.fov_deg = 90.0
+
+    def render(self, pos, yaw, sim_time):
+        return self.frames[int(sim_time * self.fps) % len(self.frames)]
+
+
+class _Vehicle:
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.pos = np.zeros(3)
+        self.vel = np.zeros(3)
+        self.yaw = 0.0
+        self.yaw_rate = 0.0
+        self.api_control = False
+        self.armed = False
+        self.landed = True
+        self.cmd_vel = np.zeros(3)
+        self.cmd_yaw_rate = 0.0
+        self.cmd_until = 0.0
+        self.target = None
+        self.target_speed = 0.0
+
+
+class StandInSimulator:
+    """RPC handler emulating the AirSim multirotor API.
+
+    Parameters
+    ----------
+    renderer : object
+        Object with a ``render(pos, yaw, sim_time)`` method returning a BGR image.
+    clock_speed : float
+        Simulation seconds per wall-clock second while running.
+    frame_period : float
+        Simulation seconds covered by ``simContinueForFrames(1)``.
+    velocity_tau : float
+        Time constant of the first-order velocity response in seconds.
+    blocking_commands : bool
+        When ``True`` motion commands only respond once their duration has
+        elapsed, matching AirSim's ``.join()`` semantics.  The default answers
+        immediately so loops can run as fast as possible.
+    depth_size : tuple, optional
+        ``(width, height)`` of depth images, like a depth ``CaptureSettings``
+        entry in ``settings.json``.  Defaults to the scene resolution.
+    binary_floats : bool
+        Send float images and LiDAR point clouds as one float32 byte string
+        instead of the list of floats AirSim sends.  The client then decodes
+        them without a copy.  LiDAR points are in the sensor frame.
+    """
+
+    def __init__(self, renderer=None, clock_speed=1.0, frame_period=1.0 / 30,
+                 velocity_tau=0.3, blocking_commands=False, depth_size=None, binary_floats=False):
+        self.renderer = renderer or SyntheticRenderer()
+        self.clock_speed = clock_speed
+        self.frame_period = frame_period
+        self.velocity_tau = velocity_tau
+        self.blocking_commands = blocking_commands
+        self.depth_size = depth_size
+        self.binary_floats = binary_floats
+        self.schedule = None  # set by the server: schedule(delay_s, callback)
+        self.vehicles = {'SimpleFlight': _Vehicle()}
+        # Segmentation object ID per mesh name, like AirSim's initial IDs
+        self.segmentation_ids = {name: i + 1 for i, name in enumerate(getattr(self.renderer, 'meshes', ()))}
+        self.sim_time = 0.0
+        self.paused = False
+        self._last_wall = time.monotonic()
+        self._lock = threading.Lock()
+
+    # ---- time and physics ----------------------------------------------
+    def _vehicle(self, name=''):
+        if not name:
+            return next(iter(self.vehicles.values()))
+        return self.vehicles[name]
+
+    def _sync_clock(self):
+        now = time.monotonic()
+        if not self.paused:
+            self._advance((now - self._last_wall) * self.clock_speed)
+        self._last_wall = now
+
+    def _advance(self, seconds):
+        while seconds > 1e-9:
+            step = min(PHYSICS_STEP, seconds)
+            for vehicle in self.vehicles.values():
+                self._integrate(vehicle, step)
+            self.sim_time += step
+            seconds -= step
+
+    def _integrate(self, v, dt):
+        if v.target is not None:
+            delta = v.target - v.pos
+            dist = np.linalg.norm(delta)
+            if dist < 0.05:
+                v.target = None
+                v.cmd_vel = np.zeros(3)
+            else:
+                v.cmd_vel = delta / dist * min(v.target_speed, dist / max(self.velocity_tau, dt))
+        elif self.sim_time >= v.cmd_until:
+            v.cmd_vel = np.zeros(3)
+            v.cmd_yaw_rate = 0.0
+        gain = 1.0 - math.exp(-dt / self.velocity_tau)
+        v.vel += (v.cmd_vel - v.vel) * gain
+        v.yaw_rate = v.cmd_yaw_rate
+        v.pos += v.vel * dt
+        v.yaw += v.yaw_rate * dt
+        if v.pos[2] > 0.0:  # ground at z = 0 (NED)
+            v.pos[2] = 0.0
+            v.vel[2] = min(v.vel[2], 0.0)
+        v.landed = v.pos[2] > -0.05 and abs(v.vel[2]) < 0.05
+
+    def _finish_after(self, sim_seconds):
+        if not self.blocking_commands or self.paused or self.schedule is None:
+            return True
+        result = AsyncResult()
+        self.schedule(sim_seconds / self.clock_speed, lambda: result.set_result(True))
+        return result
+
+    def _command(self, vehicle_name, vel, duration, yaw_mode=None, body_frame=False, z=None):
+        with self._lock:
+            self._sync_clock()
+            v = self._vehicle(vehicle_name)
+            vel = np.array(vel, dtype=float)
+            if body_frame:
+                c, s = math.cos(v.yaw), math.sin(v.yaw)
+                vel[0], vel[1] = c * vel[0] - s * vel[1], s * vel[0] + c * vel[1]
+            if z is not None:
+                vel[2] = (z - v.pos[2]) / max(duration, 1.0)
+            v.target = None
+            v.cmd_vel = vel
+            v.cmd_until = self.sim_time + duration
+            v.cmd_yaw_rate = 0.0
+            if yaw_mode:
+                if yaw_mode.get('is_rate', True):
+                    v.cmd_yaw_rate = math.radians(yaw_mode.get('yaw_or_rate', 0.0))
+                else:
+                    v.yaw = math.radians(yaw_mode.get('yaw_or_rate', 0.0))
+        return self._finish_after(duration)
+
+    def _move_to(self, vehicle_name, target, speed):
+        with self._lock:
+            self._sync_clock()
+            v = self._vehicle(vehicle_name)
+            v.target = np.array(target, dtype=float)
+            v.target_speed = max(float(speed), 0.1)
+            v.landed = False
+            eta = np.linalg.norm(v.target - v.pos) / v.target_speed + 3 * self.velocity_tau
+        return self._finish_after(eta)
+
+    # ---- connection -------------------------------------------------------
+    def ping(self):
+        return True
+
+    def getServerVersion(self):
+        return 1
+
+    def getMinRequiredClientVersion(self):
+        return 1
+
+    def getSettingsString(self):
+        return '{"SettingsVersion": 1.2, "SimMode": "Multirotor", "ClockSpeed": %s}' % self.clock_speed
+
+    def reset(self):
+        with self._lock:
+            for vehicle in self.vehicles.values():
+                vehicle.reset()
+            self.sim_time = 0.0
+            self._last_wall = time.monotonic()
+
+    def enableApiControl(self, is_enabled, vehicle_name=''):
+        self._vehicle(vehicle_name).api_control = bool(is_enabled)
+
+    def isApiControlEnabled(self, vehicle_name=''):
+        return self._vehicle(vehicle_name).api_control
+
+    def armDisarm(self, arm, vehicle_name=''):
+        self._vehicle(vehicle_name).armed = bool(arm)
+        return True
+
+    def listVehicles(self):
+        return list(self.vehicles)
+
+    def simAddVehicle(self, vehicle_name, vehicle_type, pose, pawn_path=''):
+        vehicle = _Vehicle()
+        position = pose.get('position', {}) if pose else {}
+        vehicle.pos = np.array([position.get('x_val', 0.0), position.get('y_val', 0.0),
+                                position.get('z_val', 0.0)], dtype=float)
+        self.vehicles[vehicle_name] = vehicle
+        return True
+
+    # ---- simulation clock -------------------------------------------------
+    def simPause(self, is_paused):
+        with self._lock:
+            self._sync_clock()
+            self.paused = bool(is_paused)
+
+    def simIsPaused(self):
+        return self.paused
+
+    def simContinueForTime(self, seconds):
+        # Paused simulations are advanced instantly so lockstep runs are not
+        # limited by wall-clock time.
+        with self._lock:
+            self._sync_clock()
+            self._advance(float(seconds))
+            self.paused = True
+
+    def simContinueForFrames(self, frames):
+        self.simContinueForTime(int(frames) * self.frame_period)
+
+    # ---- state ------------------------------------------------------------
+    def _kinematics(self, v):
+        return {
+            'position': _vec(*v.pos),
+            'orientation': _quat_from_yaw(v.yaw),
+            'linear_velocity': _vec(*v.vel),
+            'angular_velocity': _vec(0.0, 0.0, v.yaw_rate),
+            'linear_acceleration': _vec(0.0, 0.0, 0.0),
+            'angular_acceleration': _vec(0.0, 0.0, 0.0),
+        }
+
+    def getMultirotorState(self, vehicle_name=''):
+        with self._lock:
+            self._sync_clock()
+            v = self._vehicle(vehicle_name)
+            return {
+                'kinematics_estimated': self._kinematics(v),
+                'timestamp': int(self.sim_time * NS_PER_SEC),
+                'landed_state': 0 if v.landed else 1,
+                'ready': True,
+                'ready_message': '',
+                'can_arm': True,
+            }
+
+    def simGetGroundTruthKinematics(self, vehicle_name=''):
+        with self._lock:
+            self._sync_clock()
+            return self._kinematics(self._vehicle(vehicle_name))
+
+    def simGetVehiclePose(self, vehicle_name=''):
+        with self._lock:
+            self._sync_clock()
+            v = self._vehicle(vehicle_name)
+            return {'position': _vec(*v.pos), 'orientation': _quat_from_yaw(v.yaw)}
+
+    def simSetVehiclePose(self, pose, ignore_collision, vehicle_name=''):
+        with self._lock:
+            self._sync_clock()
+            v = self._vehicle(vehicle_name)
+            position = pose['position']
+            for i, key in enumerate(('x_val', 'y_val', 'z_val')):
+                if not math.isnan(position[key]):
+                    v.pos[i] = position[key]
+            if not any(math.isnan(val) for val in pose['orientation'].values()):
+                v.yaw = _yaw_from_quat(pose['orientation'])
+            v.target = None
+
+    def simSetKinematics(self, state, ignore_collision, vehicle_name=''):
+        with self._lock:
+            self._sync_clock()
+            v = self._vehicle(vehicle_name)
+            if 'position' in state:
+                p = state['position']
+                v.pos = np.array([p['x_val'], p['y_val'], p['z_val']], dtype=float)
+            if 'orientation' in state:
+                v.yaw = _yaw_from_quat(state['orientation'])
+            if 'linear_velocity' in state:
+                lv = state['linear_velocity']
+                v.vel = np.array([lv['x_val'], lv['y_val'], lv['z_val']], dtype=float)
+            v.cmd_vel = v.vel.copy()
+            v.cmd_until = self.sim_time
+            v.target = None
+
+    def getImuData(self, imu_name='', vehicle_name=''):
+        with self._lock:
+            self._sync_clock()
+            v = self._vehicle(vehicle_name)
+            return {
+                'time_stamp': int(self.sim_time * NS_PER_SEC),
+                'orientation': _quat_from_yaw(v.yaw),
+                'angular_velocity': _vec(0.0, 0.0, v.yaw_rate),
+                'linear_acceleration': _vec(0.0, 0.0, -9.81),
+            }
+
+    def getLidarData(self, lidar_name='', vehicle_name=''):
+        with self._lock:
+            self._sync_clock()
+            v = self._vehicle(vehicle_name)
+            points = np.zeros(1, dtype=np.float32)
+            if hasattr(self.renderer, 'lidar_points'):
+                points = self.renderer.lidar_points(v.pos.copy(), v.yaw).ravel()
+                if points.size == 0:
+                    points = np.zeros(1, dtype=np.float32)
+            return {
+                'point_cloud': points.tobytes() if self.binary_floats else points.tolist(),
+                'time_stamp': int(self.sim_time * NS_PER_SEC),
+                'pose': {'position': _vec(*v.pos), 'orientation': _quat_from_yaw(v.yaw)},
+                'segmentation': [],
+            }
+
+    def simGetCameraInfo(self, camera_name, vehicle_name='', external=False):
+        with self._lock:
+            v = self._vehicle(vehicle_name)
+            return {
+                'pose': {'position': _vec(*v.pos), 'orientation': _quat_from_yaw(v.yaw)},
+                'fov': float(self.renderer.fov_deg),
+                'proj_mat': {'matrix': []},
+            }
+
+    def simSetSegmentationObjectID(self, mesh_name, object_id, is_name_regex=False):
+        with self._lock:
+            if is_name_regex:
+                names = [name for name in self.segmentation_ids if re.fullmatch(mesh_name, name)]
+            else:
+                names = [name for name in self.segmentation_ids if name == mesh_name]
+            for name in names:
+                self.segmentation_ids[name] = int(object_id)
+            return bool(names)
+
+    def simGetSegmentationObjectID(self, mesh_name):
+        return self.segmentation_ids.get(mesh_name, -1)
+
+    # ---- scene ------------------------------------------------------------
+    def _scene_geometry(self):
+        if not hasattr(self.renderer, 'mesh_geometry'):
+            return {}
+        return self.renderer.mesh_geometry()
+
+    def simListSceneObjects(self, name_regex='.*'):
+        return [name for name in self._scene_geometry() if re.fullmatch(name_regex, name)]
+
+    def simGetObjectPose(self, object_name):
+        geometry = self._scene_geometry().get(object_name)
+        if geometry is None:
+            nan = float('nan')
+            return {'position': _vec(nan, nan, nan),
+                    'orientation': {'w_val': nan, 'x_val': nan, 'y_val': nan, 'z_val': nan}}
+        return {'position': _vec(*geometry[0].mean(axis=0)), 'orientation': _quat_from_yaw(0.0)}
+
+    def simGetMeshPositionVertexBuffers(self):
+        # Unreal world frame: centimetres, Z up, player start at the origin
+        to_ue = np.array([100.0, 100.0, -100.0], dtype=np.float32)
+        meshes = []
+        for name, (vertices, indices) in self._scene_geometry().items():
+            meshes.append({
+                'position': _vec(*(vertices.mean(axis=0) * to_ue)),
+                'orientation': _quat_from_yaw(0.0),
+                'vertices': (vertices * to_ue).ravel().tolist(),
+                'indices': indices.tolist(),
+                'name': name,
+            })
+        return meshes
+
+    # ---- images -----------------------------------------------------------
+    def _float_image(self, response, img):
+        response['height'], response['width'] = img.shape[:2]
+        img = np.ascontiguousarray(img, dtype=np.float32)
+        response['image_data_float'] = img.tobytes() if self.binary_floats else img.ravel().tolist()
+        return response
+
+    def _image_response(self, request, v):
+        image_type = request.get('image_type', 0)
+        response = {
+            'image_data_uint8': b'',
+            'image_data_float': [],
+            'camera_position': _vec(*v.pos),
+            'camera_orientation': _quat_from_yaw(v.yaw),
+            'time_stamp': int(self.sim_time * NS_PER_SEC),
+            'message': '',
+            'pixels_as_float': bool(request.get('pixels_as_float', False)),
+            'compress': bool(request.get('compress', True)),
+            'width': 0,
+            'height': 0,
+            'image_type': image_type,
+        }
+        if image_type in (1, 2) and response['pixels_as_float'] and hasattr(self.renderer, 'depth'):
+            depth = self.renderer.depth(v.pos.copy(), v.yaw, perspective=image_type == 2)
+            if self.depth_size:
+                depth = cv2.resize(depth, tuple(self.depth_size), interpolation=cv2.INTER_NEAREST)
+            return self._float_image(response, depth)
+        if image_type == 8 and response['pixels_as_float'] and hasattr(self.renderer, 'flow'):
+            # Like AirSim, the flow covers the last rendered frame
+            prev_pos = v.pos - v.vel * self.frame_period
+            prev_yaw = v.yaw - v.yaw_rate * self.frame_period
+            return self._float_image(response, self.renderer.flow(prev_pos, prev_yaw, v.pos.copy(), v.yaw))
+        if image_type == 5 and not response['pixels_as_float'] and hasattr(self.renderer, 'segmentation'):
+            palette = np.array([segmentation_color(0)] + [
+                segmentation_color(self.segmentation_ids[name]) for name in self.renderer.meshes], dtype=np.uint8)
+            img = palette[self.renderer.segmentation(v.pos.copy(), v.yaw)]
+        elif image_type != 0:
+            response['message'] = f'image type {image_type} not supported by stand-in'
+            return response
+        else:
+            img = self.renderer.render(v.pos.copy(), v.yaw, self.sim_time)
+        if response['compress']:
+            ok, encoded = cv2.imencode('.png', img)
+            response['image_data_uint8'] = encoded.tobytes()
+        else:
+            response['image_data_uint8'] = img.tobytes()
+        response['height'], response['width'] = img.shape[:2]
+        return response
+
+    def simGetImages(self, requests, vehicle_name='', external=False):
+        with self._lock:
+            self._sync_clock()
+            v = self._vehicle(vehicle_name)
+            return [self._image_response(request, v) for request in requests]
+
+    def simGetImage(self, camera_name, image_type, vehicle_name='', external=False):
+        response = self.simGetImages([{'camera_name': camera_name, 'image_type': image_type}], vehicle_name)[0]
+        return response['image_data_uint8'] or b'\0'
+
+    # ---- flight commands --------------------------------------------------
+    def takeoff(self, timeout_sec=20, vehicle_name=''):
+        v = self._vehicle(vehicle_name)
+        return self._move_to(vehicle_name, [v.pos[0], v.pos[1], -3.0], 1.0)
+
+    def land(self, timeout_sec=60, vehicle_name=''):
+        v = self._vehicle(vehicle_name)
+        return self._move_to(vehicle_name, [v.pos[0], v.pos[1], 0.0], 1.0)
+
+    def goHome(self, timeout_sec=3e38, vehicle_name=''):
+        return self._move_to(vehicle_name, [0.0, 0.0, -3.0], 2.0)
+
+    def hover(self, vehicle_name=''):
+        return self._command(vehicle_name, [0, 0, 0], 0.0)
+
+    def cancelLastTask(self, vehicle_name=''):
+        return self.hover(vehicle_name)
+
+    def moveByVelocity(self, vx, vy, vz, duration, drivetrain=0, yaw_mode=None, vehicle_name=''):
+        return self._command(vehicle_name, [vx, vy, vz], duration, yaw_mode)
+
+    def moveByVelocityBodyFrame(self, vx, vy, vz, duration, drivetrain=0, yaw_mode=None, vehicle_name=''):
+        return self._command(vehicle_name, [vx, vy, vz], duration, yaw_mode, body_frame=True)
+
+    def moveByVelocityZ(self, vx, vy, z, duration, drivetrain=0, yaw_mode=None, vehicle_name=''):
+        return self._command(vehicle_name, [vx, vy, 0.0], duration, yaw_mode, z=z)
+
+    def moveByVelocityZBodyFrame(self, vx, vy, z, duration, drivetrain=0, yaw_mode=None, vehicle_name=''):
+        return self._command(vehicle_name, [vx, vy, 0.0], duration, yaw_mode, body_frame=True, z=z)
+
+    def moveToPosition(self, x, y, z, velocity, timeout_sec=3e38, drivetrain=0, yaw_mode=None,
+                       lookahead=-1, adaptive_lookahead=1, vehicle_name=''):
+        return self._move_to(vehicle_name, [x, y, z], velocity)
+
+    def moveToZ(self, z, velocity, timeout_sec=3e38, yaw_mode=None, lookahead=-1,
+                adaptive_lookahead=1, vehicle_name=''):
+        v = self._vehicle(vehicle_name)
+        return self._move_to(vehicle_name, [v.pos[0], v.pos[1], z], velocity)
+
+    def rotateByYawRate(self, yaw_rate, duration, vehicle_name=''):
+        return self._command(vehicle_name, [0, 0, 0], duration, {'is_rate': True, 'yaw_or_rate': yaw_rate})
+
+    def rotateToYaw(self, yaw, timeout_sec=3e38, margin=5, vehicle_name=''):
+        with self._lock:
+            self._vehicle(vehicle_name).yaw = math.radians(yaw)
+        return True
+
+
+class StandInServer(msgpackrpc.Server):
+    """msgpack-rpc server with AirSim-compatible encoding and optional latency."""
+
+    def __init__(self, simulator, latency_ms=0.0, loop=None):
+        super().__init__(simulator, loop=loop, pack_encoding='utf-8', unpack_encoding='utf-8')
+        self.latency_ms = latency_ms
+        simulator.schedule = lambda delay, callback: self._loop._ioloop.call_later(delay, callback)
+
+    def on_request(self, sendable, msgid, method, param):
+        # AirSim sends image buffers as msgpack bin; the stock packer would
+        # send them as str and the client would try to decode them as utf-8.
+        if not getattr(sendable, '_airsim_bin', False):
+            sendable._packer = msgpack.Packer(encoding='utf-8', use_bin_type=True,
+                                              default=lambda x: x.to_msgpack())
+            sendable._airsim_bin = True
+        if self.latency_ms > 0:
+            self._loop._ioloop.call_later(
+                self.latency_ms / 1000.0,
+                lambda: super(StandInServer, self).on_request(sendable, msgid, method, param))
+        else:
+            super().on_request(sendable, msgid, method, param)
+
+
+def serve(simulator, port=41451, latency_ms=0.0):
+    """Create a server listening on ``port``; call ``start()`` to run it."""
+    server = StandInServer(simulator, latency_ms=latency_ms)
+    server.listen(msgpackrpc.Address('127.0.0.1', port))
+    return server
+
+
+def start_background(simulator=None, port=41451, latency_ms=0.0):
+    """Run a stand-in server on a daemon thread and return ``(thread, server)``."""
+    simulator = simulator or StandInSimulator()
+    ready = threading.Event()
+    holder = {}
+
+    def run():
+        # The tornado loop must be created on the thread that runs it
+        holder['server'] = serve(simulator, port, latency_ms)
+        ready.set()
+        holder['server'].start()
+
+    thread = threading.Thread(target=run, name=f"standin-{port}", daemon=True)
+    thread.start()
+    ready.wait()
+    return thread, holder['server']
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Local AirSim stand-in server")
+    parser.add_argument('--port', type=int, default=41451)
+    parser.add_argument('--source', default='synthetic',
+                        help="'synthetic' or the path of a video file to serve frames from")
+    parser.add_argument('--width', type=int, default=640)
+    parser.add_argument('--height', type=int, default=480)
+    parser.add_argument('--latency-ms', type=float, default=0.0,
+                        help="delay added before every RPC is handled")
+    parser.add_argument('--clock-speed', type=float, default=1.0)
+    parser.add_argument('--blocking-commands', action='store_true',
+                        help="only answer motion commands once they have completed")
+    parser.add_argument('--depth-size', help="WxH of depth images (default: scene size)")
+    parser.add_argument('--binary-floats', action='store_true',
+                        help="send float images and point clouds as float32 bytes instead of float lists")
+    args = parser.parse_args(argv)
+
+    if args.source == 'synthetic':
+        renderer = SyntheticRenderer(args.width, args.height)
+    else:
+        renderer = VideoRenderer(args.source, args.width, args.height)
+    depth_size = tuple(int(n) for n in args.depth_size.split('x')) if args.depth_size else None
+    simulator = StandInSimulator(renderer, clock_speed=args.clock_speed,
+                                 blocking_commands=args.blocking_commands,
+                                 depth_size=depth_size, binary_floats=args.binary_floats)
+    server = serve(simulator, args.port, args.latency_ms)
+    print(f"AirSim stand-in listening on 127.0.0.1:{args.port} ({args.source})")
+    try:
+        server.start()
+    except KeyboardInterrupt:
+        server.stop()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,93 @@
+# uav/startup.py
+"""Simulator readiness probe used instead of a fixed sleep after launch.
+
+:func:`wait_for_simulator` polls ``ping`` on short-lived, short-timeout
+clients with exponential backoff until the RPC server answers or a total
+deadline passes.  :func:`warm_up` then issues image requests until the first
+non-empty frame arrives, so the first loop iteration does not pay for
+renderer and RPC warm-up.
+"""
+import logging
+import time
+
+import airsim
+
+from uav.logging import debug_print
+
+
+class SimulatorNotReady(RuntimeError):
+    """The simulator did not become ready before the deadline."""
+
+
+def _ping(ip, port, timeout):
+    client = airsim.VehicleClient(ip, port, timeout_value=timeout)
+    try:
+        return client.ping()
+    finally:
+        client.client.close()
+
+
+def wait_for_simulator(ip="", port=41451, deadline=60.0, probe_timeout=2.0,
+                       min_delay=0.05, max_delay=2.0, process=None):
+    """Block until the simulator answers ``ping``.
+
+    Parameters
+    ----------
+    deadline : float
+        Total seconds to wait before raising :class:`SimulatorNotReady`.
+    probe_timeout : float
+        RPC timeout of each individual probe.
+    min_delay, max_delay : float
+        Backoff between probes starts at ``min_delay`` and doubles up to
+        ``max_delay``.
+    process : subprocess.Popen, optional
+        Simulator process; the probe fails immediately if it exits.
+
+    Returns
+    -------
+    dict
+        ``{'ready_s': seconds until ping succeeded, 'attempts': probes sent}``.
+    """
+    start = time.monotonic()
+    delay = min_delay
+    attempts = 0
+    # Every refused connection is logged by tornado; keep the console quiet
+    tornado_log = logging.getLogger('tornado.general')
+    level = tornado_log.level
+    tornado_log.setLevel(logging.ERROR)
+    try:
+        while True:
+            attempts += 1
+            try:
+                if _ping(ip, port, probe_timeout):
+                    return {'ready_s': time.monotonic() - start, 'attempts': attempts}
+            except Exception as e:
+                debug_print(f"⏳ Simulator not ready (attempt {attempts}): {e}")
+            if process is not None and process.poll() is not None:
+                raise SimulatorNotReady(f"simulator exited with code {process.returncode}")
+            remaining = deadline - (time.monotonic() - start)
+            if remaining <= 0:
+                raise SimulatorNotReady(
+                    f"no response on port {port} after {deadline:.0f}s ({attempts} attempts)")
+            time.sleep(min(delay, remaining))
+            delay = min(delay * 2, max_delay)
+    finally:
+        tornado_log.setLevel(level)
+
+
+def warm_up(client, requests, deadline=30.0, vehicle_name=''):
+    """Request images until a non-empty frame arrives.
+
+    Returns
+    -------
+    tuple
+        ``(responses, seconds)`` for the first successful request.
+    """
+    start = time.monotonic()
+    while True:
+        responses = client.simGetImages(requests, vehicle_name)
+        if responses and responses[0].width > 0 and len(responses[0].image_data_uint8) > 0:
+            return responses, time.monotonic() - start
+        if time.monotonic() - start > deadline:
+            raise SimulatorNotReady(f"no image within {deadline:.0f}s")
+        time.sleep(0.05)
@@ -0,0 +1,213 @@
+# uav/sweep.py
+"""Parallel parameter sweep over recorded sessions.
+
+Every combination of the given parameter values is replayed through
+:func:`uav.replay.replay_session` on every session, spread over a process
+pool.  Workers memory-map the session chunks (see :mod:`uav.framestore`), so
+the frames are read once into the page cache and shared by all workers
+instead of being decoded per process.
+
+Usage::
+
+    python -m uav.sweep flow_logs/session_20250604_204643 \\
+        --threshold 250,350,450 --safe-frames 3,5 --win-size 15,21 --output sweep.csv
+
+Configurations are ranked by decision quality, then by compute cost.
+Quality is the agreement with the state recorded during the flight when the
+session has one, otherwise with the baseline configuration (the module
+defaults).  ``flips`` counts state changes per 100 frames as a measure of
+jitter.
+"""
+import argparse
+import csv
+import itertools
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import cv2
+
+from uav.framestore import FrameStoreReader
+from uav.replay import replay_session
+from sparse_optical_flow_utils import lk_params, shitomasi_params
+
+# Baseline values, matching main.py and sparse_optical_flow_utils.py
+DEFAULTS = {
+    'threshold': 350.0,
+    'safe_frames': 5,
+    'grace_frames': 10,
+    'max_corners': shitomasi_params['maxCorners'],
+    'quality_level': shitomasi_params['qualityLevel'],
+    'win_size': lk_params['winSize'][0],
+    'max_level': lk_params['maxLevel'],
+}
+
+CASTS = {
+    'threshold': float, 'safe_frames': int, 'grace_frames': int,
+    'max_corners': int, 'quality_level': float, 'win_size': int, 'max_level': int,
+}
+
+RESULT_FIELDS = ['rank', 'pareto'] + list(DEFAULTS) + [
+    'quality', 'reference_agreement', 'baseline_agreement', 'flips', 'obstacle_rate',
+    'ms_per_frame', 'frames',
+]
+
+_readers = {}
+
+
+def _init_worker():
+    # One OpenCV thread per worker so ms/frame compares configurations
+    # instead of contention between workers
+    cv2.setNumThreads(1)
+
+
+def grid(values):
+    """Expand ``{name: [values]}`` into a list of full configurations."""
+    names = list(DEFAULTS)
+    axes = [values.get(name) or [DEFAULTS[name]] for name in names]
+    return [dict(zip(names, combo)) for combo in itertools.product(*axes)]
+
+
+def replay_params(config):
+    """Translate a sweep configuration into :func:`replay_session` keyword arguments."""
+    return {
+        'threshold': config['threshold'],
+        'grace_frames': config['grace_frames'],
+        'safe_frames': config['safe_frames'],
+        'feature_params': dict(shitomasi_params, maxCorners=config['max_corners'],
+                               qualityLevel=config['quality_level']),
+        'flow_params': dict(lk_params, winSize=(config['win_size'], config['win_size']),
+                            maxLevel=config['max_level']),
+    }
+
+
+def _run(job):
+    """Worker: replay one session with one configuration."""
+    index, session, config, max_frames = job
+    reader = _readers.get(session)
+    if reader is None:
+        reader = _readers[session] = FrameStoreReader(session)
+    trace, stats = replay_session(reader, max_frames, **replay_params(config))
+    states = [t['state'] for t in trace]
+    references = [t['reference_state'] for t in trace]
+    return index, session, states, references, stats
+
+
+def _agreement(states, others):
+    pairs = [(a, b) for a, b in zip(states, others) if b]
+    if not pairs:
+        return None
+    return sum(1 for a, b in pairs if a == b) / len(pairs)
+
+
+def _flips(states):
+    if len(states) < 2:
+        return 0.0
+    return sum(1 for a, b in zip(states, states[1:]) if a != b) * 100.0 / len(states)
+
+
+def summarize(configs, runs):
+    """Aggregate per-session runs into one row per configuration.
+
+    ``runs`` maps ``(config_index, session)`` to ``(states, references, stats)``;
+    configuration 0 is the baseline.
+    """
+    rows = []
+    sessions = sorted({session for _, session in runs})
+    for index, config in enumerate(configs):
+        ref, base, flips, obstacles, elapsed, frames = [], [], [], 0, 0.0, 0
+        for session in sessions:
+            states, references, stats = runs[(index, session)]
+            baseline_states = runs[(0, session)][0]
+            agreement = _agreement(states, references)
+            if agreement is not None:
+                ref.append(agreement)
+            base.append(_agreement(states, baseline_states) or 0.0)
+            flips.append(_flips(states))
+            obstacles += stats['obstacle_frames']
+            elapsed += stats['elapsed_s']
+            frames += stats['frames']
+        row = dict(config)
+        row['reference_agreement'] = sum(ref) / len(ref) if ref else None
+        row['baseline_agreement'] = sum(base) / len(base) if base else None
+        row['quality'] = row['reference_agreement'] if ref else row['baseline_agreement']
+        row['flips'] = sum(flips) / len(flips) if flips else 0.0
+        row['obstacle_rate'] = obstacles / frames if frames else 0.0
+        row['ms_per_frame'] = elapsed * 1000.0 / frames if frames else 0.0
+        row['frames'] = frames
+        rows.append(row)
+
+    rows.sort(key=lambda r: (-(r['quality'] or 0.0), r['flips'], r['ms_per_frame']))
+    best_quality = -1.0
+    for row in sorted(rows, key=lambda r: r['ms_per_frame']):
+        # Pareto front: nothing cheaper reaches the same quality
+        row['pareto'] = (row['quality'] or 0.0) > best_quality
+        best_quality = max(best_quality, row['quality'] or 0.0)
+    for rank, row in enumerate(rows, start=1):
+        row['rank'] = rank
+    return rows
+
+
+def sweep(sessions, values, workers=None, max_frames=None):
+    """Replay every configuration of ``values`` on every session in parallel."""
+    configs = grid(values)
+    baseline = dict(DEFAULTS)
+    if baseline in configs:
+        configs.remove(baseline)
+    configs.insert(0, baseline)
+    jobs = [(index, session, config, max_frames)
+            for index, config in enumerate(configs) for session in sessions]
+    runs = {}
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker) as pool:
+        for index, session, states, references, stats in pool.map(_run, jobs, chunksize=1):
+            runs[(index, session)] = (states, references, stats)
+    return summarize(configs, runs)
+
+
+def print_table(rows, limit=None):
+    varied = [name for name in DEFAULTS if len({row[name] for row in rows}) > 1]
+    header = f"{'rank':>4} " + "".join(f"{name:>23s}" for name in varied)
+    header += f"{'quality':>9}{'flips':>8}{'obstacle':>10}{'ms/frame':>10}"
+    print(header)
+    for row in rows[:limit]:
+        line = f"{row['rank']:>3}{'*' if row['pareto'] else ' '} "
+        line += "".join(f"{row[name]:>23}" for name in varied)
+        quality = f"{row['quality'] * 100:8.1f}%" if row['quality'] is not None else f"{'-':>9}"
+        line += f"{quality}{row['flips']:8.2f}{row['obstacle_rate'] * 100:9.1f}%{row['ms_per_frame']:10.2f}"
+        print(line)
+    print("* = Pareto optimal: no cheaper configuration reaches the same quality")
+
+
+def write_results(rows, path):
+    with open(path, 'w', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=RESULT_FIELDS)
+        writer.writeheader()
+        writer.writerows(rows)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Sweep detection and tracking parameters over recorded sessions")
+    parser.add_argument('sessions', nargs='+', help="frame-store session directories")
+    for name in DEFAULTS:
+        parser.add_argument('--' + name.replace('_', '-'), metavar='V1,V2,...',
+                            help=f"comma separated values (default {DEFAULTS[name]})")
+    parser.add_argument('--workers', type=int, default=os.cpu_count())
+    parser.add_argument('--max-frames', type=int)
+    parser.add_argument('--top', type=int, help="only print the best N configurations")
+    parser.add_argument('--output', help="write the ranked table to this CSV")
+    args = parser.parse_args(argv)
+
+    values = {}
+    for name, cast in CASTS.items():
+        raw = getattr(args, name)
+        if raw:
+            values[name] = [cast(v) for v in raw.split(',')]
+
+    rows = sweep(args.sessions, values, args.workers, args.max_frames)
+    print_table(rows, args.top)
+    if args.output:
+        write_results(rows, args.output)
+        print(f"Sweep results written to {args.output}")
+
+
+if __name__ == '__main__':
+    main()
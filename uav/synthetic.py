@@ -0,0 +1,140 @@
+# uav/synthetic.py
+"""Procedural frames with known ground-truth optical flow.
+
+A textured background plane moves by a per-frame similarity transform
+(translation, rotation and expansion about a focus point).  An optional
+obstacle patch in front of it expands on its own to mimic an approaching
+object.  Because every motion is an explicit transform, the per-pixel flow
+between consecutive frames is known exactly.
+"""
+import cv2
+import numpy as np
+
+# Named scenarios shared by the benchmark and replay tools
+SCENARIOS = {
+    'translate': dict(translation=(3.0, 0.0)),
+    'loom': dict(expansion=0.02),
+    'rotate': dict(rotation=0.5),
+    'obstacle': dict(translation=(0.5, 0.0), obstacle_expansion=0.05),
+    'noisy': dict(translation=(2.0, 1.0), expansion=0.01, noise=4.0),
+}
+
+
+def make_texture(size=1024, seed=0):
+    """Return a tileable grayscale texture with corners for feature tracking."""
+    rng = np.random.default_rng(seed)
+    noise = rng.random((size, size)).astype(np.float32)
+    texture = cv2.GaussianBlur(noise, (0, 0), 2) * 0.7 + noise * 0.3
+    texture = cv2.normalize(texture, None, 0, 255, cv2.NORM_MINMAX).astype(np.uint8)
+    for _ in range(size // 8):
+        x, y = rng.integers(0, size, 2)
+        w, h = rng.integers(8, 40, 2)
+        cv2.rectangle(texture, (int(x), int(y)), (int(x + w), int(y + h)), int(rng.integers(0, 256)), -1)
+    return texture
+
+
+def similarity(translation=(0.0, 0.0), rotation=0.0, expansion=0.0, center=(0.0, 0.0)):
+    """3x3 transform rotating by ``rotation`` degrees and scaling by ``1 + expansion``
+    about ``center``, followed by ``translation`` pixels."""
+    m = np.eye(3)
+    m[:2] = cv2.getRotationMatrix2D(center, rotation, 1.0 + expansion)
+    m[0, 2] += translation[0]
+    m[1, 2] += translation[1]
+    return m
+
+
+def flow_field(transform, width, height):
+    """Per-pixel displacement ``(H, W, 2)`` produced by a 3x3 affine ``transform``."""
+    xs, ys = np.meshgrid(np.arange(width, dtype=np.float32), np.arange(height, dtype=np.float32))
+    d = transform - np.eye(3)
+    flow = np.empty((height, width, 2), dtype=np.float32)
+    flow[..., 0] = d[0, 0] * xs + d[0, 1] * ys + d[0, 2]
+    flow[..., 1] = d[1, 0] * xs + d[1, 1] * ys + d[1, 2]
+    return flow
+
+
+def generate(width=640, height=480, frames=30, translation=(0.0, 0.0), rotation=0.0,
+             expansion=0.0, focus=None, obstacle_expansion=0.0, obstacle_size=0.2,
+             noise=0.0, seed=0):
+    """Yield ``(image, flow)`` pairs.
+
+    ``image`` is a uint8 grayscale frame and ``flow[y, x]`` is the exact
+    displacement of pixel ``(x, y)`` of this frame in the next one.
+
+    Parameters
+    ----------
+    translation : tuple
+        Background translation in pixels per frame.
+    rotation : float
+        Background rotation about the image centre in degrees per frame.
+    expansion : float
+        Background scale increase per frame about ``focus`` (looming).
+    focus : tuple, optional
+        Focus of expansion, defaults to the image centre.
+    obstacle_expansion : float
+        If non-zero, a textured patch centred on ``focus`` expands at this rate
+        in front of the background.
+    obstacle_size : float
+        Initial obstacle half-width as a fraction of the frame width.
+    noise : float
+        Standard deviation of additive Gaussian pixel noise.
+    """
+    rng = np.random.default_rng(seed + 1)
+    center = (width / 2.0, height / 2.0)
+    focus = center if focus is None else focus
+    background = make_texture(max(width, height) * 2, seed)
+    patch = make_texture(256, seed + 2)
+
+    # Place the texture centre at the image centre
+    bg_size = background.shape[0]
+    bg_pose = similarity(translation=(center[0] - bg_size / 2, center[1] - bg_size / 2))
+    step = similarity(translation, 0.0, expansion, focus) @ similarity(rotation=rotation, center=center)
+    bg_flow = flow_field(step, width, height)
+
+    # Map the obstacle patch onto a square of half-width ``half`` around the focus
+    half = obstacle_size * width
+    scale = 2 * half / patch.shape[0]
+    obs_pose = np.array([[scale, 0.0, focus[0] - half], [0.0, scale, focus[1] - half], [0.0, 0.0, 1.0]])
+    obs_step = similarity(expansion=obstacle_expansion, center=focus)
+    obs_flow = flow_field(obs_step, width, height) if obstacle_expansion else None
+
+    for _ in range(frames):
+        image = cv2.warpAffine(background, bg_pose[:2], (width, height),
+                               flags=cv2.INTER_LINEAR, borderMode=cv2.BORDER_WRAP)
+        flow = bg_flow.copy()
+        if obstacle_expansion:
+            mask = cv2.warpAffine(np.full(patch.shape, 255, np.uint8), obs_pose[:2], (width, height),
+                                  flags=cv2.INTER_NEAREST) > 0
+            warped = cv2.warpAffine(patch, obs_pose[:2], (width, height), flags=cv2.INTER_LINEAR)
+            image[mask] = warped[mask]
+            flow[mask] = obs_flow[mask]
+            obs_pose = obs_step @ obs_pose
+        if noise:
+            noisy = image.astype(np.float32) + rng.normal(0.0, noise, image.shape)
+            image = np.clip(noisy, 0, 255).astype(np.uint8)
+        yield image, flow
+        bg_pose = step @ bg_pose
+
+
+def scenario(name, width=640, height=480, frames=30, seed=0):
+    """Generator for one of the named :data:`SCENARIOS`."""
+    return generate(width, height, frames, seed=seed, **SCENARIOS[name])
+
+
+def sample_flow(flow, pts):
+    """Ground-truth flow at ``(N, 2)`` point coordinates (nearest pixel)."""
+    pts = np.asarray(pts, dtype=np.float32).reshape(-1, 2)
+    h, w = flow.shape[:2]
+    xs = np.clip(np.rint(pts[:, 0]).astype(np.intp), 0, w - 1)
+    ys = np.clip(np.rint(pts[:, 1]).astype(np.intp), 0, h - 1)
+    return flow[ys, xs]
+
+
+def endpoint_error(good_old, good_new, flow):
+    """Per-point endpoint error of tracked ``good_old -> good_new`` against ``flow``."""
+    good_old = np.asarray(good_old, dtype=np.float32).reshape(-1, 2)
+    good_new = np.asarray(good_new, dtype=np.float32).reshape(-1, 2)
+    if len(good_old) == 0:
+        return np.empty(0, dtype=np.float32)
+    return np.linalg.norm((good_new - good_old) - sample_flow(flow, good_old), axis=1)
+
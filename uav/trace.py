@@ -0,0 +1,144 @@
+# uav/trace.py
+"""Lightweight span tracer exporting Chrome trace-event JSON.
+
+Spans are kept in a bounded ring buffer so tracing can stay enabled for a
+whole flight.  The dump can be opened offline in Perfetto
+(https://ui.perfetto.dev) or ``chrome://tracing``.
+"""
+import json
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+# Set TRACE_OUTPUT to a file path to enable tracing of the main loop
+TRACE_OUTPUT = os.environ.get("TRACE_OUTPUT", "")
+
+
+class Tracer:
+    """Record begin/end spans per thread into a ring buffer.
+
+    Parameters
+    ----------
+    capacity : int
+        Maximum number of spans kept.  Older spans are discarded first.
+    enabled : bool
+        When ``False`` every call is a no-op so the tracer can be left in the
+        hot path at negligible cost.
+    """
+
+    def __init__(self, capacity=200000, enabled=True):
+        self.enabled = enabled
+        self.events = deque(maxlen=capacity)
+        self.pid = os.getpid()
+        self._t0 = time.perf_counter()
+        self._thread_names = {}
+
+    def _now_us(self):
+        return (time.perf_counter() - self._t0) * 1e6
+
+    def _record(self, name, cat, start_us, dur_us, args):
+        thread = threading.current_thread()
+        tid = thread.ident
+        if tid not in self._thread_names:
+            self._thread_names[tid] = thread.name
+        # deque.append is atomic so no lock is needed across threads
+        self.events.append((name, cat, start_us, dur_us, tid, args))
+
+    @contextmanager
+    def span(self, name, cat="loop", **args):
+        """Context manager recording the duration of the enclosed block."""
+        if not self.enabled:
+            yield
+            return
+        start = self._now_us()
+        try:
+            yield
+        finally:
+            self._record(name, cat, start, self._now_us() - start, args)
+
+    def instant(self, name, cat="loop", **args):
+        """Record a zero-length marker event."""
+        if self.enabled:
+            self._record(name, cat, self._now_us(), None, args)
+
+    def clear(self):
+        self.events.clear()
+
+    def to_events(self):
+        """Return the buffered spans as a list of trace-event dicts."""
+        events = [
+            {"name": "thread_name", "ph": "M", "pid": self.pid, "tid": tid,
+             "args": {"name": name}}
+            for tid, name in self._thread_names.items()
+        ]
+        for name, cat, ts, dur, tid, args in list(self.events):
+            event = {"name": name, "cat": cat, "ts": ts, "pid": self.pid, "tid": tid}
+            if dur is None:
+                event.update(ph="i", s="t")
+            else:
+                event.update(ph="X", dur=dur)
+            if args:
+                event["args"] = args
+            events.append(event)
+        return events
+
+    def dump(self, path):
+        """Write the buffered spans to ``path`` as Chrome trace-event JSON."""
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(path, "w") as f:
+            json.dump({"traceEvents": self.to_events(), "displayTimeUnit": "ms"}, f)
+
+
+class _TracedFuture:
+    """Wrap an RPC future so that waiting on it is recorded as a span."""
+
+    def __init__(self, future, method, tracer):
+        self._future = future
+        self._method = method
+        self._tracer = tracer
+
+    def join(self):
+        with self._tracer.span(f"{self._method}.join", cat="rpc"):
+            return self._future.join()
+
+    def get(self):
+        with self._tracer.span(f"{self._method}.get", cat="rpc"):
+            return self._future.get()
+
+    def __getattr__(self, name):
+        return getattr(self._future, name)
+
+
+class _TracedRpcClient:
+    """Proxy around ``msgpackrpc.Client`` tracing every call."""
+
+    def __init__(self, rpc, tracer):
+        self._rpc = rpc
+        self._tracer = tracer
+
+    def call(self, method, *args):
+        with self._tracer.span(method, cat="rpc"):
+            return self._rpc.call(method, *args)
+
+    def call_async(self, method, *args):
+        with self._tracer.span(f"{method}.send", cat="rpc"):
+            future = self._rpc.call_async(method, *args)
+        return _TracedFuture(future, method, self._tracer)
+
+    def __getattr__(self, name):
+        return getattr(self._rpc, name)
+
+
+def trace_rpc(client, span_tracer=None):
+    """Record a span for every RPC issued through an AirSim ``client``."""
+    span_tracer = span_tracer or tracer
+    if not isinstance(client.client, _TracedRpcClient):
+        client.client = _TracedRpcClient(client.client, span_tracer)
+    return client
+
+
+tracer = Tracer(enabled=bool(TRACE_OUTPUT))
@@ -0,0 +1,131 @@
+# uav/ttc.py
+"""Focus of expansion and time to contact from tracked feature pairs.
+
+For a camera translating towards a surface every flow vector points away
+from the focus of expansion (FOE).  The FOE is the least-squares
+intersection of the lines through the tracked points along their flow, and
+a point at distance ``r`` from it moving outwards at ``dr`` pixels per frame
+reaches the camera plane in ``r / dr`` frames -- independent of speed and
+scene depth, unlike the raw flow magnitude::
+
+    ttc = TimeToContact(roi, partitions=3)
+    foe, seconds = ttc.estimate(good_old, good_new, dt)
+
+Rotation adds flow that does not come from the FOE, so turns inflate the
+residual and make TTC unreliable until the flow is derotated.
+"""
+import numpy as np
+
+from uav.utils import partition_roi
+
+
+def fit_foe(old, new, min_flow=0.2):
+    """Least-squares focus of expansion of flow vectors ``old -> new``.
+
+    Each vector contributes the constraint ``n . (foe - p) = 0`` with ``p``
+    its midpoint and ``n`` its unnormalised normal, so longer (more
+    reliable) vectors weigh more.  Returns ``(foe, rms)`` with the RMS
+    perpendicular distance in pixels, or ``(None, nan)`` when fewer than two
+    vectors move by ``min_flow`` or they are all parallel.
+    """
+    old = np.asarray(old, dtype=np.float64).reshape(-1, 2)
+    new = np.asarray(new, dtype=np.float64).reshape(-1, 2)
+    d = new - old
+    keep = np.einsum('ij,ij->i', d, d) > min_flow * min_flow
+    if np.count_nonzero(keep) < 2:
+        return None, float('nan')
+    d = d[keep]
+    p = (old[keep] + new[keep]) * 0.5
+    n = np.stack([-d[:, 1], d[:, 0]], axis=1)
+    a = n.T @ n
+    b = n.T @ np.einsum('ij,ij->i', n, p)
+    det = a[0, 0] * a[1, 1] - a[0, 1] * a[1, 0]
+    if det <= 1e-9 * (a[0, 0] + a[1, 1]) ** 2:
+        return None, float('nan')
+    foe = np.array([a[1, 1] * b[0] - a[0, 1] * b[1], a[0, 0] * b[1] - a[1, 0] * b[0]]) / det
+    residual = (n @ foe - np.einsum('ij,ij->i', n, p)) / np.linalg.norm(d, axis=1)
+    return foe, float(np.sqrt(np.mean(residual * residual)))
+
+
+def time_to_contact(old, new, foe):
+    """Per-point time to contact in frames; ``inf`` for points not moving away from ``foe``."""
+    old = np.asarray(old, dtype=np.float64).reshape(-1, 2)
+    new = np.asarray(new, dtype=np.float64).reshape(-1, 2)
+    r = (old + new) * 0.5 - foe
+    rate = np.einsum('ij,ij->i', new - old, r)  # |r| * radial speed
+    with np.errstate(divide='ignore'):
+        return np.where(rate > 0, np.einsum('ij,ij->i', r, r) / rate, np.inf)
+
+
+class TimeToContact:
+    """FOE and smoothed per-partition time to contact.
+
+    Parameters
+    ----------
+    roi : sequence
+        ``(x1, y1, x2, y2)``; points are assigned to partitions by their new
+        position like the flow tracker does.
+    min_flow : float
+        Vectors shorter than this (pixels per frame) are ignored.
+    min_points : int
+        Partitions with fewer points keep their previous estimate.
+    alpha : float
+        Weight of the newest frame when smoothing the expansion rate
+        (``1 / ttc``), which averages cleanly across "no expansion" frames.
+    max_ttc : float
+        Seconds reported when nothing approaches.
+    """
+
+    def __init__(self, roi, partitions=3, min_flow=0.2, min_points=3, alpha=0.5, max_ttc=60.0):
+        self.roi = roi
+        self.partitions = partitions
+        self.min_flow = min_flow
+        self.min_points = min_points
+        self.alpha = alpha
+        self.max_ttc = max_ttc
+        self.edges = np.array([part[2] for part in partition_roi(roi, partitions)[:-1]], dtype=np.float64)
+        self.reset()
+
+    def reset(self):
+        self.rates = np.zeros(self.partitions)
+        self.foe = None
+        self.rms = float('nan')
+
+    def rates_per_frame(self, good_old, good_new):
+        """Median expansion rate (1/frames) of each partition for one frame pair.
+
+        Partitions with fewer than ``min_points`` points are NaN; when the
+        points do not move (no FOE) every rate is 0.
+        """
+        rates = np.full(self.partitions, np.nan)
+        old = np.asarray(good_old, dtype=np.float64).reshape(-1, 2)
+        new = np.asarray(good_new, dtype=np.float64).reshape(-1, 2)
+        x1, y1, x2, y2 = self.roi
+        inside = (new[:, 0] >= x1) & (new[:, 0] <= x2) & (new[:, 1] >= y1) & (new[:, 1] <= y2)
+        if np.count_nonzero(inside) < self.min_points:
+            self.foe, self.rms = None, float('nan')
+            return rates
+        self.foe, self.rms = fit_foe(old[inside], new[inside], self.min_flow)
+        if self.foe is None:
+            return np.zeros(self.partitions)
+        old, new = old[inside], new[inside]
+        inverse = 1.0 / time_to_contact(old, new, self.foe)
+        sector = np.searchsorted(self.edges, new[:, 0], side='right')
+        order = np.argsort(sector, kind='stable')
+        bounds = np.searchsorted(sector[order], np.arange(self.partitions + 1))
+        for p in range(self.partitions):
+            values = inverse[order[bounds[p]:bounds[p + 1]]]
+            if len(values) >= self.min_points:
+                rates[p] = max(float(np.median(values)), 0.0)
+        return rates
+
+    def estimate(self, good_old, good_new, dt):
+        """Update with one frame pair.  Returns ``(foe, ttc_seconds)`` per partition."""
+        if dt > 0:
+            rates = self.rates_per_frame(good_old, good_new) / dt
+            known = ~np.isnan(rates)
+            self.rates[known] = self.alpha * rates[known] + (1.0 - self.alpha) * self.rates[known]
+        with np.errstate(divide='ignore'):
+            ttc = np.minimum(1.0 / self.rates, self.max_ttc)
+        foe = None if self.foe is None else (float(self.foe[0]), float(self.foe[1]))
+        return foe, ttc.tolist()
@@ -14,8 +14,11 @@ def get_yaw(orientation):
 def get_speed(velocity):
     return np.linalg.norm([velocity.x_val, velocity.y_val, velocity.z_val])
 
-def get_drone_state(client):
-    state = client.getMultirotorState()
+def get_drone_state(client, vehicle_name=''):
+    return unpack_state(client.getMultirotorState(vehicle_name=vehicle_name))
+
+def unpack_state(state):
+    """Return ``(pos, yaw, speed, vel)`` of a ``MultirotorState``."""
     pos = state.kinematics_estimated.position
     ori = state.kinematics_estimated.orientation
     yaw = get_yaw(ori)
@@ -49,3 +52,38 @@ def partition_roi(roi, parts):
         partitions.append((px1, y1, px2, y2))
     return partitions
 
+
+def scaled_roi(width, height):
+    """Scale ``main.py``'s ROI for 640x480 to another frame size."""
+    sx, sy = width / 640.0, height / 480.0
+    return [int(60 * sx), int(60 * sy), int(580 * sx), int(420 * sy)]
+
+
+
+class FrameClock:
+    """Inter-frame interval from simulator image timestamps.
+
+    ``tick`` returns the seconds since the previous frame, or ``None`` when
+    the frame carries the same timestamp as the previous one (the simulator
+    has not rendered a new image yet).  Falls back to the wall clock when the
+    simulator does not fill in timestamps.
+    """
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.last_time = None
+        self.duplicates = 0
+
+    def tick(self, time_stamp_ns, wall_time):
+        sim_time = time_stamp_ns / 1e9 if time_stamp_ns else wall_time
+        if self.last_time is None:
+            self.last_time = sim_time
+            return 0.0
+        if time_stamp_ns and sim_time == self.last_time:
+            self.duplicates += 1
+            return None
+        dt = sim_time - self.last_time
+        self.last_time = sim_time
+        return dt